@@ -1,17 +1,3114 @@
+import time
+STARTUP_TIME = time.perf_counter()  # avant les imports lourds : base du rapport de démarrage
+
 import pandas as pd
-import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
-from difflib import get_close_matches
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from difflib import SequenceMatcher, get_close_matches
 import threading
-from tkinter import font as tkfont
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import queue
+import asyncio
+import uuid
+import urllib.error
+import urllib.parse
+import urllib.request
+import heapq
+from collections import Counter, OrderedDict, deque
+import numpy as np
+import sys
+import argparse
+import re
+import itertools
+import sqlite3
+import functools
+import bisect
+import cProfile
+import pstats
+import io
+
+EXCEL_FILE = "BADGES.xlsx"
+DATE_COLUMNS = ['ID_Modify_Time', 'Load_Date', 'Token_Modify_Time',
+                'Issue_Date', 'Activation_Date', 'Deactivation_Date']
+
+# Cache disque Parquet du DataFrame déjà normalisé (à côté du classeur Excel)
+CACHE_VERSION = 3
+CACHE_SUFFIX = ".cache"
+# Erreurs attendues d'un cache : disque, JSON ou Parquet illisible (ArrowInvalid est une ValueError), pyarrow absent
+CACHE_ERRORS = (OSError, ValueError, TypeError, NotImplementedError, ImportError)
+
+# Chargement progressif : premier lot petit, puis lots de taille croissante
+LOAD_FIRST_CHUNK = 500
+LOAD_MAX_CHUNK = 50000
+
+# Liste virtuelle : seules les lignes visibles existent comme items Tk
+VIRTUAL_OVERSCAN = 50
+
+# Champs couverts par l'index de recherche
+NAME_FIELDS = ['Full_Name', 'First_Name', 'Last_Name']
+ID_FIELDS = ['External_System_ID', 'Internal_Number']
+SEARCH_FIELDS = NAME_FIELDS + ID_FIELDS
+
+# Mode mémoire compact (--compact) : colonnes utiles seulement, catégories, noms en minuscules
+COMPACT_COLUMNS = ['Export_UUID', 'External_System_ID', 'Type', 'First_Name', 'Last_Name', 'Address', 'Roles',
+                   'Internal_Number', 'Token_Status', 'Issue_Level', 'Issue_Date', 'Activation_Date',
+                   'Deactivation_Date', 'VIP', 'Site']
+COMPACT_CATEGORIES = ['Token_Status', 'VIP', 'Issue_Level', 'Roles', 'Type', 'Site']
+COMPACT_CATEGORY_RATIO = 0.5
+LOWER_SUFFIX = '_lower'
+
+# Plusieurs sites (--sites) : un classeur par site, fusionnés avec une colonne Site
+SITE_COLUMN = 'Site'
+SITE_SUFFIX = '.xlsx'
+SITE_ALL = "Tous les sites"
+# Badge présent sur plusieurs sites : la version la plus récemment modifiée l'emporte
+SITE_RECENCY_COLUMNS = ['ID_Modify_Time', 'Token_Modify_Time']
+
+# Suggestions approximatives : nombre de candidats départagés par SequenceMatcher
+FUZZY_CANDIDATES = 100
+# Terme plus court : pas de préfiltre par trigrammes, seule la borne par caractères s'applique
+FUZZY_MIN_TERM = 3
+# Caractères regroupés modulo ce nombre pour la borne de quick_ratio (un regroupement ne fait que l'élargir)
+FUZZY_CHAR_BUCKETS = 64
+FUZZY_POSTING_BUDGET = 50000
+FUZZY_CACHE_SIZE = 256
+
+# Cube d'agrégation : comptages par événement, jour et dimensions, conservé avec le cache
+AGGREGATE_EVENTS = {'issued': 'Issue_Date', 'activated': 'Activation_Date', 'deactivated': 'Deactivation_Date'}
+AGGREGATE_DIMENSIONS = ['Token_Status', 'Type', 'VIP', 'Issue_Level']
+CUBE_KEYS = ['event', 'day'] + AGGREGATE_DIMENSIONS
+CUBE_EPOCH = pd.Timestamp(0, tz='UTC')
+
+# Recherche pendant la saisie
+SEARCH_DEBOUNCE_MS = 250
+SEARCH_CACHE_SIZE = 64
+SEARCH_NARROW_LIMIT = 20000
+
+# Fenêtre « expire bientôt » utilisée par les statistiques, les détails et l'assistant
+EXPIRING_DAYS = 30
+
+# Intentions de l'assistant, par ordre de priorité : (nom, motif, mots-clés approchés)
+ASSISTANT_INTENTS = [
+    ('next_page', r"^(suivant|suite|page suivante)\b", ['suivant', 'suite']),
+    ('greeting', r"bonjour|salut", ['bonjour', 'salut']),
+    ('stats', r"statistiques|complet", ['statistiques', 'complet', 'complètes']),
+    ('period_counts', r"créés?\b|crées?\b|émis\b|délivrés?|activés?\b|désactivés?", ['créés', 'émis', 'activés']),
+    # Fenêtre d'échéance : une période à venir avec un verbe d'échéance, ou une date explicite
+    ('expiry_window', r"^(?=.*(?:expir(?:ant|ent|era|eront|ation)|échéance))"
+                      r".*(?:\d+ (prochains? )?jours|prochains? \d+ jours|semaine|mois prochain|prochain mois"
+                      r"|trimestre|année|an prochain)"
+                      r"|(?:avant|après|entre) le \d{1,2}/\d{1,2}/\d{4}", ['trimestre', 'semaine']),
+    ('expired_list', r"liste des badges expirés", ['expirés', 'expiré', 'expires']),
+    ('expiring_month', r"badges? expirant ce mois", ['expirant', 'expirent']),
+    ('vip', r"vip", ['vip']),
+    ('status', r"statut", ['statut', 'status']),
+]
+ASSISTANT_FUZZY_CUTOFF = 0.8
+ASSISTANT_CACHE_SIZE = 128
+ASSISTANT_PAGE_SIZE = 20
+# Intentions paginées : réponse servie par un curseur, jamais mémorisée
+ASSISTANT_PAGED_INTENTS = {'expired_list', 'expiring_month', 'expiry_window', 'next_page'}
+# Mois cités dans les questions (« badges émis en mars 2025 »)
+PERIOD_MONTHS = ['janvier', 'février', 'mars', 'avril', 'mai', 'juin', 'juillet', 'août', 'septembre', 'octobre',
+                 'novembre', 'décembre']
+# Dates citées dans les questions (« avant le 31/12/2026 »)
+ASSISTANT_DATE_PATTERN = r"(\d{1,2})/(\d{1,2})/(\d{4})"
+
+# Onglet Échéances des graphiques : (libellé, jours, pas des barres, format des étiquettes)
+EXPIRY_CHART_WINDOWS = [
+    ("7 prochains jours", 7, 'D', '%d/%m'),
+    ("30 prochains jours", 30, 'D', '%d/%m'),
+    ("3 prochains mois", 91, 'W-MON', '%d/%m'),
+    ("12 prochains mois", 365, 'MS', '%m/%Y'),
+]
+
+# Assistant en lot : questions du rapport de nuit, nom des rapports planifiés, fréquence de vérification
+ASSISTANT_BATCH_QUESTIONS = ["Statistiques complètes", "Liste des badges expirés", "Badges expirant ce mois",
+                             "Nombre de VIP"]
+BATCH_REPORT_PATTERN = "rapport_assistant_{date}.txt"
+BATCH_CHECK_MS = 30000
+
+# File des questions de l'assistant
+ASSISTANT_WORKERS = 1
+ASSISTANT_MAX_PENDING = 20
+
+# Instrumentation (onglet Diagnostics) : bornes des histogrammes de latence et échantillons gardés
+PERF_BUCKETS_MS = [1, 5, 10, 50, 100, 500, 1000, 5000]
+PERF_SAMPLES = 1000
+PERF_REFRESH_MS = 1000
+PERF_PROFILE_LINES = 25
+
+# Fiche détaillée : colonnes lues et nombre de fiches rendues gardées en cache
+DETAILS_FIELDS = ['First_Name', 'Last_Name', 'External_System_ID', 'Internal_Number', 'Address', 'Roles',
+                  'Token_Status', 'VIP', 'Issue_Level', 'Issue_Date', 'Activation_Date', 'Deactivation_Date', 'Site']
+DETAILS_CACHE_SIZE = 512
+
+# Export des résultats
+EXPORT_CHUNK = 50000
+EXPORT_DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+EXPORT_FILETYPES = [("CSV", "*.csv"), ("Parquet", "*.parquet"), ("Excel", "*.xlsx")]
+
+# Colonnes des rapports produits en mode ligne de commande
+# Stockage SQLite (--backend sqlite) : une table indexée à côté du classeur
+SQLITE_SUFFIX = ".sqlite"
+SQLITE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+SQLITE_INDEXES = [('External_System_ID', ''), ('Last_Name', ' COLLATE NOCASE'), ('First_Name', ' COLLATE NOCASE'),
+                  ('Token_Status', ''), ('Deactivation_Date', '')]
+
+# Serveur local (anpp.py serve) et client léger (--server)
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_WORKERS = 4
+SERVER_CACHE_SIZE = 256
+SERVER_PAGE_SIZE = 200
+SERVER_SESSIONS = 64
+SERVER_TIMEOUT = 60
+# Listes servies par /rows?kind=
+SERVER_KINDS = ('expired', 'expiring', 'vip')
+SERVER_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+REPORT_KINDS = ['expired', 'expiring', 'stats', 'memory', 'assistant']
+REPORT_COLUMNS = ['External_System_ID', 'Last_Name', 'First_Name', 'Internal_Number',
+                  'Token_Status', 'Deactivation_Date']
+
+# tkinter n'est importé qu'au lancement de l'interface (voir load_tk) : rapports et serveur s'en passent
+tk = ttk = messagebox = scrolledtext = filedialog = tkfont = None
+
+# matplotlib est importé à la première ouverture d'un graphique (voir load_plotting)
+plt = None
+FigureCanvasTkAgg = None
+
+
+def load_tk():
+    # Renvoie la durée de l'import en secondes (0 si déjà chargé)
+    global tk, ttk, messagebox, scrolledtext, filedialog, tkfont
+    if tk is not None:
+        return 0.0
+    started = time.perf_counter()
+    import tkinter
+    from tkinter import ttk as ttk_module, messagebox as messagebox_module, scrolledtext as scrolledtext_module
+    from tkinter import filedialog as filedialog_module, font as font_module
+    tk, ttk, messagebox, scrolledtext = tkinter, ttk_module, messagebox_module, scrolledtext_module
+    filedialog, tkfont = filedialog_module, font_module
+    return time.perf_counter() - started
+
+
+def load_plotting():
+    # Renvoie la durée de l'import en secondes (0 si déjà chargé)
+    global plt, FigureCanvasTkAgg
+    if plt is not None:
+        return 0.0
+    started = time.perf_counter()
+    import matplotlib.pyplot
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg as canvas_class
+    plt, FigureCanvasTkAgg = matplotlib.pyplot, canvas_class
+    return time.perf_counter() - started
+
+
+class StartupTimer:
+    # Jalons du démarrage, en secondes depuis le lancement du processus
+    def __init__(self, verbose=False, start=STARTUP_TIME):
+        self.verbose = verbose
+        self.start = start
+        self.marks = []
+        self.reported = False
+
+    def mark(self, name, duration=None):
+        if name not in (mark[0] for mark in self.marks):
+            self.marks.append((name, time.perf_counter() - self.start, duration))
+
+    def report(self):
+        lines = ["Démarrage (ms depuis le lancement) :"]
+        for name, elapsed, duration in self.marks:
+            line = f"  {name:<28} {elapsed * 1000:8.0f}"
+            if duration is not None:
+                line += f"   (durée {duration * 1000:.0f})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def finish(self):
+        if self.verbose and not self.reported:
+            self.reported = True
+            print(self.report(), file=sys.stderr)
+
+
+def current_rss():
+    # Mémoire résidente du processus en octets ; None si ni /proc ni psutil ne sont disponibles
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class PerfSpan:
+    # Une opération mesurée : durée, lignes traitées, variation de mémoire résidente
+    def __init__(self, recorder, name, profile=True):
+        self.recorder = recorder
+        self.name = name
+        self.rows = None
+        self.profiler = recorder.start_profile() if profile else None
+        self.rss = current_rss()
+        self.started = time.perf_counter()
+
+    def stop(self, rows=None):
+        elapsed = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.recorder.stop_profile(self.profiler)
+        rss = current_rss()
+        memory = rss - self.rss if rss is not None and self.rss is not None else None
+        self.recorder.record(self.name, elapsed, self.rows if rows is None else rows, memory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class PerfRecorder:
+    # Compteurs par opération (histogramme, derniers échantillons) et capture cProfile optionnelle
+    def __init__(self, buckets=PERF_BUCKETS_MS, samples=PERF_SAMPLES):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.operations = {}
+        self.samples = deque(maxlen=samples)
+        self.profiling = False
+        self.profile_active = False
+        self.profile_stats = None
+
+    def span(self, name, profile=True):
+        return PerfSpan(self, name, profile)
+
+    def record(self, name, seconds, rows=None, memory=None):
+        ms = seconds * 1000
+        with self.lock:
+            op = self.operations.get(name)
+            if op is None:
+                op = self.operations[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'memory': 0,
+                                              'histogram': [0] * (len(self.buckets) + 1),
+                                              'recent': deque(maxlen=self.samples.maxlen)}
+            op['count'] += 1
+            op['total_ms'] += ms
+            op['max_ms'] = max(op['max_ms'], ms)
+            op['rows'] += rows or 0
+            op['memory'] += memory or 0
+            op['histogram'][bisect.bisect_left(self.buckets, ms)] += 1
+            op['recent'].append(ms)
+            self.samples.append({'time': datetime.now().isoformat(timespec='milliseconds'), 'operation': name,
+                                 'ms': round(ms, 3), 'rows': rows, 'memory_delta': memory})
+
+    def summary(self):
+        with self.lock:
+            operations = {name: dict(op, recent=list(op['recent'])) for name, op in self.operations.items()}
+        rows = []
+        for name, op in sorted(operations.items()):
+            recent = np.array(op['recent'])
+            rows.append({
+                'operation': name,
+                'count': op['count'],
+                'mean_ms': round(op['total_ms'] / op['count'], 3),
+                'p50_ms': round(float(np.percentile(recent, 50)), 3),
+                'p95_ms': round(float(np.percentile(recent, 95)), 3),
+                'max_ms': round(op['max_ms'], 3),
+                'rows': op['rows'],
+                'memory_delta': op['memory'],
+                'histogram': op['histogram'],
+            })
+        return rows
+
+    def bucket_labels(self):
+        return [f"≤{bound} ms" for bound in self.buckets] + [f">{self.buckets[-1]} ms"]
+
+    # Un seul profil actif à la fois (cProfile ne supporte pas plusieurs profileurs simultanés)
+    def start_profile(self):
+        with self.lock:
+            if not self.profiling or self.profile_active:
+                return None
+            self.profile_active = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            with self.lock:
+                self.profile_active = False
+            return None
+        return profiler
+
+    def stop_profile(self, profiler):
+        profiler.disable()
+        with self.lock:
+            self.profile_active = False
+            if self.profile_stats is None:
+                self.profile_stats = pstats.Stats(profiler)
+            else:
+                self.profile_stats.add(profiler)
+
+    def profile_report(self, limit=PERF_PROFILE_LINES):
+        with self.lock:
+            if self.profile_stats is None:
+                return ""
+            stream = io.StringIO()
+            self.profile_stats.stream = stream
+            self.profile_stats.sort_stats('cumulative').print_stats(limit)
+        return stream.getvalue()
+
+    def dump(self, path):
+        # CSV : journal des derniers échantillons ; JSON : synthèse, histogrammes et échantillons
+        with self.lock:
+            samples = list(self.samples)
+        if path.lower().endswith('.csv'):
+            log = pd.DataFrame(samples, columns=['time', 'operation', 'ms', 'rows', 'memory_delta'])
+            log.astype({'rows': 'Int64', 'memory_delta': 'Int64'}).to_csv(path, index=False)
+            return
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'buckets_ms': self.buckets,
+            'operations': self.summary(),
+            'samples': samples,
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    def dump_profile(self, path):
+        with self.lock:
+            if self.profile_stats is not None:
+                self.profile_stats.dump_stats(path)
+                return True
+        return False
+
+
+PERF = PerfRecorder()
+
+
+def instrumented(name, rows=None):
+    # Décorateur de méthode : mesure l'appel avec PERF ; rows(self, *args) donne le nombre de lignes
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with PERF.span(name) as span:
+                result = method(self, *args, **kwargs)
+                if rows is not None:
+                    span.rows = rows(self, *args)
+            return result
+        return wrapper
+    return decorate
+
+
+def uniform_text(column, always=False):
+    # Colonne mêlant nombres et texte -> texte, valeurs manquantes conservées ; always : identifiants,
+    # toujours en texte pour que tous les lots d'un chargement aient le même type (entiers sans « .0 »)
+    if not always and (column.dtype != object
+                       or not pd.api.types.infer_dtype(column, skipna=True).startswith('mixed')):
+        return column
+    if pd.api.types.is_float_dtype(column.dtype) and column.dropna().mod(1).eq(0).all():
+        column = column.astype('Int64')
+    elif column.dtype == object:
+        # Entiers devenus flottants dans les lots où la colonne avait des trous
+        # (liste explicite : Series.map referait d'entiers et de None une colonne de flottants)
+        column = pd.Series([int(value) if isinstance(value, float) and value.is_integer() else value
+                            for value in column], index=column.index, dtype=object)
+    return column.astype(str).where(column.notna(), None)
+
+
+def uniform_columns(df):
+    # Types homogènes par colonne : condition d'un cache Parquet (pyarrow refuse int et str mêlés)
+    for col in df.columns:
+        df[col] = uniform_text(df[col], always=col in ID_FIELDS)
+    return df
+
+
+def normalize_badges(df):
+    df.columns = [col.strip().replace(' ', '_') for col in df.columns]
+
+    # Toujours en UTC : une colonne vide d'un classeur de site reste comparable à celles des autres
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce', utc=True)
+
+    # Identifiants saisis tantôt en nombre, tantôt en texte : tout en texte (colonnes Parquet typées)
+    uniform_columns(df)
+
+    df['Full_Name'] = df['First_Name'].str.strip() + ' ' + df['Last_Name'].str.strip()
+    return df
+
+
+def read_badges(path=EXCEL_FILE):
+    return normalize_badges(pd.read_excel(path))
+
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_stat(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def cache_paths(path):
+    base = path + CACHE_SUFFIX
+    return base + ".json", base + ".parquet"
+
+
+def legacy_cache_paths(path):
+    # Caches pickle des versions précédentes : jamais relus, supprimés au prochain enregistrement
+    base = path + CACHE_SUFFIX
+    return base + ".pkl", base + ".cube.pkl"
+
+
+def remove_files(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def drop_cache(path):
+    remove_files(cache_paths(path) + (cube_path(path),) + legacy_cache_paths(path))
+
+
+def replace_file(path, write):
+    # Écrit dans un fichier temporaire du même dossier puis le renomme : un arrêt en cours
+    # d'écriture ne laisse jamais de cache tronqué sous le nom final
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    os.close(fd)
+    try:
+        # write renvoie False pour abandonner (export annulé) : le fichier final reste intact
+        if write(tmp_path) is False:
+            remove_files([tmp_path])
+            return False
+        os.replace(tmp_path, path)
+        return True
+    except BaseException:
+        remove_files([tmp_path])
+        raise
+
+
+def write_json(path, data):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    replace_file(path, write)
+
+
+def read_cache(path):
+    meta_path, parquet_path = cache_paths(path)
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != CACHE_VERSION:
+            return None
+
+        stat = os.stat(path)
+        if meta.get('mtime') != stat.st_mtime_ns or meta.get('size') != stat.st_size:
+            # Le fichier a été touché : on ne garde le cache que si le contenu est identique
+            if meta.get('size') != stat.st_size or meta.get('sha1') != file_digest(path):
+                return None
+            meta['mtime'] = stat.st_mtime_ns
+            write_json(meta_path, meta)
+        return pd.read_parquet(parquet_path)
+    except CACHE_ERRORS:
+        # Cache illisible (JSON invalide, Parquet tronqué, pyarrow absent) : supprimé, le classeur sera relu
+        drop_cache(path)
+        return None
+
+
+def cube_path(path):
+    return path + CACHE_SUFFIX + ".cube.parquet"
+
+
+def read_cube(path):
+    # À appeler après read_cache : le cube partage les métadonnées (et la validité) du cache
+    meta_path = cache_paths(path)[0]
+    if not os.path.exists(meta_path):
+        return None
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('cube'):
+            return pd.read_parquet(cube_path(path))
+    except CACHE_ERRORS:
+        # Cube illisible : il sera recalculé à partir des lignes
+        remove_files([cube_path(path)])
+    return None
+
+
+def write_cube(path, cube):
+    meta_path = cache_paths(path)[0]
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            meta = json.load(f)
+        replace_file(cube_path(path), cube.to_parquet)
+        meta['cube'] = True
+        write_json(meta_path, meta)
+    except CACHE_ERRORS:
+        pass
+
+
+def write_cache(path, df, cube=None):
+    # Cache Parquet seulement (colonnes typées, voir uniform_columns) : best effort, jamais bloquant
+    meta_path, parquet_path = cache_paths(path)
+    try:
+        stat = os.stat(path)
+        meta = {
+            'version': CACHE_VERSION,
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha1': file_digest(path),
+        }
+        replace_file(parquet_path, df.to_parquet)
+        write_json(meta_path, meta)
+    except CACHE_ERRORS:
+        drop_cache(path)
+        return
+    remove_files(legacy_cache_paths(path))
+    if cube is not None:
+        write_cube(path, cube)
+
+
+def load_badges(path=EXCEL_FILE, use_cache=True):
+    if use_cache:
+        df = read_cache(path)
+        if df is not None:
+            return df
+
+    df = read_badges(path)
+    if use_cache:
+        try:
+            write_cache(path, df)
+        except OSError:
+            pass
+    return df
+
+
+def site_workbooks(source=EXCEL_FILE):
+    # Un classeur, un dossier (un classeur par site) ou un motif glob
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '*' + SITE_SUFFIX))
+    elif any(char in source for char in '*?['):
+        paths = glob.glob(source)
+    else:
+        return [source]
+    # Fichiers verrous d'Excel (~$nom.xlsx) ignorés
+    return sorted(path for path in paths if not os.path.basename(path).startswith('~$'))
+
+
+def site_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def workbooks_stat(paths):
+    return tuple(file_stat(path) for path in paths)
+
+
+def with_site(df, path):
+    df[SITE_COLUMN] = site_name(path)
+    return df
+
+
+def load_site(path, use_cache=True):
+    # Point d'entrée des processus de travail : un classeur de site (cache compris)
+    return with_site(load_badges(path, use_cache=use_cache), path)
+
+
+def merge_sites(frames):
+    merged = pd.concat(frames, ignore_index=True)
+    if 'External_System_ID' not in merged.columns:
+        return merged
+    order = [col for col in SITE_RECENCY_COLUMNS if col in merged.columns]
+    ranked = merged.sort_values(order, kind='stable', na_position='first') if order else merged
+    ids = ranked['External_System_ID']
+    duplicate = (ids.notna() & ids.duplicated(keep='last')).to_numpy()
+    return merged.drop(index=ranked.index[duplicate]).reset_index(drop=True)
+
+
+def load_sites(paths, use_cache=True, jobs=None, progress=None, cancelled=None):
+    # Les classeurs en cache sont lus ici, les autres analysés en parallèle (un processus par classeur)
+    frames, pending = {}, []
+    for path in paths:
+        cached = read_cache(path) if use_cache else None
+        if cached is None:
+            pending.append(path)
+        else:
+            frames[path] = with_site(cached, path)
+    if progress is not None:
+        progress(len(frames), len(paths))
+
+    workers = min(jobs or os.cpu_count() or 1, len(pending))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if executor is not None:
+            futures = {executor.submit(load_site, path, use_cache): path for path in pending}
+            results = ((futures[future], future.result()) for future in as_completed(futures))
+        else:
+            results = ((path, load_site(path, use_cache)) for path in pending)
+        for path, df in results:
+            frames[path] = df
+            if progress is not None:
+                progress(len(frames), len(paths))
+            if cancelled is not None and cancelled.is_set():
+                return None
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    return merge_sites([frames[path] for path in paths])
+
+
+def filter_site(df, site):
+    if site is None or SITE_COLUMN not in df.columns:
+        return df
+    return df[(df[SITE_COLUMN] == site).to_numpy()]
+
+
+def site_names(df):
+    if SITE_COLUMN not in df.columns:
+        return []
+    return sorted(str(site) for site in df[SITE_COLUMN].dropna().unique())
+
+
+def mentioned_site(user_msg, sites):
+    # Site cité dans une question de l'assistant (le nom le plus long l'emporte)
+    text = user_msg.lower()
+    for site in sorted(sites, key=len, reverse=True):
+        if re.search(r'\b' + re.escape(site.lower()) + r'\b', text):
+            return site
+    return None
+
+
+def chunk_bounds(total, first_chunk=LOAD_FIRST_CHUNK, max_chunk=LOAD_MAX_CHUNK):
+    start, size = 0, first_chunk
+    while start < total:
+        stop = min(start + size, total)
+        yield start, stop
+        start, size = stop, min(size * 2, max_chunk)
+
+
+def iter_frame_chunks(df, first_chunk=LOAD_FIRST_CHUNK, max_chunk=LOAD_MAX_CHUNK):
+    for start, stop in chunk_bounds(len(df), first_chunk, max_chunk):
+        yield df.iloc[start:stop], stop, len(df)
+
+
+def iter_excel_chunks(path=EXCEL_FILE, first_chunk=LOAD_FIRST_CHUNK, max_chunk=LOAD_MAX_CHUNK):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.active
+        total = max((sheet.max_row or 1) - 1, 0) or None
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(col) if col is not None else '' for col in next(rows, ())]
+
+        batch, start, size = [], 0, first_chunk
+        width = len(header)
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            if len(row) < width:
+                # Cellules vides de fin de ligne absentes de certains fichiers (sans dimensions)
+                row = row + (None,) * (width - len(row))
+            batch.append(row)
+            if len(batch) >= size:
+                yield _excel_chunk(batch, header, start), start + len(batch), total
+                start += len(batch)
+                batch, size = [], min(size * 2, max_chunk)
+        if batch:
+            yield _excel_chunk(batch, header, start), start + len(batch), total
+    finally:
+        workbook.close()
+
+
+def _excel_chunk(rows, header, start):
+    chunk = pd.DataFrame(rows, columns=header, index=pd.RangeIndex(start, start + len(rows))).infer_objects()
+
+    # Colonnes vides dans ce lot : même type que pd.read_excel (float) sauf les noms
+    for col in chunk.columns:
+        if chunk[col].dtype == object and chunk[col].isna().all() and col not in ('First Name', 'Last Name'):
+            chunk[col] = chunk[col].astype('float64')
+    return normalize_badges(chunk)
+
+
+def arrow_strings(column):
+    try:
+        return column.astype('string[pyarrow]')
+    except ImportError:
+        return column
+
+
+def search_column(df, field):
+    # Valeurs en minuscules d'un champ de recherche ; précalculées en mode compact, None si absent
+    lower = field + LOWER_SUFFIX
+    if lower in df.columns:
+        return df[lower].dropna()
+    if field not in df.columns:
+        return None
+    column = df[field].dropna()
+    if field in ID_FIELDS:
+        column = column.astype(str)
+    return column.str.lower()
+
+
+def compact_badges(df):
+    # Copie réduite : Full_Name n'est gardé qu'en minuscules, les textes répétitifs deviennent des catégories
+    compact = df[[col for col in COMPACT_COLUMNS if col in df.columns]].copy()
+    for col in compact.columns:
+        if col in COMPACT_CATEGORIES:
+            compact[col] = compact[col].astype('category')
+        elif compact[col].dtype.kind == 'O' or pd.api.types.is_string_dtype(compact[col].dtype):
+            values = compact[col].astype(object).where(compact[col].notna(), None)
+            if compact[col].nunique() < COMPACT_CATEGORY_RATIO * len(compact):
+                compact[col] = values.astype('category')
+            else:
+                compact[col] = arrow_strings(values.map(lambda value: value if value is None else str(value)))
+    for field in NAME_FIELDS:
+        lower = field + LOWER_SUFFIX
+        if lower in df.columns:
+            compact[lower] = df[lower]
+        elif field in df.columns:
+            compact[lower] = arrow_strings(df[field].str.lower())
+    return compact
+
+
+def frame_memory(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def memory_saving(before, after):
+    return f"mémoire {before / 2**20:.1f} Mo → {after / 2**20:.1f} Mo (÷{before / max(after, 1):.1f})"
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    # Index inversé de trigrammes sur les valeurs distinctes (noms et identifiants)
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value_ids = {}
+        self.texts = []
+        self.grams = {}
+        self.rows = {field: {} for field in SEARCH_FIELDS}
+        self.version = 0
+
+    def normalized(self, df, field):
+        return search_column(df, field)
+
+    def value_id(self, text):
+        vid = self.value_ids.get(text)
+        if vid is None:
+            vid = len(self.texts)
+            self.value_ids[text] = vid
+            self.texts.append(text)
+            for gram in trigrams(text):
+                self.grams.setdefault(gram, set()).add(vid)
+        return vid
+
+    def add(self, df):
+        with self.lock:
+            for field in SEARCH_FIELDS:
+                column = self.normalized(df, field)
+                if column is None:
+                    continue
+                rows = self.rows[field]
+                for text, labels in self._groups(column):
+                    rows.setdefault(self.value_id(text), set()).update(labels)
+            self.version += 1
+
+    def remove(self, df):
+        with self.lock:
+            for field in SEARCH_FIELDS:
+                column = self.normalized(df, field)
+                if column is None:
+                    continue
+                rows = self.rows[field]
+                for text, labels in self._groups(column):
+                    vid = self.value_ids.get(text)
+                    if vid in rows:
+                        rows[vid].difference_update(labels)
+                        if not rows[vid]:
+                            del rows[vid]
+            self.version += 1
+
+    @staticmethod
+    def _groups(column):
+        return column.groupby(column.values, sort=False).groups.items()
+
+    def matching_values(self, term):
+        if len(term) < 3:
+            return {vid for vid, text in enumerate(self.texts) if term in text}
+
+        postings = []
+        for gram in trigrams(term):
+            posting = self.grams.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return {vid for vid in candidates if term in self.texts[vid]}
+
+    def rows_for(self, vids, fields):
+        labels = set()
+        for field in fields:
+            rows = self.rows[field]
+            for vid in vids:
+                labels.update(rows.get(vid, ()))
+        return labels
+
+    def search(self, term, swapped=True):
+        term = term.lower().strip()
+        with self.lock:
+            labels = self.rows_for(self.matching_values(term), SEARCH_FIELDS)
+
+            # Prénom + nom dans les deux ordres
+            if not labels and swapped and ' ' in term:
+                parts = term.split()
+                if len(parts) == 2:
+                    first = [self.rows_for(self.matching_values(part), ['First_Name']) for part in parts]
+                    last = [self.rows_for(self.matching_values(part), ['Last_Name']) for part in parts]
+                    labels = (first[0] & last[1]) | (first[1] & last[0])
+            return labels
+
+
+def char_matrix(names):
+    # Occurrences de chaque caractère par nom : borne vectorisée de SequenceMatcher.quick_ratio
+    lengths = np.fromiter(map(len, names), dtype=np.int64, count=len(names))
+    matrix = np.zeros((len(names), FUZZY_CHAR_BUCKETS), dtype=np.uint8)
+    codes = np.frombuffer(''.join(names).encode('utf-32-le'), dtype=np.uint32) % FUZZY_CHAR_BUCKETS
+    np.add.at(matrix, (np.repeat(np.arange(len(names)), lengths), codes), 1)
+    return matrix, lengths
+
+
+class FuzzyIndex:
+    # Suggestions de noms : préfiltrage par trigrammes, score difflib des meilleurs candidats, puis
+    # borne par caractères communs pour ne manquer aucun nom que get_close_matches retiendrait
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.name_ids = {}
+        self.names = []
+        self.name_grams = []
+        self.counts = []
+        self.grams = {}
+        self.chars, self.lengths = char_matrix([])
+        self.cache = OrderedDict()
+        self.version = 0
+
+    @staticmethod
+    def padded_grams(text):
+        return trigrams(f"  {text} ")
+
+    def _update(self, df, sign):
+        with self.lock:
+            first_new = len(self.names)
+            for field in NAME_FIELDS:
+                column = search_column(df, field)
+                if column is None:
+                    continue
+                for name, count in column.value_counts(sort=False).items():
+                    nid = self.name_ids.get(name)
+                    if nid is None:
+                        if sign < 0:
+                            continue
+                        nid = len(self.names)
+                        self.name_ids[name] = nid
+                        self.names.append(name)
+                        self.counts.append(0)
+                        grams = self.padded_grams(name)
+                        self.name_grams.append(len(grams))
+                        for gram in grams:
+                            self.grams.setdefault(gram, []).append(nid)
+                    self.counts[nid] += sign * count
+            if len(self.names) > first_new:
+                chars, lengths = char_matrix(self.names[first_new:])
+                self.chars = np.concatenate([self.chars, chars])
+                self.lengths = np.concatenate([self.lengths, lengths])
+            self.cache.clear()
+            self.version += 1
+
+    def add(self, df):
+        self._update(df, 1)
+
+    def remove(self, df):
+        self._update(df, -1)
+
+    def score(self, term, nids, cutoff):
+        matcher = SequenceMatcher()
+        matcher.set_seq2(term)
+        scored = []
+        for nid in nids:
+            matcher.set_seq1(self.names[nid])
+            if matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff:
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    scored.append((ratio, self.names[nid]))
+        return scored
+
+    def suggestions(self, term, n=3, cutoff=0.6):
+        key = (term, n, cutoff)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+            # Trigrammes les plus rares d'abord, avec un budget borné de postings
+            term_grams = self.padded_grams(term)
+            postings = sorted((self.grams.get(gram, []) for gram in term_grams), key=len)
+            shared, budget = Counter(), FUZZY_POSTING_BUDGET
+            for posting in postings:
+                if budget <= 0:
+                    break
+                shared.update(posting)
+                budget -= len(posting)
+
+            candidates = heapq.nlargest(
+                FUZZY_CANDIDATES,
+                (nid for nid in shared if self.counts[nid] > 0),
+                key=lambda nid: 2 * shared[nid] / (len(term_grams) + self.name_grams[nid]))
+
+            if len(term) < FUZZY_MIN_TERM:
+                candidates = []
+            scored = self.score(term, candidates, cutoff)
+
+            # Parcours complet borné : un nom hors préfiltre n'est comparé que si ses caractères communs
+            # avec le terme lui permettent encore d'entrer dans les n meilleurs (égalités comprises)
+            best = heapq.nlargest(n, scored)
+            threshold = best[-1][0] if len(best) == n else cutoff
+            term_chars, _ = char_matrix([term])
+            bound = 2 * np.minimum(self.chars, term_chars).sum(axis=1) / np.maximum(self.lengths + len(term), 1)
+            seen = set(candidates)
+            rest = [nid for nid in np.flatnonzero((bound >= threshold) & (np.asarray(self.counts) > 0))
+                    if nid not in seen]
+            scored += self.score(term, rest, threshold)
+            result = [name for _, name in heapq.nlargest(n, scored)]
+
+            self.cache[key] = result
+            if len(self.cache) > FUZZY_CACHE_SIZE:
+                self.cache.popitem(last=False)
+            return result
+
+
+def narrow_labels(df, labels, term, index):
+    # Filtre un résultat précédent (terme plus court) au lieu de repartir de tout le DataFrame
+    subset = select_labels(df, labels)
+    mask = pd.Series(False, index=subset.index)
+    for field in SEARCH_FIELDS:
+        text = index.normalized(subset, field)
+        if text is not None:
+            mask |= text.str.contains(term, regex=False).reindex(subset.index, fill_value=False).astype(bool)
+    return set(subset.index[mask.to_numpy()])
+
+
+def select_labels(df, labels):
+    # Sous-ensemble du DataFrame dans l'ordre d'origine, sans balayer les colonnes
+    keys = np.fromiter(labels, dtype=np.int64, count=len(labels))
+    positions = df.index.get_indexer(keys)
+    positions = np.sort(positions[positions >= 0])
+    return df.iloc[positions]
+
+
+def compute_status_masks(df, today):
+    # Expirés : date de désactivation passée
+    if 'Deactivation_Date' in df.columns:
+        days_left = (df['Deactivation_Date'] - today).dt.days
+        expired_mask = (days_left < 0).to_numpy()
+    else:
+        days_left = None
+        expired_mask = np.zeros(len(df), dtype=bool)
+
+    # Actifs : Token_Status = 1 et pas expiré ; inactifs : tout le reste
+    status = df['Token_Status'].to_numpy() if 'Token_Status' in df.columns else np.zeros(len(df))
+    active_mask = (status == 1) & ~expired_mask
+    inactive_mask = ~active_mask
+
+    return active_mask, inactive_mask, expired_mask, days_left
+
+
+STATE_VERSIONS = itertools.count(1)
+
+
+def utc_day():
+    # Jour courant (UTC) : les statuts expiré / expirant en dépendent
+    return datetime.now(pytz.utc).date()
+
+
+def expiry_bounds(today, days=EXPIRING_DAYS):
+    # Fenêtre d'échéance [début, fin) : n jours à partir d'aujourd'hui (comme days_left entre 0 et n),
+    # ou bornes explicites (None = ouverte)
+    if isinstance(days, tuple):
+        return days
+    return today, today + timedelta(days=days + 1)
+
+
+def expiry_stamp(value):
+    return pd.Timestamp(value).as_unit('ns').value
+
+
+class ExpiryIndex:
+    # Échéances triées (ns UTC) : comptage d'une fenêtre en O(log n), ses lignes en O(log n + k)
+    def __init__(self, dates):
+        dates = pd.DatetimeIndex(pd.to_datetime(dates, errors='coerce', utc=True)).as_unit('ns')
+        stamps = dates.asi8
+        valid = np.flatnonzero(~dates.isna())
+        self.order = valid[np.argsort(stamps[valid], kind='stable')]
+        self.stamps = stamps[self.order]
+
+    def bounds(self, start, stop):
+        lo = 0 if start is None else int(np.searchsorted(self.stamps, expiry_stamp(start)))
+        hi = len(self.stamps) if stop is None else int(np.searchsorted(self.stamps, expiry_stamp(stop)))
+        return lo, max(lo, hi)
+
+    def count(self, start, stop):
+        lo, hi = self.bounds(start, stop)
+        return hi - lo
+
+    def positions(self, start, stop):
+        # Positions dans le DataFrame, remises dans l'ordre d'origine
+        lo, hi = self.bounds(start, stop)
+        return np.sort(self.order[lo:hi])
+
+    def counts(self, edges):
+        # Comptages par fenêtre glissante [edges[i], edges[i+1]) en une seule recherche ;
+        # bornes ouvertes (None) : début ou fin de l'index, comme bounds
+        positions = np.searchsorted(self.stamps, [expiry_stamp(edge) for edge in edges])
+        if edges[-1] is None:
+            positions[-1] = len(self.stamps)
+        return np.diff(positions)
+
+
+class BadgeState:
+    # Masques de statut calculés une fois par chargement et par jour ; échéances dans un index trié
+    def __init__(self, df):
+        self.df = df
+        self.calendar = ExpiryIndex(df['Deactivation_Date']) if 'Deactivation_Date' in df.columns else None
+        self.compute()
+
+    def compute(self):
+        self.version = next(STATE_VERSIONS)
+        self.today = datetime.now(pytz.utc)
+        self.day = self.today.date()
+        self.total = len(self.df)
+        self.has_expiry = self.calendar is not None
+        self.positions = {}
+
+        # Mêmes règles que compute_status_masks, sans recalculer les jours restants de chaque ligne
+        self.expired = np.zeros(self.total, dtype=bool)
+        self.expired[self.kind_positions('expired')] = True
+        status = self.df['Token_Status'].to_numpy() if 'Token_Status' in self.df.columns else np.zeros(self.total)
+        self.active = (status == 1) & ~self.expired
+        self.inactive = ~self.active
+
+        self.active_count = int(self.active.sum())
+        self.inactive_count = self.total - self.active_count
+        self.expired_count = self.count('expired')
+        self.expiring_count = self.count('expiring')
+        self.has_vip = 'VIP' in self.df.columns
+        self.vip = (self.df['VIP'] == 1).to_numpy() if self.has_vip else None
+        self.vip_count = int(self.vip.sum()) if self.vip is not None else 0
+
+    def current(self):
+        if utc_day() != self.day:
+            self.compute()
+        return self
+
+    def bounds(self, kind, days=EXPIRING_DAYS):
+        if kind == 'expired':
+            return None, self.today
+        return expiry_bounds(self.today, days)
+
+    # Interface commune aux sources de données (voir SQLiteState) : kind = active / expired / expiring / vip ;
+    # days = nombre de jours ou bornes (début, fin) de la fenêtre d'échéance
+    def mask(self, kind, days=EXPIRING_DAYS):
+        if kind == 'vip' and self.vip is not None:
+            return self.vip
+        mask = np.zeros(self.total, dtype=bool)
+        mask[self.kind_positions(kind, days)] = True
+        return mask
+
+    def count(self, kind, days=EXPIRING_DAYS):
+        if kind in ('expired', 'expiring') and self.has_expiry:
+            return self.calendar.count(*self.bounds(kind, days))
+        return len(self.kind_positions(kind, days))
+
+    def kind_positions(self, kind, days=EXPIRING_DAYS):
+        positions = self.positions.get((kind, days))
+        if positions is None:
+            if kind in ('expired', 'expiring') and self.has_expiry:
+                positions = self.calendar.positions(*self.bounds(kind, days))
+            elif kind == 'vip' and self.vip is not None:
+                positions = np.flatnonzero(self.vip)
+            elif kind == 'active':
+                positions = np.flatnonzero(self.active)
+            else:
+                positions = np.array([], dtype=np.int64)
+            self.positions[(kind, days)] = positions
+        return positions
+
+    def expiry_counts(self, edges):
+        if not self.has_expiry:
+            return np.zeros(len(edges) - 1, dtype=np.int64)
+        return self.calendar.counts(edges)
+
+    def rows(self, kind, start, stop, days=EXPIRING_DAYS):
+        return self.df.iloc[self.kind_positions(kind, days)[start:stop]]
+
+    def select(self, kind, days=EXPIRING_DAYS):
+        return self.df.iloc[self.kind_positions(kind, days)]
+
+
+def sqlite_path(path=EXCEL_FILE):
+    return os.path.splitext(path)[0] + SQLITE_SUFFIX
+
+
+def to_sqlite_rows(chunk):
+    # Dates en texte UTC triable, identifiants mixtes (nombres / texte) en texte
+    rows = chunk.copy()
+    for col in DATE_COLUMNS:
+        if col in rows.columns:
+            rows[col] = rows[col].dt.strftime(SQLITE_DATE_FORMAT)
+    for col in ID_FIELDS:
+        if col in rows.columns:
+            rows[col] = rows[col].astype(object).where(rows[col].isna(), rows[col].astype(str))
+    return rows
+
+
+def from_sqlite_rows(rows):
+    for col in DATE_COLUMNS:
+        if col in rows.columns:
+            rows[col] = pd.to_datetime(rows[col], format=SQLITE_DATE_FORMAT, utc=True)
+    rows.index.name = None
+    return rows
+
+
+def sqlite_time(value):
+    stamp = pd.Timestamp(value)
+    if stamp.tzinfo is not None:
+        stamp = stamp.tz_convert('UTC')
+    return stamp.strftime(SQLITE_DATE_FORMAT)
+
+
+def like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+class SQLiteStore:
+    # Classeur importé dans une table SQLite indexée ; une connexion par thread
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.fuzzy = FuzzyIndex()
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = sqlite3.connect(self.db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def query(self, sql, params=()):
+        return self.connection().execute(sql, params).fetchall()
+
+    def frame(self, sql, params=()):
+        return from_sqlite_rows(pd.read_sql_query(sql, self.connection(), params=params, index_col='label'))
+
+    def meta(self):
+        try:
+            return dict(self.query("SELECT key, value FROM meta"))
+        except sqlite3.OperationalError:
+            return {}
+
+    @property
+    def version(self):
+        return int(self.meta().get('version', 0))
+
+    @property
+    def columns(self):
+        return [row[1] for row in self.query("PRAGMA table_info(badges)") if row[1] != 'label']
+
+    def is_current(self, path):
+        meta = self.meta()
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return bool(meta)
+        if meta.get('mtime') == str(stat.st_mtime_ns) and meta.get('size') == str(stat.st_size):
+            return True
+        return meta.get('size') == str(stat.st_size) and meta.get('sha1') == file_digest(path)
+
+    def import_workbook(self, path, progress=None, cancelled=None):
+        # Import par lots dans une table de travail, puis bascule atomique et création des index
+        conn = self.connection()
+        conn.execute("DROP TABLE IF EXISTS badges_import")
+        columns, done = None, 0
+        for chunk, done, total in iter_excel_chunks(path):
+            if cancelled is not None and cancelled.is_set():
+                conn.execute("DROP TABLE IF EXISTS badges_import")
+                return None
+            rows = to_sqlite_rows(chunk)
+            if columns is None:
+                columns = list(rows.columns)
+                definitions = ", ".join(f'"{col}"' + (' TEXT' if col in DATE_COLUMNS else '') for col in columns)
+                conn.execute(f"CREATE TABLE badges_import (label INTEGER PRIMARY KEY, {definitions})")
+            rows.to_sql('badges_import', conn, if_exists='append', index=True, index_label='label')
+            if progress is not None:
+                progress(done, total)
+        if columns is None:
+            raise ValueError("Le classeur ne contient aucune ligne")
+
+        stat = os.stat(path)
+        meta = {'version': self.version + 1, 'source': os.path.abspath(path), 'mtime': stat.st_mtime_ns,
+                'size': stat.st_size, 'sha1': file_digest(path)}
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("BEGIN")
+        try:
+            conn.execute("DROP TABLE IF EXISTS badges")
+            conn.execute("ALTER TABLE badges_import RENAME TO badges")
+            for column, collate in SQLITE_INDEXES:
+                if column in columns:
+                    conn.execute(f'CREATE INDEX "ix_badges_{column}" ON badges ("{column}"{collate})')
+            conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)", [(k, str(v)) for k, v in meta.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return done
+
+    def loader(self, path):
+        return SQLiteImporter(self, path)
+
+    def state(self, view):
+        return SQLiteState(view)
+
+    def load_names(self):
+        fields = [f'"{field}"' for field in NAME_FIELDS if field in self.columns]
+        self.fuzzy = FuzzyIndex()
+        if fields:
+            self.fuzzy.add(self.frame(f"SELECT label, {', '.join(fields)} FROM badges"))
+
+    def view(self):
+        return SQLiteView(self)
+
+    # Agrégats des graphiques (même interface que BadgeAggregates)
+    def monthly_series(self):
+        if 'Issue_Date' not in self.columns:
+            return pd.Series(dtype='int64')
+        rows = self.query('SELECT substr("Issue_Date", 1, 7), COUNT(*) FROM badges '
+                          'WHERE "Issue_Date" IS NOT NULL GROUP BY 1 ORDER BY 1')
+        if not rows:
+            return pd.Series(dtype='int64')
+        counts = pd.Series([count for _, count in rows],
+                           index=pd.to_datetime([month for month, _ in rows], format='%Y-%m'))
+        return counts.asfreq('MS', fill_value=0)
+
+    def period_count(self, event, start, stop, **filters):
+        column = AGGREGATE_EVENTS[event]
+        if column not in self.columns or any(col not in self.columns for col in filters):
+            return 0
+        where = f'"{column}" >= ? AND "{column}" < ?' + "".join(f' AND "{col}" = ?' for col in filters)
+        params = (sqlite_time(start), sqlite_time(stop)) + tuple(filters.values())
+        return self.query(f"SELECT COUNT(*) FROM badges WHERE {where}", params)[0][0]
+
+    def type_counts(self):
+        if 'Type' not in self.columns:
+            return pd.Series(dtype='int64')
+        rows = self.query('SELECT "Type", COUNT(*) FROM badges WHERE "Type" IS NOT NULL '
+                          'GROUP BY 1 ORDER BY 2 DESC')
+        return pd.Series(dict(rows), dtype='int64')
+
+
+class SQLiteRows:
+    # Accès .iloc (tranches de positions) et .loc (étiquette) d'une SQLiteView
+    def __init__(self, view, positional):
+        self.view = view
+        self.positional = positional
+
+    def __getitem__(self, key):
+        if self.positional:
+            start, stop, _ = key.indices(len(self.view))
+            return self.view.fetch(start, stop)
+        rows = self.view.fetch_label(int(key))
+        if rows.empty:
+            raise KeyError(key)
+        return rows.iloc[0]
+
+
+class SQLiteView:
+    # Sélection paresseuse : seules les tranches affichées ou exportées sont lues
+    def __init__(self, store, where='1', params=()):
+        self.store = store
+        self.where = where
+        self.params = tuple(params)
+        self.columns = pd.Index(store.columns)
+        self.length = None
+        self.iloc = SQLiteRows(self, True)
+        self.loc = SQLiteRows(self, False)
+
+    def __len__(self):
+        if self.length is None:
+            self.length = self.store.query(f"SELECT COUNT(*) FROM badges WHERE {self.where}", self.params)[0][0]
+        return self.length
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def fetch(self, start, stop):
+        return self.store.frame(f"SELECT * FROM badges WHERE {self.where} ORDER BY label LIMIT ? OFFSET ?",
+                                self.params + (max(stop - start, 0), start))
+
+    def fetch_label(self, label):
+        return self.store.frame(f"SELECT * FROM badges WHERE ({self.where}) AND label = ?", self.params + (label,))
+
+    def filter(self, where, params=()):
+        return SQLiteView(self.store, f"({self.where}) AND ({where})", self.params + tuple(params))
+
+    def search(self, term, swapped=True):
+        # Même logique que SearchIndex.search : sous-chaîne dans les noms / identifiants, puis prénom + nom
+        term = term.lower().strip()
+        fields = [field for field in SEARCH_FIELDS if field in self.columns]
+        like = " LIKE ? ESCAPE '\\'"
+        pattern = like_pattern(term)
+        result = self.filter(" OR ".join(f'"{field}"' + like for field in fields), [pattern] * len(fields))
+
+        parts = term.split()
+        if (swapped and len(result) == 0 and len(parts) == 2
+                and 'First_Name' in self.columns and 'Last_Name' in self.columns):
+            first, last = like_pattern(parts[0]), like_pattern(parts[1])
+            pair = f'("First_Name"{like} AND "Last_Name"{like})'
+            result = self.filter(f"{pair} OR {pair}", [first, last, last, first])
+        return result
+
+
+class SQLiteState:
+    # Même interface que BadgeState ; comptages et listes calculés par des requêtes indexées
+    def __init__(self, df):
+        self.df = df
+        self.store = df.store
+        self.compute()
+
+    def compute(self):
+        self.version = next(STATE_VERSIONS)
+        self.data_version = self.store.version
+        self.today = datetime.now(pytz.utc)
+        self.day = self.today.date()
+        self.now = self.today.strftime(SQLITE_DATE_FORMAT)
+        self.has_expiry = 'Deactivation_Date' in self.df.columns
+        self.has_vip = 'VIP' in self.df.columns
+        self.counts = {}
+
+        # Tous les compteurs en un seul passage sur la table
+        kinds = ['active', 'expired', 'expiring', 'vip']
+        clauses = [self.condition(kind) for kind in kinds]
+        sums = ", ".join(f"COALESCE(SUM({where}), 0)" for where, _ in clauses)
+        params = tuple(param for _, values in clauses for param in values)
+        total, *counts = self.store.query(f"SELECT COUNT(*), {sums} FROM badges", params)[0]
+        self.counts.update({(kind, EXPIRING_DAYS): count for kind, count in zip(kinds, counts)})
+
+        self.total = total
+        self.active_count = self.counts[('active', EXPIRING_DAYS)]
+        self.inactive_count = total - self.active_count
+        self.expired_count = self.counts[('expired', EXPIRING_DAYS)]
+        self.expiring_count = self.counts[('expiring', EXPIRING_DAYS)]
+        self.vip_count = self.counts[('vip', EXPIRING_DAYS)]
+
+    def current(self):
+        if utc_day() != self.day or self.store.version != self.data_version:
+            self.compute()
+        return self
+
+    def condition(self, kind, days=EXPIRING_DAYS):
+        # Mêmes règles que compute_status_masks, exprimées sur les dates texte UTC
+        if kind == 'active' and 'Token_Status' in self.df.columns:
+            if not self.has_expiry:
+                return '"Token_Status" = 1', ()
+            return '"Token_Status" = 1 AND ("Deactivation_Date" IS NULL OR "Deactivation_Date" >= ?)', (self.now,)
+        if kind == 'expired' and self.has_expiry:
+            return '"Deactivation_Date" < ?', (self.now,)
+        if kind == 'expiring' and self.has_expiry:
+            return self.window(*expiry_bounds(self.today, days))
+        if kind == 'vip' and self.has_vip:
+            return '"VIP" = 1', ()
+        return '0', ()
+
+    def window(self, start, stop):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append('"Deactivation_Date" >= ?')
+            params.append(sqlite_time(start))
+        if stop is not None:
+            clauses.append('"Deactivation_Date" < ?')
+            params.append(sqlite_time(stop))
+        return " AND ".join(clauses) or '"Deactivation_Date" IS NOT NULL', tuple(params)
+
+    def view(self, kind, days=EXPIRING_DAYS):
+        return self.df.filter(*self.condition(kind, days))
+
+    def expiry_counts(self, edges):
+        # Une requête indexée par fenêtre
+        if not self.has_expiry:
+            return np.zeros(len(edges) - 1, dtype=np.int64)
+        return np.array([len(self.df.filter(*self.window(start, stop))) for start, stop in zip(edges, edges[1:])])
+
+    def count(self, kind, days=EXPIRING_DAYS):
+        count = self.counts.get((kind, days))
+        if count is None:
+            count = self.counts[(kind, days)] = len(self.view(kind, days))
+        return count
+
+    def rows(self, kind, start, stop, days=EXPIRING_DAYS):
+        return self.view(kind, days).fetch(start, stop)
+
+    def select(self, kind, days=EXPIRING_DAYS):
+        return self.view(kind, days).fetch(0, self.count(kind, days))
+
+
+def badge_keys(df):
+    # Clé de rapprochement : External_System_ID, sinon l'UUID d'export
+    keys = df['External_System_ID'].astype(str)
+    if 'Export_UUID' in df.columns:
+        keys = keys.where(df['External_System_ID'].notna(), 'uuid:' + df['Export_UUID'].astype(str))
+    return keys
+
+
+def diff_badges(old, new):
+    # None si un rapprochement ligne à ligne est impossible (schéma différent, clés en double)
+    if list(old.columns) != list(new.columns):
+        return None
+    old_keys, new_keys = badge_keys(old), badge_keys(new)
+    if old_keys.duplicated().any() or new_keys.duplicated().any():
+        return None
+
+    old_labels = pd.Series(old.index, index=old_keys.to_numpy())
+    new_labels = pd.Series(new.index, index=new_keys.to_numpy())
+    common = old_labels.index.intersection(new_labels.index)
+
+    deleted = old.loc[old_labels.drop(common).to_numpy()]
+    inserted = new.loc[new_labels.drop(common).to_numpy()]
+
+    before = old.loc[old_labels[common].to_numpy()]
+    after = new.loc[new_labels[common].to_numpy()]
+    left, right = before.reset_index(drop=True), after.reset_index(drop=True)
+    # Catégories propres à chaque chargement (mode compact) : comparaison sur les valeurs
+    categorical = {col: object for col in left.columns if isinstance(left[col].dtype, pd.CategoricalDtype)}
+    left, right = left.astype(categorical), right.astype(categorical)
+    changed = ((left != right) & ~(left.isna() & right.isna())).any(axis=1).to_numpy()
+
+    updated_old = before[changed]
+    updated_new = after[changed].set_axis(updated_old.index)
+    return inserted, updated_old, updated_new, deleted
+
+
+def apply_badge_changes(df, inserted, updated_old, updated_new, deleted):
+    # Les lignes modifiées gardent leur label, les nouvelles sont ajoutées à la fin
+    start = int(df.index.max()) + 1 if len(df) else 0
+    inserted = inserted.set_axis(pd.RangeIndex(start, start + len(inserted)))
+    rest = df.drop(index=deleted.index.union(updated_old.index))
+    return pd.concat([rest, updated_new, inserted]).sort_index(), inserted
+
+
+class BadgeRefresher(threading.Thread):
+    # Relit le classeur modifié et calcule les insertions / mises à jour / suppressions
+    def __init__(self, df, index, fuzzy, aggregates, path=EXCEL_FILE, compact=False):
+        super().__init__(daemon=True)
+        self.df = df
+        self.index = index
+        self.fuzzy = fuzzy
+        self.aggregates = aggregates
+        self.path = path
+        self.compact = compact
+        self.messages = queue.Queue()
+
+    def run(self):
+        try:
+            stat = file_stat(self.path)
+            full = new = read_badges(self.path)
+            if self.compact:
+                new = compact_badges(full)
+            changes = diff_badges(self.df, new)
+            if changes is None:
+                self.messages.put(('reload',))
+                return
+
+            inserted, updated_old, updated_new, deleted = changes
+            merged, inserted = apply_badge_changes(self.df, *changes)
+            if self.compact:
+                merged = compact_badges(merged)
+
+            for target in (self.index, self.fuzzy, self.aggregates):
+                target.remove(pd.concat([updated_old, deleted]))
+                target.add(pd.concat([updated_new, inserted]))
+
+            try:
+                # Le cache garde toutes les colonnes, même en mode compact
+                write_cache(self.path, full if self.compact else merged, self.aggregates.cube)
+            except OSError:
+                pass
+            self.messages.put(('changes', merged, stat, len(inserted), len(updated_new), len(deleted)))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+
+def day_numbers(dates):
+    # Jours depuis 1970 (UTC), <NA> pour les dates manquantes
+    dates = pd.to_datetime(dates, errors='coerce', utc=True)
+    return (dates - CUBE_EPOCH).dt.days.astype('Int64')
+
+
+def day_number(value):
+    return int(day_numbers(pd.Series([value])).iloc[0])
+
+
+def cube_counts(df):
+    # Comptages d'un lot par (événement, jour, dimensions) ; dimensions absentes = valeur manquante
+    frames = []
+    for event, column in AGGREGATE_EVENTS.items():
+        if column not in df.columns:
+            continue
+        keys = pd.DataFrame({'event': event, 'day': day_numbers(df[column])}, index=df.index)
+        for col in AGGREGATE_DIMENSIONS:
+            keys[col] = df[col].astype(object) if col in df.columns else None
+        frames.append(keys.groupby(CUBE_KEYS, dropna=False, sort=False).size().rename('count').reset_index())
+    if not frames:
+        return pd.DataFrame(columns=CUBE_KEYS + ['count'])
+    return pd.concat(frames, ignore_index=True)
+
+
+class BadgeAggregates:
+    # Cube d'agrégation (émissions, activations, désactivations par jour et par dimension),
+    # mis à jour par lots ajoutés / retirés ; graphiques et assistant ne relisent jamais le DataFrame
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cube = pd.DataFrame(columns=CUBE_KEYS + ['count'])
+        self.version = 0
+
+    def _update(self, df, sign):
+        delta = cube_counts(df)
+        delta['count'] *= sign
+        with self.lock:
+            if len(self.cube):
+                merged = pd.concat([self.cube, delta], ignore_index=True)
+                delta = merged.groupby(CUBE_KEYS, dropna=False, sort=False)['count'].sum().reset_index()
+            self.cube = delta[delta['count'] != 0].reset_index(drop=True)
+            self.version += 1
+
+    def add(self, df):
+        self._update(df, 1)
+
+    def remove(self, df):
+        self._update(df, -1)
+
+    def load(self, cube):
+        with self.lock:
+            self.cube = cube
+            self.version += 1
+
+    def select(self, event, **filters):
+        with self.lock:
+            cube = self.cube
+        mask = (cube['event'] == event).to_numpy().copy()
+        for col, value in filters.items():
+            mask &= (cube[col] == value).to_numpy()
+        return cube[mask]
+
+    def series(self, event='issued', freq='MS', **filters):
+        # Série complète (périodes vides à 0) par jour 'D', mois 'MS' ou année 'YS'
+        rows = self.select(event, **filters).dropna(subset=['day'])
+        if rows.empty:
+            return pd.Series(dtype='int64')
+        days = pd.to_datetime(rows['day'].astype('int64').to_numpy(), unit='D')
+        counts = pd.Series(rows['count'].astype('int64').to_numpy(), index=days).groupby(level=0).sum()
+        return counts.resample(freq).sum()
+
+    def period_count(self, event, start, stop, **filters):
+        # Badges dont la date de l'événement tombe dans [start, stop)
+        rows = self.select(event, **filters).dropna(subset=['day'])
+        days = rows['day'].astype('int64').to_numpy()
+        inside = (days >= day_number(start)) & (days < day_number(stop))
+        return int(rows['count'].to_numpy()[inside].sum())
+
+    def monthly_series(self):
+        return self.series('issued', 'MS')
+
+    def type_counts(self):
+        counts = self.select('issued').groupby('Type')['count'].sum()
+        return counts[counts > 0].sort_values(ascending=False, kind='stable').astype('int64')
+
+
+def pie_label(count, total):
+    percent = 100 * count / total if total else 0
+    return f"{percent:.1f}%\n({count})"
+
+
+def update_pie(wedges, autotexts, counts, texts=None, startangle=90, pctdistance=0.6, labeldistance=1.1):
+    # Même géométrie que Axes.pie, appliquée aux artistes existants
+    total = sum(counts)
+    theta1 = startangle
+    for position, (wedge, autotext, count) in enumerate(zip(wedges, autotexts, counts)):
+        theta2 = theta1 + 360 * count / total
+        wedge.set_theta1(theta1)
+        wedge.set_theta2(theta2)
+        middle = np.deg2rad((theta1 + theta2) / 2)
+        x, y = np.cos(middle), np.sin(middle)
+        autotext.set_position((pctdistance * x, pctdistance * y))
+        autotext.set_text(pie_label(count, total))
+        if texts:
+            texts[position].set_position((labeldistance * x, labeldistance * y))
+            texts[position].set_horizontalalignment('left' if x > 0 else 'right')
+        theta1 = theta2
+
+
+def update_bars(ax, bars, labels, heights):
+    for bar, label, height in zip(bars, labels, heights):
+        bar.set_height(height)
+        label.set_position((bar.get_x() + bar.get_width() / 2., height))
+        label.set_text(f"{int(height)}")
+    ax.relim()
+    ax.autoscale_view()
+
+
+def badge_names(rows):
+    first = rows['First_Name'].fillna('').astype(str) if 'First_Name' in rows.columns else ''
+    last = rows['Last_Name'].fillna('').astype(str) if 'Last_Name' in rows.columns else ''
+    return (first + ' ' + last).str.strip()
+
+
+def format_badge_lines(rows, verb):
+    # Une ligne par badge, construite colonne par colonne
+    names = badge_names(rows)
+    dates = rows['Deactivation_Date'].dt.strftime('%d/%m/%Y').fillna('N/A')
+    return "".join(("- " + names + f" ({verb} le " + dates + ")\n").tolist())
+
+
+def message_dates(text):
+    dates = []
+    for day, month, year in re.findall(ASSISTANT_DATE_PATTERN, text):
+        try:
+            dates.append(pd.Timestamp(int(year), int(month), int(day), tz='UTC'))
+        except ValueError:
+            pass
+    return dates
+
+
+def parse_expiry_window(user_msg, today):
+    # Fenêtre d'échéance citée dans une question : ((début, fin), libellé) ou None
+    text = user_msg.lower()
+    dates = message_dates(text)
+    day = pd.Timestamp(today).normalize()
+    one_day = pd.Timedelta(days=1)
+    if 'entre' in text and len(dates) >= 2:
+        first, last = sorted(dates[:2])
+        return (first, last + one_day), f"entre le {first:%d/%m/%Y} et le {last:%d/%m/%Y}"
+    if 'avant' in text and dates:
+        return (None, dates[0]), f"avant le {dates[0]:%d/%m/%Y}"
+    if 'après' in text and dates:
+        return (dates[0] + one_day, None), f"après le {dates[0]:%d/%m/%Y}"
+
+    match = re.search(r"(\d+) (?:prochains? )?jours|prochains? (\d+) jours", text)
+    if match:
+        days = int(match.group(1) or match.group(2))
+        return expiry_bounds(today, days), f"dans les {days} prochains jours"
+
+    monday = day + pd.Timedelta(days=7 - day.weekday())
+    month = day.replace(day=1)
+    quarter = month - pd.DateOffset(months=(month.month - 1) % 3)
+    year = month.replace(month=1)
+    if 'semaine prochaine' in text or 'prochaine semaine' in text:
+        return (monday, monday + pd.Timedelta(days=7)), "la semaine prochaine"
+    if 'semaine' in text:
+        return (today, monday), "cette semaine"
+    if 'mois prochain' in text or 'prochain mois' in text:
+        return (month + pd.DateOffset(months=1), month + pd.DateOffset(months=2)), "le mois prochain"
+    if 'trimestre prochain' in text or 'prochain trimestre' in text:
+        return (quarter + pd.DateOffset(months=3), quarter + pd.DateOffset(months=6)), "le trimestre prochain"
+    if 'trimestre' in text:
+        return (today, quarter + pd.DateOffset(months=3)), "ce trimestre"
+    if 'année prochaine' in text or 'an prochain' in text:
+        return (year + pd.DateOffset(years=1), year + pd.DateOffset(years=2)), "l'année prochaine"
+    if 'année' in text:
+        return (today, year + pd.DateOffset(years=1)), "cette année"
+    return None
+
+
+def parse_period(user_msg, today):
+    # Période écoulée citée dans une question (« ce mois », « en mars 2025 ») : ((début, fin), libellé),
+    # None si aucune période n'est reconnue
+    text = user_msg.lower()
+    day = pd.Timestamp(today).normalize()
+    tomorrow = day + pd.Timedelta(days=1)
+    one_day = pd.Timedelta(days=1)
+    dates = message_dates(text)
+    if 'entre' in text and len(dates) >= 2:
+        first, last = sorted(dates[:2])
+        return (first, last + one_day), f"entre le {first:%d/%m/%Y} et le {last:%d/%m/%Y}"
+    if 'depuis' in text and dates:
+        return (dates[0], tomorrow), f"depuis le {dates[0]:%d/%m/%Y}"
+    if dates:
+        return (dates[0], dates[0] + one_day), f"le {dates[0]:%d/%m/%Y}"
+    if "aujourd'hui" in text:
+        return (day, tomorrow), "aujourd'hui"
+    if 'hier' in text:
+        return (day - one_day, day), "hier"
+    monday = day - pd.Timedelta(days=day.weekday())
+    month = day.replace(day=1)
+    year = month.replace(month=1)
+    if 'semaine dernière' in text:
+        return (monday - pd.Timedelta(days=7), monday), "la semaine dernière"
+    if 'semaine' in text:
+        return (monday, tomorrow), "cette semaine"
+    if 'mois dernier' in text:
+        return (month - pd.DateOffset(months=1), month), "le mois dernier"
+    if 'ce mois' in text:
+        return (month, tomorrow), "ce mois"
+    if 'année dernière' in text or 'an dernier' in text:
+        return (year - pd.DateOffset(years=1), year), "l'année dernière"
+
+    # Mois nommé (« en mars », « mars 2025 ») : sans année, le dernier mois de ce nom déjà commencé
+    match = re.search(r"\b(" + "|".join(PERIOD_MONTHS) + r")\b(?:\s+(\d{4}))?", text)
+    if match:
+        number = PERIOD_MONTHS.index(match.group(1)) + 1
+        start = year.replace(month=number)
+        if match.group(2):
+            start = start.replace(year=int(match.group(2)))
+        elif start > day:
+            start -= pd.DateOffset(years=1)
+        return (start, start + pd.DateOffset(months=1)), f"en {match.group(1)} {start.year}"
+    match = re.search(r"\b(\d{4})\b", text)
+    if match:
+        start = year.replace(year=int(match.group(1)))
+        return (start, start + pd.DateOffset(years=1)), f"en {start.year}"
+    if 'année' in text or ' an ' in f" {text} ":
+        return (year, tomorrow), "cette année"
+    return None
+
+
+def read_questions(path):
+    # Une question par ligne ; lignes vides et commentaires (#) ignorés
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def parse_clock(text):
+    hour, minute = (int(part) for part in text.split(':'))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(text)
+    return hour, minute
+
+
+def next_run(at, now):
+    # Prochaine occurrence de l'heure (locale) at = (heure, minute) strictement après now
+    hour, minute = at
+    when = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return when if when > now else when + timedelta(days=1)
+
+
+def format_batch_report(results, title):
+    lines = [title, "=" * len(title), ""]
+    for question, _, answer in results:
+        lines += [f"■ {question}", answer.rstrip(), ""]
+    return "\n".join(lines)
+
+
+def write_batch_report(results, path, title):
+    # .json : liste {question, intent, answer} ; sinon texte consolidé
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() == '.json':
+            json.dump([{'question': question, 'intent': intent, 'answer': answer}
+                       for question, intent, answer in results], f, ensure_ascii=False, indent=2)
+        else:
+            f.write(format_batch_report(results, title))
+
+
+def batch_title(now=None):
+    return f"Rapport de l'assistant ANP - {(now or datetime.now()):%d/%m/%Y %H:%M}"
+
+
+def expiry_edges(today, days, step):
+    # Bornes des barres de l'onglet Échéances, d'aujourd'hui minuit à + days jours
+    start = pd.Timestamp(today).normalize()
+    stop = start + pd.Timedelta(days=days)
+    edges = pd.date_range(start, stop, freq=step)
+    if not len(edges) or edges[0] != start:
+        edges = edges.insert(0, start)
+    if edges[-1] != stop:
+        edges = edges.append(pd.DatetimeIndex([stop]))
+    return edges
+
+
+class AnswerCursor:
+    # Curseur sur une liste de badges déjà sélectionnée ; chaque next() produit une page
+    def __init__(self, state, kind, title, verb, days=EXPIRING_DAYS, page_size=ASSISTANT_PAGE_SIZE):
+        self.version = state.version
+        self.state = state
+        self.kind = kind
+        self.days = days
+        self.total = state.count(kind, days)
+        self.title = title
+        self.verb = verb
+        # page_size=None : liste complète en une page (rapports en lot)
+        self.page_size = page_size or max(self.total, 1)
+        self.pages = self.iter_pages()
+
+    def iter_pages(self):
+        total = self.total
+        for start in range(0, total, self.page_size):
+            stop = min(start + self.page_size, total)
+            rows = self.state.rows(self.kind, start, stop, self.days)
+            if start == 0:
+                header = f"{total} {self.title} :\n"
+            else:
+                header = f"{self.title.capitalize()} {start + 1} à {stop} sur {total} :\n"
+            footer = ""
+            if stop < total:
+                footer = f"...et {total - stop} autres. Tapez « suivant » pour la page suivante."
+            yield header + format_badge_lines(rows, self.verb) + footer
+
+
+class AssistantEngine:
+    # Routage des questions par intention ; chaque réponse est mémorisée par (intention, données, jour)
+    def __init__(self, intents=ASSISTANT_INTENTS, page_size=ASSISTANT_PAGE_SIZE):
+        self.page_size = page_size
+        self.intents = [(name, re.compile(pattern)) for name, pattern, _ in intents]
+        self.keywords = {keyword: name for name, _, keywords in intents for keyword in keywords}
+        self.priority = {name: position for position, (name, _, _) in enumerate(intents)}
+        self.handlers = {
+            'next_page': self.next_page,
+            'greeting': self.greeting,
+            'stats': self.stats,
+            'expired_list': self.expired_list,
+            'expiring_month': self.expiring_month,
+            'vip': self.vip,
+            'status': self.status,
+        }
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cursor = None
+
+    def route(self, user_msg):
+        user_msg = user_msg.lower().strip()
+        for name, pattern in self.intents:
+            if pattern.search(user_msg):
+                return name
+
+        # Fautes de frappe : rapprochement approché mot par mot
+        matched = set()
+        for word in re.findall(r"\w+", user_msg):
+            close = get_close_matches(word, self.keywords, n=1, cutoff=ASSISTANT_FUZZY_CUTOFF)
+            if close:
+                matched.add(self.keywords[close[0]])
+        return min(matched, key=self.priority.get, default=None)
+
+    def answer(self, state, user_msg, aggregates=None):
+        try:
+            intent = self.route(user_msg)
+            if intent is None:
+                return self.fallback()
+
+            if intent == 'expiry_window':
+                return self.expiry_window(state.current(), user_msg)
+            if intent == 'period_counts':
+                return self.period_counts(state.current(), aggregates, user_msg)
+            if intent in ASSISTANT_PAGED_INTENTS:
+                return self.handlers[intent](state.current())
+
+            key = (intent, state.version, state.current().day)
+            with self.lock:
+                if key in self.cache:
+                    self.cache.move_to_end(key)
+                    return self.cache[key]
+
+            response = self.handlers[intent](state)
+            with self.lock:
+                self.cache[key] = response
+                if len(self.cache) > ASSISTANT_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+            return response
+        except Exception as e:
+            return f"Désolé, une erreur est survenue : {str(e)}"
+
+    def answer_batch(self, state, questions, aggregates=None):
+        # Toutes les questions sur le même état (masques et positions déjà calculés) ;
+        # une question répétée n'est évaluée qu'une fois
+        state = state.current()
+        answers = {}
+        for question in questions:
+            if question not in answers:
+                answers[question] = (self.route(question), self.answer(state, question, aggregates))
+        return [(question,) + answers[question] for question in questions]
+
+    def greeting(self, state):
+        return (
+            f"Bonjour !\n"
+            f"- Badges actifs : {state.active_count}\n"
+            f"- Inactifs : {state.inactive_count}\n"
+            f"- Total : {state.total}"
+        )
+
+    def stats(self, state):
+        response = (f"Statistiques globales :\n- Total : {state.total}\n- Actifs : {state.active_count}\n"
+                    f"- Inactifs : {state.inactive_count}\n")
+        if state.has_vip:
+            response += f"- VIP : {state.vip_count}\n"
+        if state.has_expiry:
+            response += f"- Expirés : {state.expired_count}\n"
+            response += f"- Expirant dans 30 jours : {state.expiring_count}"
+        return response
+
+    def badge_list(self, state, kind, title, verb, days=EXPIRING_DAYS):
+        cursor = AnswerCursor(state, kind, title, verb, days, self.page_size)
+        with self.lock:
+            self.cursor = cursor
+        return next(cursor.pages)
+
+    def next_page(self, state):
+        with self.lock:
+            cursor = self.cursor
+        if cursor is None:
+            return "Aucune liste en cours. Demandez par exemple « Liste des badges expirés »."
+        if cursor.version != state.version:
+            return "Les données ont changé depuis cette liste. Veuillez reposer la question."
+        with self.lock:
+            page = next(cursor.pages, None)
+        if page is None:
+            return "Fin de la liste."
+        return page
+
+    def expired_list(self, state):
+        if not state.has_expiry:
+            return "Les données ne contiennent pas les dates d'expiration."
+        if state.expired_count == 0:
+            return "Aucun badge n'est expiré pour le moment."
+        return self.badge_list(state, 'expired', "badge(s) expirés", "expiré")
+
+    def expiring_month(self, state):
+        if not state.has_expiry:
+            return "Les données ne contiennent pas les dates d'expiration."
+        if state.expiring_count == 0:
+            return "Aucun badge n'expire ce mois."
+        return self.badge_list(state, 'expiring', "badge(s) expirent ce mois", "expire")
+
+    def expiry_window(self, state, user_msg):
+        if not state.has_expiry:
+            return "Les données ne contiennent pas les dates d'expiration."
+        window = parse_expiry_window(user_msg, state.today)
+        if window is None:
+            return ("Précisez la période, par exemple « badges expirant dans les 7 prochains jours », "
+                    "« le trimestre prochain » ou « avant le 31/12/2026 ».")
+        bounds, label = window
+        if state.count('expiring', bounds) == 0:
+            return f"Aucun badge n'expire {label}."
+        # Fenêtre entièrement passée : badges déjà expirés
+        past = bounds[1] is not None and pd.Timestamp(bounds[1]) <= pd.Timestamp(state.today)
+        verb = "expiré" if past else "expire"
+        return self.badge_list(state, 'expiring', f"badge(s) expirant {label}", verb, bounds)
+
+    def period_counts(self, state, aggregates, user_msg):
+        # Réponse lue dans le cube d'agrégation, sans parcourir les badges
+        if aggregates is None:
+            return "Les comptages par période ne sont pas disponibles pour ces données."
+        text = user_msg.lower()
+        if 'désactiv' in text:
+            event, verb = 'deactivated', "désactivé(s)"
+        elif 'activ' in text:
+            event, verb = 'activated', "activé(s)"
+        else:
+            event, verb = 'issued', "émis"
+        period = parse_period(user_msg, state.today)
+        if period is None:
+            return ("Je n'ai pas reconnu la période. Précisez par exemple « ce mois », « la semaine dernière », "
+                    "« en 2023 » ou « en mars 2025 ».")
+        (start, stop), label = period
+        response = f"{aggregates.period_count(event, start, stop)} badge(s) {verb} {label}"
+        if state.has_vip:
+            response += f", dont {aggregates.period_count(event, start, stop, VIP=1)} VIP"
+        return response + "."
+
+    def vip(self, state):
+        if not state.has_vip:
+            return "La colonne VIP est absente des données."
+        shown = state.rows('vip', 0, 5)
+        status = np.where(compute_status_masks(shown, state.today)[0], "Actif", "Inactif")
+        response = f"Nombre total de VIP : {state.vip_count}\n"
+        return response + "".join(f"- {name} ({label})\n" for name, label in zip(badge_names(shown), status))
+
+    def status(self, state):
+        response = f"- Actifs : {state.active_count}\n- Inactifs : {state.inactive_count}"
+        if state.has_expiry:
+            response += f"\n- Expirés : {state.expired_count}\n- Expirant dans 30 jours : {state.expiring_count}"
+        return response
+
+    def fallback(self):
+        return (
+            "Je ne comprends pas votre demande. Essayez par exemple :\n"
+            "- 'Liste des badges expirés'\n"
+            "- 'Badges expirant ce mois'\n"
+            "- 'Badges expirant le trimestre prochain'\n"
+            "- 'Combien de badges créés ce mois ?'\n"
+            "- 'Nombre de VIP'\n"
+            "- 'Statistiques complètes'"
+        )
+
+
+class AssistantDispatcher:
+    # Exécuteur borné : questions identiques en attente fusionnées, réponses livrées dans l'ordre
+    def __init__(self, answer, deliver, workers=ASSISTANT_WORKERS, max_pending=ASSISTANT_MAX_PENDING,
+                 coalesce=None):
+        self.answer = answer
+        self.deliver = deliver
+        self.coalesce = coalesce or (lambda user_msg: True)
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="assistant")
+        self.lock = threading.Lock()
+        self.running = {}
+        self.tickets = deque()
+        self.latencies = deque(maxlen=100)
+
+    def submit(self, user_msg):
+        key = user_msg.lower().strip()
+        with self.lock:
+            if len(self.tickets) >= self.max_pending:
+                return False
+            future = self.running.get(key) if self.coalesce(user_msg) else None
+            if future is None:
+                future = self.executor.submit(self.answer, user_msg)
+                self.running[key] = future
+            self.tickets.append((future, time.perf_counter()))
+        future.add_done_callback(lambda f: self.completed(key, f))
+        return True
+
+    def completed(self, key, future):
+        with self.lock:
+            if self.running.get(key) is future:
+                del self.running[key]
+            while self.tickets and self.tickets[0][0].done():
+                done, submitted = self.tickets.popleft()
+                self.latencies.append(time.perf_counter() - submitted)
+                try:
+                    response = done.result()
+                except Exception as e:
+                    response = f"Désolé, une erreur est survenue : {str(e)}"
+                self.deliver(response)
+
+    def depth(self):
+        with self.lock:
+            return len(self.tickets)
+
+    def latency_ms(self):
+        with self.lock:
+            return 1000 * sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+
+def public_columns(df):
+    # Sans les colonnes de recherche internes (*_lower) ajoutées en mode compact
+    return [col for col in df.columns if not col.endswith(LOWER_SUFFIX)]
+
+
+def export_chunk(rows, keep_types=False):
+    # Dates formatées par colonne ; Parquet garde les types natifs sauf les colonnes mixtes
+    rows = rows.copy()
+    for col in rows.columns:
+        if isinstance(rows[col].dtype, pd.DatetimeTZDtype) or rows[col].dtype.kind == 'M':
+            if not keep_types:
+                rows[col] = rows[col].dt.strftime(EXPORT_DATE_FORMAT)
+        elif rows[col].dtype == object:
+            rows[col] = rows[col].astype(str).where(rows[col].notna(), None)
+    return rows
+
+
+def export_frame(df, path, progress=None, cancelled=None, chunk_size=EXPORT_CHUNK):
+    total = len(df)
+    columns = public_columns(df)
+    extension = os.path.splitext(path)[1].lower()
+
+    def write(tmp_path):
+        writer = None
+        try:
+            if extension == '.parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            elif extension == '.xlsx':
+                from openpyxl import Workbook
+                writer = Workbook(write_only=True)
+                sheet = writer.create_sheet("Badges")
+                sheet.append(columns)
+            else:
+                writer = open(tmp_path, 'w', encoding='utf-8-sig', newline='')
+
+            for start, stop in chunk_bounds(total, chunk_size, chunk_size):
+                if cancelled is not None and cancelled.is_set():
+                    return False
+                chunk = export_chunk(df.iloc[start:stop][columns], keep_types=extension == '.parquet')
+
+                if extension == '.parquet':
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    writer.write_table(table.cast(writer.schema))
+                elif extension == '.xlsx':
+                    for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                        sheet.append(row)
+                else:
+                    chunk.to_csv(writer, header=start == 0, index=False)
+
+                if progress is not None:
+                    progress(stop, total)
+
+            if extension == '.xlsx':
+                writer.save(tmp_path)
+            elif extension == '.parquet' and writer is None:
+                export_chunk(df[columns], keep_types=True).to_parquet(tmp_path, index=False)
+            return True
+        finally:
+            if extension == '.xlsx':
+                # Classeur abandonné (annulation, erreur) : la feuille en écriture seule est fermée
+                if writer is not None and not sheet.closed:
+                    sheet.close()
+            elif writer is not None:
+                writer.close()
+
+    # Fichier temporaire renommé à la fin : annulation ou erreur ne laissent aucun export tronqué
+    return replace_file(path, write)
+
+class ExportJob(threading.Thread):
+    # Export en arrière-plan ; la progression est lue par la boucle Tk
+    def __init__(self, df, path):
+        super().__init__(daemon=True)
+        self.df = df
+        self.path = path
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            done = export_frame(self.df, self.path, progress=lambda done, total: self.messages.put(('progress', done, total)),
+                                cancelled=self.cancelled)
+            self.messages.put(('done' if done else 'cancelled', len(self.df)))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+
+class BadgeLoader(threading.Thread):
+    # Lit le classeur (ou son cache) dans un thread et publie les lots dans une file
+    def __init__(self, path=EXCEL_FILE, use_cache=True, compact=False):
+        super().__init__(daemon=True)
+        # Plusieurs classeurs : lus en parallèle puis fusionnés (colonne Site)
+        self.paths = [path] if isinstance(path, str) else list(path)
+        self.path = self.paths[0]
+        self.use_cache = use_cache
+        self.compact = compact
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.index = SearchIndex()
+        self.fuzzy = FuzzyIndex()
+        self.aggregates = BadgeAggregates()
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        chunks = []
+        try:
+            if len(self.paths) > 1:
+                progress = lambda done, total: self.messages.put(('progress', done, total, "Lecture des sites",
+                                                                  "classeurs"))
+                cached = load_sites(self.paths, self.use_cache, progress=progress, cancelled=self.cancelled)
+                if cached is None:
+                    self.messages.put(('cancelled', 0))
+                    return
+            else:
+                cached = read_cache(self.path) if self.use_cache else None
+            # Cube enregistré avec le cache : les lots n'ont plus à être agrégés
+            cube = read_cube(self.path) if cached is not None and len(self.paths) == 1 else None
+            if cube is not None:
+                self.aggregates.load(cube)
+            source = iter_frame_chunks(cached) if cached is not None else iter_excel_chunks(self.path)
+
+            for chunk, done, total in source:
+                if self.cancelled.is_set():
+                    # Lots déjà lus : assemblés ici, une seule fois, hors du thread Tk
+                    if chunks:
+                        self.messages.put(('frame', pd.concat(chunks)))
+                    self.messages.put(('cancelled', done - len(chunk)))
+                    return
+                chunks.append(chunk)
+                self.index.add(chunk)
+                self.fuzzy.add(chunk)
+                if cube is None:
+                    self.aggregates.add(chunk)
+                self.messages.put(('batch', chunk, done, total))
+
+            # Lots typés séparément : une colonne entière dans un lot, mêlée dans un autre
+            full = cached if cached is not None or not chunks else uniform_columns(pd.concat(chunks).infer_objects())
+            if cached is None and self.use_cache and chunks:
+                try:
+                    write_cache(self.path, full, self.aggregates.cube)
+                except OSError:
+                    pass
+            elif cached is not None and cube is None and self.use_cache and len(self.paths) == 1:
+                write_cube(self.path, self.aggregates.cube)
+            if chunks:
+                self.messages.put(('frame', full))
+            if self.compact and chunks:
+                compact = compact_badges(full)
+                self.messages.put(('compact', compact, frame_memory(full), frame_memory(compact)))
+            self.messages.put(('done', sum(len(chunk) for chunk in chunks)))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+
+class SQLiteImporter(threading.Thread):
+    # Même protocole que BadgeLoader : importe le classeur si la base est périmée, puis publie la vue
+    def __init__(self, store, path=EXCEL_FILE):
+        super().__init__(daemon=True)
+        self.store = store
+        self.path = path
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.index = None
+        self.fuzzy = store.fuzzy
+        self.aggregates = store
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            if not self.store.is_current(self.path):
+                progress = lambda done, total: self.messages.put(('progress', done, total, "Import SQLite",
+                                                                  "enregistrements"))
+                self.store.import_workbook(self.path, progress=progress, cancelled=self.cancelled)
+            if not self.store.version:
+                self.messages.put(('cancelled', 0))
+                return
+            self.store.load_names()
+            self.fuzzy = self.store.fuzzy
+            view = self.store.view()
+            total = len(view)
+            self.messages.put(('batch', view, total, total))
+            self.messages.put(('cancelled' if self.cancelled.is_set() else 'done', total))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+
+def format_badge_rows(df):
+    # Formatage vectorisé d'une tranche du DataFrame pour le Treeview
+    def column(name):
+        if name in df.columns:
+            return df[name].astype(object).where(df[name].notna(), '')
+        return pd.Series('', index=df.index, dtype=object)
+
+    if 'Deactivation_Date' in df.columns:
+        expiry = df['Deactivation_Date'].dt.strftime('%d/%m/%Y').astype(object).fillna('')
+    else:
+        expiry = column('Deactivation_Date')
+
+    if 'Token_Status' in df.columns:
+        status = np.where(df['Token_Status'] == 1, "Actif", "Inactif")
+    else:
+        status = np.full(len(df), "Inactif", dtype=object)
+
+    values = zip(column('External_System_ID'), column('Last_Name'), column('First_Name'),
+                 column('Internal_Number'), status, expiry)
+    return [(str(label), row) for label, row in zip(df.index, values)]
+
+
+def details_line(label, field):
+    return f"║  │ {label:<15} {{{field}:<40.40}} │ ║\n"
+
+
+# Gabarit de la fiche, assemblé une fois ; {site} et {days} reçoivent les lignes optionnelles
+DETAILS_TEMPLATE = "".join([
+    "\n",
+    "╔══════════════════════════════════════════════════════════════════╗\n",
+    "║            INFORMATIONS COMPLÈTES DU BADGE - ANP                ║\n",
+    "╠══════════════════════════════════════════════════════════════════╣\n",
+    "║                                                                 ║\n",
+    "║  ■ IDENTITÉ                                                    ║\n",
+    "║  ┌────────────────────────────────────────────────────────────┐ ║\n",
+    details_line('Nom complet:', 'name'),
+    "{site}",
+    details_line('ID:', 'external_id'),
+    details_line('Numéro interne:', 'internal_number'),
+    details_line('Adresse:', 'address'),
+    details_line('Rôles:', 'roles'),
+    "║  └────────────────────────────────────────────────────────────┘ ║\n",
+    "║                                                                 ║\n",
+    "║  ■ STATUT                                                      ║\n",
+    "║  ┌────────────────────────────────────────────────────────────┐ ║\n",
+    details_line('Statut du badge:', 'status'),
+    details_line('VIP:', 'vip'),
+    details_line("Niveau d'émission:", 'issue_level'),
+    "║  └────────────────────────────────────────────────────────────┘ ║\n",
+    "║                                                                 ║\n",
+    "║  ■ DATES IMPORTANTES                                           ║\n",
+    "║  ┌────────────────────────────────────────────────────────────┐ ║\n",
+    details_line('Émis le:', 'issued'),
+    details_line('Activé le:', 'activated'),
+    details_line('Expire le:', 'expires'),
+    "{days}",
+    "║  └────────────────────────────────────────────────────────────┘ ║\n",
+    "║                                                                 ║\n",
+    "╚══════════════════════════════════════════════════════════════════╝\n",
+])
+DETAILS_SITE_LINE = details_line('Site:', 'site')
+DETAILS_DAYS_LINE = details_line('Jours restants:', 'days_left')
+
+
+def details_value(value):
+    if value is None or pd.isna(value):
+        return 'N/A'
+    return str(value)
+
+
+def details_date(date):
+    if date is None or pd.isna(date):
+        return "N/A"
+    return date.strftime('%d/%m/%Y %H:%M')
+
+
+def render_details(row, today):
+    # row : dict ou Series des DETAILS_FIELDS d'un badge
+    name = ' '.join(str(part) for part in (row.get('First_Name'), row.get('Last_Name')) if pd.notna(part))
+    vip = row.get('VIP')
+    site = row.get(SITE_COLUMN)
+    expiry = row.get('Deactivation_Date')
+    days = ''
+    if expiry is not None and pd.notna(expiry):
+        days_left = (expiry - today).days
+        status = "⚠ Expire bientôt!" if days_left <= EXPIRING_DAYS else "✅ Valide"
+        days = DETAILS_DAYS_LINE.format(days_left=f"{days_left} jours ({status})")
+
+    return DETAILS_TEMPLATE.format(
+        name=name or 'N/A',
+        site='' if site is None or pd.isna(site) else DETAILS_SITE_LINE.format(site=site),
+        external_id=details_value(row.get('External_System_ID')),
+        internal_number=details_value(row.get('Internal_Number')),
+        address=details_value(row.get('Address')),
+        roles=details_value(row.get('Roles')),
+        status='Actif' if row.get('Token_Status') == 1 else 'Inactif',
+        vip='Oui' if vip is not None and pd.notna(vip) and vip else 'Non',
+        issue_level=details_value(row.get('Issue_Level')),
+        issued=details_date(row.get('Issue_Date')),
+        activated=details_date(row.get('Activation_Date')),
+        expires=details_date(expiry),
+        days=days,
+    )
+
+
+class DetailsRenderer:
+    # Fiches détaillées : colonnes extraites une fois par DataFrame, accès par position, cartes en LRU
+    def __init__(self, size=DETAILS_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.cards = OrderedDict()
+        self.source = None
+        self.arrays = None
+        self.version = 0
+
+    def bind(self, df):
+        if df is not self.source:
+            self.source = df
+            self.version += 1
+            self.cards.clear()
+            if not isinstance(df, pd.DataFrame):
+                # Vues (SQLite, serveur, lots en cours de chargement) : ligne lue par .loc
+                self.arrays = None
+            else:
+                self.arrays = {field: df[field].array for field in DETAILS_FIELDS if field in df.columns}
+
+    def row(self, label):
+        if self.arrays is None:
+            return self.source.loc[label]
+        position = self.source.index.get_loc(label)
+        return {field: array[position] for field, array in self.arrays.items()}
+
+    def card(self, df, label):
+        # Clé : ligne, version des données et jour (les jours restants en dépendent) ;
+        # verrou car le serveur partage un même moteur de rendu entre ses threads
+        with self.lock:
+            self.bind(df)
+            key = (label, self.version, utc_day())
+            card = self.cards.get(key)
+            if card is not None:
+                self.cards.move_to_end(key)
+                return key, card
+
+            card = self.cards[key] = render_details(self.row(label), datetime.now(pytz.utc))
+            if len(self.cards) > self.size:
+                self.cards.popitem(last=False)
+            return key, card
+
+
+class ChunkedFrame:
+    # Lots déjà lus pendant le chargement : tous visibles au fur et à mesure, sans concaténation répétée
+    def __init__(self):
+        self.chunks = []
+        self.starts = []
+        self.length = 0
+        self.columns = pd.Index([])
+        self.iloc = SQLiteRows(self, True)
+        self.loc = SQLiteRows(self, False)
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def empty(self):
+        return self.length == 0
+
+    def append(self, chunk):
+        if not self.chunks:
+            self.columns = chunk.columns
+        self.chunks.append(chunk)
+        self.starts.append(self.length)
+        self.length += len(chunk)
+
+    def fetch(self, start, stop):
+        # Seuls les lots qui recouvrent la tranche sont assemblés
+        first = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        parts = [chunk.iloc[max(start - offset, 0):stop - offset]
+                 for chunk, offset in zip(self.chunks[first:], self.starts[first:]) if offset < stop]
+        if not parts:
+            return pd.DataFrame(columns=self.columns)
+        return parts[0] if len(parts) == 1 else pd.concat(parts)
+
+    def fetch_label(self, label):
+        for chunk in self.chunks:
+            if label in chunk.index:
+                return chunk.loc[[label]]
+        return pd.DataFrame(columns=self.columns)
+
+
+class VirtualTreeview:
+    # Treeview virtuel : mappe la barre de défilement sur des positions du DataFrame
+    def __init__(self, tree, scrollbar, format_rows=format_badge_rows, overscan=VIRTUAL_OVERSCAN):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.format_rows = format_rows
+        self.overscan = overscan
+        self.df = None
+        self.offset = 0
+        self.visible = 1
+        self.block_start = 0
+        self.block = []
+        self.selected_pos = None
+
+        self.scrollbar.configure(command=self.yview)
+        self.tree.bind("<Configure>", self.on_resize)
+        self.tree.bind("<MouseWheel>", self.on_wheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        for key, step in (("<Up>", -1), ("<Down>", 1), ("<Prior>", 'page-'), ("<Next>", 'page+'),
+                          ("<Home>", 'home'), ("<End>", 'end')):
+            self.tree.bind(key, lambda e, s=step: self.move_selection(s))
+
+    def __len__(self):
+        return 0 if self.df is None else len(self.df)
+
+    def set_frame(self, df, keep_offset=False):
+        self.df = df
+        self.block = []
+        if not keep_offset:
+            self.offset = 0
+            self.selected_pos = None
+        self.render()
+
+    def label_at(self, pos):
+        return self.rows(pos, pos + 1)[0][0]
+
+    def yview(self, *args):
+        total = len(self)
+        if not args or total == 0:
+            return
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * total))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            self.scroll(step * self.visible if args[2] == 'pages' else step)
+
+    def scroll(self, rows):
+        self.scroll_to(self.offset + rows)
+
+    def scroll_to(self, offset):
+        offset = max(0, min(offset, len(self) - self.visible))
+        if offset != self.offset:
+            self.offset = offset
+            self.render()
+
+    def on_wheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+        return "break"
+
+    def on_resize(self, event):
+        rowheight = int(ttk.Style().lookup('Treeview', 'rowheight') or 25)
+        visible = max(1, (event.height - rowheight) // rowheight)
+        if visible != self.visible:
+            self.visible = visible
+            self.render()
+
+    def on_select(self, event):
+        selection = self.tree.selection()
+        if selection:
+            self.selected_pos = self.offset + self.tree.index(selection[0])
+
+    def move_selection(self, step):
+        total = len(self)
+        if total == 0:
+            return "break"
+        current = self.selected_pos if self.selected_pos is not None else self.offset - 1
+        if step == 'page-':
+            pos = current - self.visible
+        elif step == 'page+':
+            pos = current + self.visible
+        elif step == 'home':
+            pos = 0
+        elif step == 'end':
+            pos = total - 1
+        else:
+            pos = current + step
+        pos = max(0, min(pos, total - 1))
+
+        self.selected_pos = pos
+        if pos < self.offset:
+            self.offset = pos
+        elif pos >= self.offset + self.visible:
+            self.offset = pos - self.visible + 1
+        self.render()
+        return "break"
+
+    def rows(self, start, stop):
+        # Cache de lignes formatées autour de la fenêtre visible (overscan)
+        block_stop = self.block_start + len(self.block)
+        if not self.block or start < self.block_start or stop > block_stop:
+            self.block_start = max(0, start - self.overscan)
+            self.block = self.format_rows(self.df.iloc[self.block_start:stop + self.overscan])
+        return self.block[start - self.block_start:stop - self.block_start]
+
+    def render(self):
+        self.tree.delete(*self.tree.get_children())
+        total = len(self)
+        if total == 0:
+            self.scrollbar.set(0, 1)
+            return
+
+        self.offset = max(0, min(self.offset, total - self.visible))
+        stop = min(self.offset + self.visible, total)
+        for iid, values in self.rows(self.offset, stop):
+            self.tree.insert("", tk.END, values=values, iid=iid)
+
+        if self.selected_pos is not None and self.offset <= self.selected_pos < stop:
+            iid = self.label_at(self.selected_pos)
+            self.tree.selection_set(iid)
+            self.tree.focus(iid)
+        self.scrollbar.set(self.offset / total, stop / total)
+
+
+def to_json_rows(frame):
+    # Lignes envoyées par le serveur : mêmes conversions que SQLite (dates texte UTC), label en tête
+    rows = to_sqlite_rows(frame[public_columns(frame)])
+    rows.insert(0, 'label', frame.index)
+    return rows.astype(object).where(rows.notna(), None).to_dict('records')
+
+
+def from_json_rows(records, columns):
+    frame = pd.DataFrame.from_records(records, columns=['label'] + list(columns)).set_index('label')
+    return from_sqlite_rows(frame)
+
+
+def json_value(value):
+    # numpy / pandas → JSON
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def window_params(days):
+    if isinstance(days, tuple):
+        return {'start': '' if days[0] is None else pd.Timestamp(days[0]).isoformat(),
+                'stop': '' if days[1] is None else pd.Timestamp(days[1]).isoformat()}
+    return {'days': days}
+
+
+def request_window(params):
+    if 'start' in params or 'stop' in params:
+        return tuple(pd.Timestamp(params[key]) if params.get(key) else None for key in ('start', 'stop'))
+    return int(params.get('days', EXPIRING_DAYS))
+
+
+def load_dataset(paths, compact=False):
+    # Chargement synchrone (serveur) par le même chemin que l'interface : cache, sites, index
+    loader = BadgeLoader(paths, compact=compact)
+    loader.run()
+    df = None
+    while True:
+        message = loader.messages.get_nowait()
+        if message[0] in ('frame', 'compact'):
+            df = message[1]
+        elif message[0] == 'error':
+            raise message[1]
+        elif message[0] in ('done', 'cancelled'):
+            break
+    return (pd.DataFrame() if df is None else df), loader
+
+
+class BadgeService:
+    # Données du serveur : chargées une fois, partagées par tous les clients ; méthodes → dict JSON
+    def __init__(self, paths, compact=False):
+        self.paths = paths
+        self.compact = compact
+        self.lock = threading.RLock()
+        self.version = 0
+        self.load()
+
+    def load(self):
+        df, loader = load_dataset(self.paths, self.compact)
+        with self.lock:
+            self.df = df
+            self.index = loader.index
+            self.fuzzy = loader.fuzzy
+            self.aggregates = loader.aggregates
+            self.loaded_stat = workbooks_stat(self.paths)
+            self.sites = site_names(df)
+            self.states = {}
+            self.site_cubes = {}
+            self.selections = OrderedDict()
+            self.assistants = OrderedDict()
+            # Rapports en lot : listes complètes, sans session ni curseur « suivant »
+            self.batch_assistant = AssistantEngine(page_size=None)
+            self.details = DetailsRenderer()
+            self.version += 1
+
+    def reload(self, params=None):
+        # Relecture seulement si un classeur a changé ; les sites inchangés viennent de leur cache
+        if workbooks_stat(self.paths) != self.loaded_stat:
+            self.load()
+        return self.info()
+
+    def info(self, params=None):
+        return {'version': self.version, 'rows': len(self.df), 'columns': public_columns(self.df),
+                'sites': self.sites}
+
+    def state(self, site=None):
+        with self.lock:
+            if site not in self.states:
+                self.states[site] = BadgeState(filter_site(self.df, site))
+            return self.states[site].current()
+
+    def site_aggregates(self, site=None):
+        if site is None:
+            return self.aggregates
+        with self.lock:
+            if site not in self.site_cubes:
+                self.site_cubes[site] = BadgeAggregates()
+                self.site_cubes[site].add(filter_site(self.df, site))
+            return self.site_cubes[site]
+
+    def selection(self, params):
+        # Résultat d'une recherche / liste / site, gardé en LRU pour la pagination des clients
+        site, term, kind = params.get('site') or None, params.get('q', '').lower().strip(), params.get('kind')
+        if kind and kind not in SERVER_KINDS:
+            raise ValueError(f"liste inconnue : {kind}")
+        days = request_window(params)
+        # Le jour fait partie de la clé : après minuit, les listes expirés / expirants sont recalculées
+        state = self.state(site)
+        key = (self.version, state.day, site, term, kind, days)
+        with self.lock:
+            if key in self.selections:
+                self.selections.move_to_end(key)
+                return self.selections[key]
+
+        frame = state.select(kind, days) if kind else state.df
+        if term:
+            labels = self.index.search(term, swapped=False) or self.index.search(term)
+            frame = select_labels(frame, labels)
+
+        with self.lock:
+            self.selections[key] = frame
+            if len(self.selections) > SERVER_CACHE_SIZE:
+                self.selections.popitem(last=False)
+        return frame
+
+    def rows(self, params):
+        frame = self.selection(params)
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', SERVER_PAGE_SIZE))
+        return {'total': len(frame), 'rows': to_json_rows(frame.iloc[offset:offset + limit])}
+
+    def badge(self, params):
+        label = int(params['label'])
+        _, card = self.details.card(self.df, label)
+        return {'row': to_json_rows(self.df.loc[[label]])[0], 'card': card}
+
+    def stats(self, params):
+        state = self.state(params.get('site') or None)
+        return {
+            'today': state.today.isoformat(),
+            'total': state.total,
+            'active_count': state.active_count,
+            'inactive_count': state.inactive_count,
+            'expired_count': state.expired_count,
+            'expiring_count': state.expiring_count,
+            'vip_count': state.vip_count,
+            'has_expiry': state.has_expiry,
+            'has_vip': state.has_vip,
+        }
+
+    def expiry_counts(self, params):
+        edges = [pd.Timestamp(edge) for edge in params['edges'].split(',')]
+        return {'counts': self.state(params.get('site') or None).expiry_counts(edges).tolist()}
+
+    def aggregates_summary(self, params):
+        aggregates = self.site_aggregates(params.get('site') or None)
+        monthly = aggregates.monthly_series()
+        return {
+            'monthly': {month.strftime('%Y-%m-%d'): int(count) for month, count in monthly.items()},
+            'types': {str(badge_type): int(count) for badge_type, count in aggregates.type_counts().items()},
+        }
+
+    def period_count(self, params):
+        filters = {col: json.loads(params[col]) for col in AGGREGATE_DIMENSIONS if col in params}
+        aggregates = self.site_aggregates(params.get('site') or None)
+        return {'count': aggregates.period_count(params['event'], pd.Timestamp(params['start']),
+                                                 pd.Timestamp(params['stop']), **filters)}
+
+    def suggest(self, params):
+        return {'suggestions': self.fuzzy.suggestions(params.get('q', ''), n=int(params.get('n', 3)),
+                                                      cutoff=float(params.get('cutoff', 0.6)))}
+
+    def ask(self, params):
+        # Un moteur par session client : les pages « suivant » ne se mélangent pas entre postes
+        session = params.get('session', '')
+        with self.lock:
+            assistant = self.assistants.get(session)
+            if assistant is None:
+                assistant = self.assistants[session] = AssistantEngine()
+                if len(self.assistants) > SERVER_SESSIONS:
+                    self.assistants.popitem(last=False)
+            self.assistants.move_to_end(session)
+        question = params.get('question', '')
+        site = mentioned_site(question, self.sites) or params.get('site') or None
+        with PERF.span(f"generate_ai_response:{assistant.route(question)}"):
+            response = assistant.answer(self.state(site), question, self.site_aggregates(site))
+        return {'response': response if site is None else f"[{site}] {response}"}
+
+    def ask_batch(self, params):
+        # Toutes les questions d'un rapport en un appel, sur un seul état et un seul jeu d'agrégats
+        questions = params.get('questions')
+        if not isinstance(questions, list) or not all(isinstance(question, str) for question in questions):
+            raise ValueError("questions : liste de textes attendue")
+        site = params.get('site') or None
+        with PERF.span('assistant_batch'):
+            results = self.batch_assistant.answer_batch(self.state(site), questions, self.site_aggregates(site))
+        return {'results': [[question, intent, answer if site is None else f"[{site}] {answer}"]
+                            for question, intent, answer in results]}
+
+
+class BadgeServer:
+    # Serveur HTTP/JSON minimal sur asyncio ; les requêtes tournent dans un pool de threads
+    routes = {
+        ('GET', '/info'): 'info',
+        ('GET', '/rows'): 'rows',
+        ('GET', '/badge'): 'badge',
+        ('GET', '/stats'): 'stats',
+        ('GET', '/expiry_counts'): 'expiry_counts',
+        ('GET', '/aggregates'): 'aggregates_summary',
+        ('GET', '/period_count'): 'period_count',
+        ('GET', '/suggest'): 'suggest',
+        ('POST', '/ask'): 'ask',
+        ('POST', '/ask_batch'): 'ask_batch',
+        ('POST', '/reload'): 'reload',
+    }
+
+    def __init__(self, service, host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="serveur")
+        self.cache = OrderedDict()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle, self.host, self.port)
+        async with server:
+            await server.serve_forever()
+
+    @staticmethod
+    def error(status, message):
+        return status, json.dumps({'error': message}, ensure_ascii=False).encode()
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, target, _ = (await reader.readline()).decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length') or 0))
+            except ValueError:
+                status, data = self.error(400, "requête HTTP invalide")
+            else:
+                try:
+                    status, data = await self.respond(method, target, body)
+                except Exception as e:
+                    # Toujours une réponse : le client ne doit pas voir une connexion coupée
+                    status, data = self.error(500, str(e))
+            writer.write(f"HTTP/1.1 {status} {SERVER_REASONS[status]}\r\n"
+                         f"Content-Type: application/json; charset=utf-8\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('latin-1') + data)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        name = self.routes.get((method, url.path))
+        if name is None:
+            return self.error(404, f"route inconnue : {method} {url.path}")
+
+        # Réponses GET mémorisées par version des données (la relecture invalide tout) et par jour
+        # (statistiques et listes changent à minuit sans relecture)
+        key = (target, self.service.version, utc_day())
+        if method == 'GET' and key in self.cache:
+            self.cache.move_to_end(key)
+            return 200, self.cache[key]
+
+        params = dict(urllib.parse.parse_qsl(url.query))
+        try:
+            if body:
+                payload = json.loads(body)
+                if not isinstance(payload, dict):
+                    raise ValueError("le corps de la requête doit être un objet JSON")
+                params.update(payload)
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, getattr(self.service, name), params)
+        except (KeyError, IndexError) as e:
+            return self.error(404, f"introuvable : {e}")
+        except ValueError as e:
+            # Comprend json.JSONDecodeError et UnicodeDecodeError : corps illisible
+            return self.error(400, str(e))
+        except Exception as e:
+            return self.error(500, str(e))
+
+        data = json.dumps(result, ensure_ascii=False, default=json_value).encode()
+        if method == 'GET':
+            self.cache[key] = data
+            if len(self.cache) > SERVER_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return 200, data
+
+
+class BadgeClient:
+    # Client du serveur (--server) : joue pour l'interface le rôle de SQLiteStore
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = uuid.uuid4().hex
+        self.fuzzy = self
+        self.version = 0
+        self.columns = []
+
+    def request(self, method, path, params=None, payload=None):
+        query = "?" + urllib.parse.urlencode(params) if params else ""
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.url + path + query, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=SERVER_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read() or b'{}').get('error', str(e))) from None
+
+    def get(self, path, **params):
+        return self.request('GET', path, params)
+
+    def reload(self):
+        info = self.request('POST', '/reload', payload={})
+        self.version = info['version']
+        self.columns = info['columns']
+        return info
+
+    def loader(self, path=None):
+        return RemoteLoader(self)
+
+    def view(self, **selection):
+        return RemoteView(self, selection)
+
+    def state(self, view):
+        return RemoteState(view)
+
+    def suggestions(self, term, n=3, cutoff=0.6):
+        return self.get('/suggest', q=term, n=n, cutoff=cutoff)['suggestions']
+
+    def ask(self, question, site=None):
+        return self.request('POST', '/ask', payload={'question': question, 'site': site or '',
+                                                     'session': self.session})['response']
+
+    def ask_batch(self, questions, site=None):
+        results = self.request('POST', '/ask_batch', payload={'questions': list(questions), 'site': site or ''})
+        return [tuple(result) for result in results['results']]
+
+    def monthly_series(self):
+        monthly = self.get('/aggregates', v=self.version)['monthly']
+        return pd.Series(list(monthly.values()), index=pd.to_datetime(list(monthly.keys())), dtype='int64')
+
+    def type_counts(self):
+        return pd.Series(self.get('/aggregates', v=self.version)['types'], dtype='int64')
+
+    def period_count(self, event, start, stop, **filters):
+        params = {key: json.dumps(value) for key, value in filters.items()}
+        return self.get('/period_count', event=event, start=pd.Timestamp(start).isoformat(),
+                        stop=pd.Timestamp(stop).isoformat(), v=self.version, **params)['count']
+
+
+class RemoteView:
+    # Sélection paresseuse côté serveur (recherche, liste, site) : seules les tranches affichées sont lues
+    def __init__(self, client, selection):
+        self.client = client
+        self.selection = selection
+        self.columns = pd.Index(client.columns)
+        self.length = None
+        self.iloc = SQLiteRows(self, True)
+        self.loc = SQLiteRows(self, False)
+
+    def __len__(self):
+        if self.length is None:
+            self.length = self.client.get('/rows', limit=0, v=self.client.version, **self.selection)['total']
+        return self.length
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def fetch(self, start, stop):
+        page = self.client.get('/rows', offset=start, limit=max(stop - start, 0), v=self.client.version,
+                               **self.selection)
+        self.length = page['total']
+        return from_json_rows(page['rows'], self.columns)
+
+    def fetch_label(self, label):
+        try:
+            badge = self.client.get('/badge', label=label, v=self.client.version)
+        except RuntimeError:
+            return from_json_rows([], self.columns)
+        return from_json_rows([badge['row']], self.columns)
+
+    def search(self, term, swapped=True):
+        return RemoteView(self.client, dict(self.selection, q=term))
+
+
+class RemoteState:
+    # Même interface que BadgeState ; comptages et listes demandés au serveur
+    def __init__(self, df):
+        self.df = df
+        self.client = df.client
+        self.site = df.selection.get('site', '')
+        self.compute()
+
+    def compute(self):
+        stats = self.client.get('/stats', site=self.site, v=self.client.version)
+        self.version = next(STATE_VERSIONS)
+        self.today = pd.Timestamp(stats.pop('today')).to_pydatetime()
+        self.day = self.today.date()
+        self.__dict__.update(stats)
+        self.counts = {}
+
+    def current(self):
+        if utc_day() != self.day:
+            self.compute()
+        return self
+
+    def view(self, kind, days=EXPIRING_DAYS):
+        return RemoteView(self.client, dict(self.df.selection, kind=kind, **window_params(days)))
+
+    def count(self, kind, days=EXPIRING_DAYS):
+        if (kind, days) not in self.counts:
+            self.counts[(kind, days)] = len(self.view(kind, days))
+        return self.counts[(kind, days)]
+
+    def rows(self, kind, start, stop, days=EXPIRING_DAYS):
+        return self.view(kind, days).fetch(start, stop)
+
+    def select(self, kind, days=EXPIRING_DAYS):
+        return self.view(kind, days)
+
+    def expiry_counts(self, edges):
+        edges = ",".join(pd.Timestamp(edge).isoformat() for edge in edges)
+        return np.array(self.client.get('/expiry_counts', edges=edges, site=self.site,
+                                        v=self.client.version)['counts'], dtype=np.int64)
+
+
+class RemoteLoader(threading.Thread):
+    # Même protocole que BadgeLoader : le serveur relit ses classeurs si besoin, le client ne garde qu'une vue
+    def __init__(self, client):
+        super().__init__(daemon=True)
+        self.client = client
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.index = None
+        self.fuzzy = client
+        self.aggregates = client
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        try:
+            self.client.reload()
+            view = self.client.view()
+            total = len(view)
+            self.messages.put(('batch', view, total, total))
+            self.messages.put(('cancelled' if self.cancelled.is_set() else 'done', total))
+        except Exception as e:
+            self.messages.put(('error', e))
+
+
+# Vues paresseuses (SQLite, serveur) : recherche et détails passent par la vue, pas par les index locaux
+LAZY_VIEWS = (SQLiteView, RemoteView)
+
 
 class EnhancedBadgeApp:
-    def __init__(self, root):  # Changé de _init à _init_
+    def __init__(self, root, store=None, compact=False, timer=None, source=EXCEL_FILE,
+                 batch_at=None, batch_dir=".", batch_questions=None):  # Changé de _init à _init_
         self.root = root
+        self.paths = site_workbooks(source)
+        self.timer = timer or StartupTimer()
+        self.store = store
+        self.compact = compact
+        self.memory_note = ""
         self.root.title("ANP - Système Intelligent de Gestion des Badges")
         self.root.geometry("1200x800")
         self.root.configure(bg="#f0f2f5")
@@ -20,11 +3117,53 @@ class EnhancedBadgeApp:
 
 
 
+        self.current_selection = None
+        self.details = DetailsRenderer()
+        self.details_key = None
+        self.loader = None
+        self.loading = False
+        self.partial = None
+        self.refresher = None
+        self.loaded_stat = None
+        self.search_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self.search_future = None
+        self.search_after = None
+        self.search_generation = 0
+        self.search_term = ""
+        self.search_cache = OrderedDict()
+        self.search_cache_version = None
+        self.site = None
+        self.sites = []
+        self.site_states = None
+        self.site_aggregates_cache = None
+        # États et cubes par site : partagés entre le thread Tk, l'assistant et les rapports en lot
+        self.state_lock = threading.Lock()
+        self.assistant = AssistantEngine()
+        self.batch_assistant = AssistantEngine(page_size=None)
+        self.batch_at = batch_at
+        self.batch_dir = batch_dir
+        self.batch_questions = batch_questions or ASSISTANT_BATCH_QUESTIONS
+        self.batch_next = None
+        self.batch_running = False
+        self.dispatcher = AssistantDispatcher(
+            self.generate_ai_response, self.deliver_ai_response,
+            coalesce=lambda user_msg: self.assistant.route(user_msg) not in ASSISTANT_PAGED_INTENTS)
+        self.figure = None
+        self.stats_artists = None
+        self.stats_counts = None
+        self.stats_pending = False
+        self.graph_window = None
+        self.graph_artists = None
+        self.graph_versions = None
+        self.graph_style_applied = False
+        self.export_job = None
+        self.diagnostics_after = None
+
         self.setup_styles()
-        self.load_data()
         self.create_widgets()
-        self.refresh()
-        self.current_selection = None
+        self.timer.mark("fenêtre prête")
+        self.load_data()
+        self.schedule_batch()
     
     def setup_styles(self):
         style = ttk.Style()
@@ -42,23 +3181,124 @@ class EnhancedBadgeApp:
         self.title_font = tkfont.Font(family="Helvetica", size=12, weight="bold")
     
     def load_data(self):
-        try:
-            self.df = pd.read_excel("BADGES.xlsx")
-            self.df.columns = [col.strip().replace(' ', '_') for col in self.df.columns]
-            
-            date_columns = ['ID_Modify_Time', 'Load_Date', 'Token_Modify_Time', 
-                          'Issue_Date', 'Activation_Date', 'Deactivation_Date']
-            
-            for col in date_columns:
-                if col in self.df.columns:
-                    self.df[col] = pd.to_datetime(self.df[col], errors='coerce')
-            
-            self.df['Full_Name'] = self.df['First_Name'].str.strip() + ' ' + self.df['Last_Name'].str.strip()
-                    
-            messagebox.showinfo("Succès", f"Données chargées avec succès!\n{len(self.df)} enregistrements trouvés.")
-        except Exception as e:
-            messagebox.showerror("Erreur", f"Impossible de charger le fichier:\n{e}")
-            self.root.destroy()
+        if self.loading:
+            return
+
+        if hasattr(self, 'df'):
+            del self.df
+        self.partial = None
+        self.virtual.set_frame(None)
+
+        if self.store is not None:
+            self.loader = self.store.loader(self.paths[0])
+        else:
+            self.loader = BadgeLoader(self.paths, compact=self.compact)
+        self.loaded_stat = workbooks_stat(self.paths)
+        self.index = self.loader.index
+        self.fuzzy = self.loader.fuzzy
+        self.aggregates = self.loader.aggregates
+        self.loader.start()
+        self.loading = True
+        # Le chargement se fait dans un autre thread : mesure sans profil, arrêtée par poll_loader
+        self.load_span = PERF.span('load_data', profile=False)
+
+        self.progress.configure(mode='indeterminate', value=0)
+        self.progress.start(10)
+        self.progress.pack(side=tk.RIGHT, padx=5)
+        self.cancel_btn.state(['!disabled'])
+        self.status_var.set("Chargement des données...")
+        self.root.after(50, self.poll_loader)
+
+    def cancel_loading(self):
+        if self.loader is not None:
+            self.loader.cancel()
+
+    def poll_loader(self):
+        loader = self.loader
+        finished = False
+        try:
+            while not finished:
+                message = loader.messages.get_nowait()
+                kind = message[0]
+
+                if kind == 'progress':
+                    _, done, total, label, unit = message
+                    if total:
+                        self.progress.stop()
+                        self.progress.configure(mode='determinate', maximum=total, value=done)
+                    self.status_var.set(f"{label}... {done} / {total or '?'} {unit}")
+                elif kind == 'batch':
+                    _, chunk, done, total = message
+                    self.fuzzy = loader.fuzzy
+                    if isinstance(chunk, LAZY_VIEWS):
+                        self.df = chunk
+                        self.virtual.set_frame(self.df, keep_offset=True)
+                        self.timer.mark("premières lignes affichées")
+                    else:
+                        # Chaque lot s'ajoute à la vue ; le DataFrame complet, assemblé une fois
+                        # par le chargeur, arrive avec le message 'frame'
+                        if self.partial is None:
+                            self.partial = ChunkedFrame()
+                            self.timer.mark("premières lignes affichées")
+                        self.partial.append(chunk)
+                        if self.virtual.df is None or self.virtual.df is self.partial:
+                            self.virtual.set_frame(self.partial, keep_offset=True)
+                    if total:
+                        self.progress.stop()
+                        self.progress.configure(mode='determinate', maximum=total, value=done)
+                    self.status_var.set(f"Chargement... {done} / {total or '?'} enregistrements")
+                elif kind == 'frame':
+                    showing_all = self.virtual.df is self.partial or self.virtual.df is getattr(self, 'df', None)
+                    self.df = message[1]
+                    self.partial = None
+                    if showing_all:
+                        self.virtual.set_frame(self.df, keep_offset=True)
+                elif kind == 'compact':
+                    _, compact, before, after = message
+                    showing_all = self.virtual.df is self.df
+                    self.df = compact
+                    if showing_all:
+                        self.virtual.set_frame(self.df, keep_offset=True)
+                    self.memory_note = f" ({memory_saving(before, after)})"
+                elif kind == 'done':
+                    finished = True
+                    self.timer.mark("données chargées")
+                    self.update_sites()
+                    if self.search_var.get().strip():
+                        # Recherche saisie pendant le chargement : relancée sur toutes les données
+                        self.search()
+                    elif self.site is not None and self.virtual.df is self.df:
+                        self.virtual.set_frame(self.site_frame())
+                    self.schedule_stats()
+                    self.status_var.set(f"Données chargées avec succès! {message[1]} enregistrements trouvés."
+                                        f"{self.memory_note}")
+                elif kind == 'cancelled':
+                    finished = True
+                    self.schedule_stats()
+                    self.status_var.set(f"Chargement annulé ({message[1]} enregistrements chargés)")
+                    if hasattr(self, 'df') and self.search_var.get().strip():
+                        self.search()
+                elif kind == 'error':
+                    finished = True
+                    messagebox.showerror("Erreur", f"Impossible de charger le fichier:\n{message[1]}")
+                    if not hasattr(self, 'df'):
+                        self.root.destroy()
+                        return
+        except queue.Empty:
+            pass
+
+        self.loading = not finished
+
+        if finished:
+            self.partial = None
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.cancel_btn.state(['disabled'])
+            self.load_span.stop(rows=len(self.df) if hasattr(self, 'df') else 0)
+            self.timer.finish()
+        else:
+            self.root.after(50, self.poll_loader)
+
     
     def create_widgets(self):
         header_frame = ttk.Frame(self.root, style='Header.TFrame')
@@ -81,6 +3321,11 @@ class EnhancedBadgeApp:
         
         ai_btn = ttk.Button(search_frame, text="Assistant IA", command=self.open_ai_chat)
         ai_btn.pack(side=tk.RIGHT, padx=5)
+
+        # Filtre par site, affiché seulement si plusieurs sites sont chargés
+        self.site_var = tk.StringVar(value=SITE_ALL)
+        self.site_box = ttk.Combobox(search_frame, textvariable=self.site_var, state='readonly', width=20)
+        self.site_box.bind("<<ComboboxSelected>>", self.on_site_changed)
         
         paned_window = ttk.PanedWindow(main_frame, orient=tk.HORIZONTAL)
         paned_window.pack(fill=tk.BOTH, expand=True)
@@ -89,9 +3334,10 @@ class EnhancedBadgeApp:
         self.tree = ttk.Treeview(results_frame, columns=("ID", "Nom", "Prénom", "Numéro", "Statut", "Expiration"), 
                                show="headings", selectmode='browse')
         
-        vsb = ttk.Scrollbar(results_frame, orient="vertical", command=self.tree.yview)
+        vsb = ttk.Scrollbar(results_frame, orient="vertical")
         hsb = ttk.Scrollbar(results_frame, orient="horizontal", command=self.tree.xview)
-        self.tree.configure(yscrollcommand=vsb.set, xscrollcommand=hsb.set)
+        self.tree.configure(xscrollcommand=hsb.set)
+        self.virtual = VirtualTreeview(self.tree, vsb)
         
         self.tree.grid(row=0, column=0, sticky='nsew')
         vsb.grid(row=0, column=1, sticky='ns')
@@ -123,9 +3369,15 @@ class EnhancedBadgeApp:
         self.details_text.pack(fill=tk.BOTH, expand=True)
         notebook.add(details_frame, text="Détails Complets")
         
-        stats_frame = ttk.Frame(notebook)
-        self.setup_stats_tab(stats_frame)
-        notebook.add(stats_frame, text="Statistiques")
+        # Onglet construit (et matplotlib importé) à sa première ouverture
+        self.stats_frame = ttk.Frame(notebook)
+        notebook.add(self.stats_frame, text="Statistiques")
+
+        self.diagnostics_frame = ttk.Frame(notebook)
+        self.setup_diagnostics_tab(self.diagnostics_frame)
+        notebook.add(self.diagnostics_frame, text="Diagnostics")
+        notebook.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+        self.notebook = notebook
         
         paned_window.add(notebook)
         
@@ -135,236 +3387,540 @@ class EnhancedBadgeApp:
         buttons = [
             ("Actualiser", self.refresh),
             ("Graphiques", self.show_graphs),
+            ("Exporter", self.export_results),
             ("Quitter", self.root.quit)
         ]
         
         for text, command in buttons:
             btn = ttk.Button(toolbar_frame, text=text, command=command)
             btn.pack(side=tk.LEFT, padx=3)
+
+        self.cancel_btn = ttk.Button(toolbar_frame, text="Annuler le chargement", command=self.cancel_loading)
+        self.cancel_btn.pack(side=tk.RIGHT, padx=3)
+        self.cancel_btn.state(['disabled'])
+        self.export_cancel_btn = ttk.Button(toolbar_frame, text="Annuler l'export", command=self.cancel_export)
+        self.export_cancel_btn.pack(side=tk.RIGHT, padx=3)
+        self.export_cancel_btn.state(['disabled'])
         
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(fill=tk.X)
+
         self.status_var = tk.StringVar()
-        status_bar = ttk.Label(self.root, textvariable=self.status_var, relief=tk.SUNKEN)
-        status_bar.pack(fill=tk.X)
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+
+        self.progress = ttk.Progressbar(status_frame, orient=tk.HORIZONTAL, length=200)
         
-        self.tree.bind("<Double-1>", self.show_details)
-        self.tree.bind("<ButtonRelease-1>", self.show_details)
+        self.tree.bind("<<TreeviewSelect>>", self.show_details, add='+')
         search_entry.bind("<Return>", lambda e: self.search())
+        self.search_var.trace_add('write', self.on_search_changed)
     
+    def on_tab_changed(self, event):
+        selected = event.widget.select()
+        if self.figure is None and selected == str(self.stats_frame):
+            self.setup_stats_tab(self.stats_frame)
+        elif selected == str(self.diagnostics_frame):
+            self.refresh_diagnostics()
+
+    def setup_diagnostics_tab(self, frame):
+        toolbar = ttk.Frame(frame)
+        toolbar.pack(fill=tk.X, pady=3)
+        ttk.Button(toolbar, text="Rafraîchir", command=self.refresh_diagnostics).pack(side=tk.LEFT, padx=3)
+        ttk.Button(toolbar, text="Exporter le journal", command=self.export_diagnostics).pack(side=tk.LEFT, padx=3)
+        self.profiling_var = tk.BooleanVar(value=PERF.profiling)
+        ttk.Checkbutton(toolbar, text="Profilage cProfile", variable=self.profiling_var,
+                        command=self.toggle_profiling).pack(side=tk.LEFT, padx=3)
+        ttk.Button(toolbar, text="Enregistrer le profil", command=self.save_profile).pack(side=tk.LEFT, padx=3)
+
+        columns = ("Opération", "Appels", "Moyenne", "p50", "p95", "Max", "Lignes", "Δ mémoire")
+        self.diagnostics_tree = ttk.Treeview(frame, columns=columns, show="headings", height=8)
+        for col in columns:
+            self.diagnostics_tree.heading(col, text=col)
+            self.diagnostics_tree.column(col, width=180 if col == "Opération" else 70,
+                                         anchor=tk.W if col == "Opération" else tk.E)
+        self.diagnostics_tree.pack(fill=tk.X)
+
+        self.diagnostics_text = scrolledtext.ScrolledText(frame, wrap=tk.NONE, font=self.details_font,
+                                                          height=12, state='disabled')
+        self.diagnostics_text.pack(fill=tk.BOTH, expand=True)
+
+    def refresh_diagnostics(self):
+        # Rafraîchi périodiquement tant que l'onglet Diagnostics est affiché
+        if self.diagnostics_after is not None:
+            self.root.after_cancel(self.diagnostics_after)
+            self.diagnostics_after = None
+
+        summary = PERF.summary()
+        self.diagnostics_tree.delete(*self.diagnostics_tree.get_children())
+        for row in summary:
+            self.diagnostics_tree.insert("", tk.END, values=(
+                row['operation'], row['count'], f"{row['mean_ms']:.1f} ms", f"{row['p50_ms']:.1f} ms",
+                f"{row['p95_ms']:.1f} ms", f"{row['max_ms']:.1f} ms", row['rows'],
+                f"{row['memory_delta'] / 2**20:+.1f} Mo"))
+
+        lines = ["Histogrammes de latence :"]
+        labels = PERF.bucket_labels()
+        for row in summary:
+            buckets = "  ".join(f"{label}: {count}" for label, count in zip(labels, row['histogram']) if count)
+            lines.append(f"  {row['operation']:<40} {buckets}")
+        lines += ["", self.timer.report(), "",
+                  f"Assistant : {self.dispatcher.depth()} question(s) en attente, "
+                  f"latence moyenne {self.dispatcher.latency_ms():.0f} ms"]
+        rss = current_rss()
+        if rss is not None:
+            lines.append(f"Mémoire résidente : {rss / 2**20:.1f} Mo")
+        profile = PERF.profile_report()
+        if profile:
+            lines += ["", "Profil cProfile (cumulé) :", profile]
+
+        position = self.diagnostics_text.yview()[0]
+        self.diagnostics_text.config(state='normal')
+        self.diagnostics_text.delete(1.0, tk.END)
+        self.diagnostics_text.insert(tk.END, "\n".join(lines))
+        self.diagnostics_text.config(state='disabled')
+        self.diagnostics_text.yview_moveto(position)
+
+        if self.notebook.select() == str(self.diagnostics_frame):
+            self.diagnostics_after = self.root.after(PERF_REFRESH_MS, self.refresh_diagnostics)
+
+    def export_diagnostics(self):
+        path = filedialog.asksaveasfilename(defaultextension=".json", initialfile="diagnostics_anpp",
+                                            filetypes=[("JSON", "*.json"), ("CSV", "*.csv")])
+        if not path:
+            return
+        try:
+            PERF.dump(path)
+        except OSError as e:
+            messagebox.showerror("Erreur", f"Échec de l'export du journal:\n{e}")
+            return
+        self.status_var.set(f"Journal de performance exporté dans {os.path.basename(path)}")
+
+    def toggle_profiling(self):
+        PERF.profiling = self.profiling_var.get()
+        self.status_var.set("Profilage cProfile activé" if PERF.profiling else "Profilage cProfile désactivé")
+
+    def save_profile(self):
+        if PERF.profile_stats is None:
+            messagebox.showinfo("Profil", "Aucun profil capturé : activez le profilage puis utilisez l'application.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".prof", initialfile="anpp",
+                                            filetypes=[("Profil cProfile", "*.prof")])
+        if path and PERF.dump_profile(path):
+            self.status_var.set(f"Profil enregistré dans {os.path.basename(path)} (lisible avec pstats / snakeviz)")
+
     def setup_stats_tab(self, frame):
+        self.timer.mark("matplotlib importé", load_plotting())
         self.figure = plt.Figure(figsize=(5, 4), dpi=100)
         self.canvas = FigureCanvasTkAgg(self.figure, master=frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
         self.update_stats()
     
+    def site_state(self, site):
+        # Un état par site consulté, recalculé quand les données changent
+        with self.state_lock:
+            df = self.df
+            if self.site_states is None or self.site_states[0] is not df:
+                self.site_states = (df, {})
+            states = self.site_states[1]
+            if site not in states:
+                frame = filter_site(df, site)
+                states[site] = self.store.state(frame) if self.store is not None else BadgeState(frame)
+            return states[site].current()
+
+    def badge_state(self):
+        return self.site_state(self.site)
+
+    def site_frame(self):
+        return self.badge_state().df
+
+    def site_aggregates(self, site=None):
+        site = site or self.site
+        if site is None:
+            return self.aggregates
+        with self.state_lock:
+            df = self.df
+            if self.site_aggregates_cache is None or self.site_aggregates_cache[0] is not df:
+                self.site_aggregates_cache = (df, {})
+            cubes = self.site_aggregates_cache[1]
+            if site not in cubes:
+                cubes[site] = BadgeAggregates()
+                cubes[site].add(filter_site(df, site))
+            return cubes[site]
+
+    def update_sites(self):
+        self.sites = site_names(self.df) if self.store is None else []
+        if self.site not in self.sites:
+            self.site = None
+            self.site_var.set(SITE_ALL)
+        if len(self.sites) > 1:
+            self.site_box.configure(values=[SITE_ALL] + self.sites)
+            self.site_box.pack(side=tk.LEFT, padx=5)
+        else:
+            self.site_box.pack_forget()
+
+    def on_site_changed(self, event=None):
+        choice = self.site_var.get()
+        self.site = None if choice == SITE_ALL else choice
+        self.search()
+        self.schedule_stats()
+        self.update_graphs()
+
+    def schedule_stats(self):
+        # Le rendu des graphiques est reporté après le traitement de l'événement en cours
+        if not self.stats_pending:
+            self.stats_pending = True
+            self.root.after_idle(self.update_stats)
+
+    @instrumented('update_stats', rows=lambda self: len(self.df) if hasattr(self, 'df') else 0)
     def update_stats(self):
+        self.stats_pending = False
         if not hasattr(self, 'df'):
             return
-            
-        self.figure.clear()
-        
-        ax1 = self.figure.add_subplot(121)
-        status_counts = self.df['Token_Status'].value_counts()
-        wedges, texts, autotexts = ax1.pie(status_counts, 
-                                         colors=['#4CAF50', '#F44336'], 
-                                         startangle=90,
-                                         autopct=lambda p: f"{p:.1f}%\n({int(p/100*sum(status_counts))})")
-        
-        ax1.set_title('Répartition par statut')
-        ax1.legend(['Actif', 'Inactif'], loc='upper right')
-        
-        ax2 = self.figure.add_subplot(122)
-        if 'Deactivation_Date' in self.df.columns:
-            today = datetime.now(pytz.utc)
-            days_left = (self.df['Deactivation_Date'] - today).dt.days
-            expiring_soon = days_left.between(0, 30).sum()
-            not_expiring = len(self.df) - expiring_soon
-            
-            colors = ['#FFC107', '#2196F3']
-            bars = ax2.bar(['Expirent bientôt', 'Autres'], 
-                         [expiring_soon, not_expiring], 
-                         color=colors)
-            ax2.set_title('Badges expirant dans 30 jours')
-            
-            for bar in bars:
-                height = bar.get_height()
-                ax2.text(bar.get_x() + bar.get_width()/2., height,
-                        f"{int(height)}", ha='center', va='bottom')
-        
-        self.figure.tight_layout()
-        self.canvas.draw()
+
+        state = self.badge_state()
+        counts = (state.active_count, state.inactive_count, state.expiring_count, state.total, state.has_expiry)
+        if self.figure is not None and counts != self.stats_counts:
+            self.stats_counts = counts
+            status_counts = [state.active_count, state.inactive_count]
+            expiring_soon = state.expiring_count
+            not_expiring = state.total - expiring_soon
+
+            artists = self.stats_artists
+            if state.total == 0:
+                pass
+            elif artists is None or artists['has_expiry'] != state.has_expiry:
+                self.figure.clear()
+
+                ax1 = self.figure.add_subplot(121)
+                wedges, texts, autotexts = ax1.pie(status_counts, 
+                                                 colors=['#4CAF50', '#F44336'], 
+                                                 startangle=90,
+                                                 autopct=lambda p: f"{p:.1f}%\n({int(p/100*sum(status_counts))})")
+                
+                ax1.set_title('Répartition par statut')
+                ax1.legend(['Actif', 'Inactif'], loc='upper right')
+                artists = {'has_expiry': state.has_expiry, 'wedges': wedges, 'autotexts': autotexts}
+                
+                ax2 = self.figure.add_subplot(122)
+                if state.has_expiry:
+                    colors = ['#FFC107', '#2196F3']
+                    bars = ax2.bar(['Expirent bientôt', 'Autres'], 
+                                 [expiring_soon, not_expiring], 
+                                 color=colors)
+                    ax2.set_title('Badges expirant dans 30 jours')
+                    
+                    labels = []
+                    for bar in bars:
+                        height = bar.get_height()
+                        labels.append(ax2.text(bar.get_x() + bar.get_width()/2., height,
+                                               f"{int(height)}", ha='center', va='bottom'))
+                    artists.update(ax2=ax2, bars=bars, labels=labels)
+                
+                self.stats_artists = artists
+                self.figure.tight_layout()
+            else:
+                update_pie(artists['wedges'], artists['autotexts'], status_counts)
+                if state.has_expiry:
+                    update_bars(artists['ax2'], artists['bars'], artists['labels'], [expiring_soon, not_expiring])
+            self.canvas.draw_idle()
+
+        if self.graph_window is not None:
+            self.update_graphs()
     
+    def on_search_changed(self, *args):
+        if self.search_var.get().lower().strip() == self.search_term:
+            return
+        if self.search_after is not None:
+            self.root.after_cancel(self.search_after)
+        self.search_after = self.root.after(SEARCH_DEBOUNCE_MS, self.search)
+
     def search(self):
+        if self.search_after is not None:
+            self.root.after_cancel(self.search_after)
+            self.search_after = None
+
+        if not hasattr(self, 'df'):
+            self.status_var.set("Chargement en cours, veuillez patienter...")
+            return
+
         search_term = self.search_var.get().lower().strip()
+        self.search_term = search_term
+        self.search_generation += 1
+        if self.search_future is not None:
+            self.search_future.cancel()
         
+        frame = self.site_frame()
         if not search_term:
-            self.refresh()
+            self.display_results(frame)
+            self.status_var.set(f"{len(frame)} enregistrements")
+            return
+
+        self.status_var.set(f"Recherche de '{search_term}'...")
+        self.search_future = self.search_executor.submit(
+            self.run_search, search_term, self.search_generation, self.df, frame)
+
+    def run_search(self, search_term, generation, df, frame=None):
+        # Exécuté dans le thread de recherche ; abandonne si une saisie plus récente existe
+        if generation != self.search_generation:
+            return
+        with PERF.span('search') as span:
+            if isinstance(df, LAZY_VIEWS):
+                results = df.search(search_term)
+            else:
+                # Index et cache couvrent tous les sites ; le filtre de site s'applique à la sélection
+                labels = self.cached_search(search_term, df)
+
+                if generation != self.search_generation:
+                    return
+                results = select_labels(df if frame is None else frame, labels)
+            span.rows = len(results)
+
+            suggestions = []
+            if len(results) < 3 and len(df) > 10:
+                suggestions = self.get_suggestions(search_term)
+
+        self.root.after(0, self.show_search_results, generation, search_term, results, suggestions)
+
+    def cached_search(self, search_term, df):
+        if self.search_cache_version != self.index.version:
+            self.search_cache.clear()
+            self.search_cache_version = self.index.version
+
+        if search_term in self.search_cache:
+            self.search_cache.move_to_end(search_term)
+            return self.search_cache[search_term][0]
+
+        # Le terme prolonge une recherche récente : on affine son résultat
+        previous = max((term for term, (labels, primary) in self.search_cache.items()
+                        if primary and term in search_term and len(labels) <= SEARCH_NARROW_LIMIT),
+                       key=len, default=None)
+        if previous is not None:
+            labels = narrow_labels(df, self.search_cache[previous][0], search_term, self.index)
+        else:
+            labels = self.index.search(search_term, swapped=False)
+
+        primary = bool(labels)
+        if not primary:
+            labels = self.index.search(search_term)
+
+        self.search_cache[search_term] = (labels, primary)
+        if len(self.search_cache) > SEARCH_CACHE_SIZE:
+            self.search_cache.popitem(last=False)
+        return labels
+
+    def show_search_results(self, generation, search_term, results, suggestions):
+        if generation != self.search_generation:
             return
-            
-        mask = (self.df['Full_Name'].str.lower().str.contains(search_term, na=False)) | \
-               (self.df['First_Name'].str.lower().str.contains(search_term, na=False)) | \
-               (self.df['Last_Name'].str.lower().str.contains(search_term, na=False)) | \
-               (self.df['External_System_ID'].astype(str).str.contains(search_term, na=False)) | \
-               (self.df['Internal_Number'].astype(str).str.contains(search_term, na=False))
-        
-        results = self.df[mask]
-        
-        if len(results) == 0 and ' ' in search_term:
-            parts = search_term.split()
-            if len(parts) == 2:
-                mask = ((self.df['First_Name'].str.lower().str.contains(parts[0], na=False)) & 
-                       (self.df['Last_Name'].str.lower().str.contains(parts[1], na=False))) | \
-                      ((self.df['First_Name'].str.lower().str.contains(parts[1], na=False)) & 
-                       (self.df['Last_Name'].str.lower().str.contains(parts[0], na=False)))
-                results = self.df[mask]
-        
-        if len(results) < 3 and len(self.df) > 10:
-            suggestions = self.get_suggestions(search_term)
-            if suggestions:
-                self.status_var.set(f"Suggestions: {', '.join(suggestions[:3])}")
         
         self.display_results(results)
+        if suggestions:
+            self.status_var.set(f"Suggestions: {', '.join(suggestions[:3])}")
+        else:
+            self.status_var.set(f"{len(results)} résultat(s) pour '{search_term}'")
     
     def get_suggestions(self, term):
-        all_names = self.df['First_Name'].str.lower().dropna().tolist() + \
-                   self.df['Last_Name'].str.lower().dropna().tolist() + \
-                   self.df['Full_Name'].str.lower().dropna().tolist()
-        unique_names = list(set(all_names))
-        return get_close_matches(term, unique_names, n=3, cutoff=0.6)
+        return self.fuzzy.suggestions(term, n=3, cutoff=0.6)
     
+    @instrumented('display_results', rows=lambda self, df: len(df) if df is not None else 0)
     def display_results(self, df):
-        self.tree.delete(*self.tree.get_children())
-        
-        for _, row in df.iterrows():
-            expiry = row.get('Deactivation_Date', '')
-            if pd.notna(expiry):
-                expiry = expiry.strftime('%d/%m/%Y')
-            
-            status = "Actif" if row.get('Token_Status', 0) == 1 else "Inactif"
-            
-            self.tree.insert("", tk.END, values=(
-                row.get('External_System_ID', ''),
-                row.get('Last_Name', ''),
-                row.get('First_Name', ''),
-                row.get('Internal_Number', ''),
-                status,
-                expiry
-            ), iid=str(row.name))
+        self.virtual.set_frame(df)
     
     def show_details(self, event):
-        item = self.tree.identify_row(event.y)
-        if not item:
+        # <<TreeviewSelect>> : clic, double-clic et navigation au clavier passent tous par ici
+        selection = self.tree.selection()
+        if selection:
+            self.show_badge(int(selection[0]))
+
+    @instrumented('show_details')
+    def show_badge(self, label):
+        # Pendant le chargement, les lignes affichées sont celles des lots déjà lus
+        df = self.df if hasattr(self, 'df') else self.partial
+        if df is None:
             return
-            
-        df_index = int(item)
-        self.current_selection = df_index
-        
         try:
-            person_data = self.df.loc[df_index]
+            key, card = self.details.card(df, label)
         except KeyError:
             return
-            
-        details = "\n"
-        details += "╔══════════════════════════════════════════════════════════════════╗\n"
-        details += "║            INFORMATIONS COMPLÈTES DU BADGE - ANP                ║\n"
-        details += "╠══════════════════════════════════════════════════════════════════╣\n"
-        details += "║                                                                 ║\n"
-        
-        details += "║  ■ IDENTITÉ                                                    ║\n"
-        details += "║  ┌────────────────────────────────────────────────────────────┐ ║\n"
-        details += f"║  │ {'Nom complet:':<15} {self.format_field(person_data.get('First_Name', '') + ' ' + person_data.get('Last_Name', ''), 40)} │ ║\n"
-        details += f"║  │ {'ID:':<15} {self.format_field(person_data.get('External_System_ID', 'N/A'), 40)} │ ║\n"
-        details += f"║  │ {'Numéro interne:':<15} {self.format_field(person_data.get('Internal_Number', 'N/A'), 40)} │ ║\n"
-        details += f"║  │ {'Adresse:':<15} {self.format_field(person_data.get('Address', 'N/A'), 40)} │ ║\n"
-        details += f"║  │ {'Rôles:':<15} {self.format_field(person_data.get('Roles', 'N/A'), 40)} │ ║\n"
-        details += "║  └────────────────────────────────────────────────────────────┘ ║\n"
-        details += "║                                                                 ║\n"
-        
-        details += "║  ■ STATUT                                                      ║\n"
-        details += "║  ┌────────────────────────────────────────────────────────────┐ ║\n"
-        details += f"║  │ {'Statut du badge:':<15} {self.format_field('Actif' if person_data.get('Token_Status', 0) == 1 else 'Inactif', 40)} │ ║\n"
-        details += f"║  │ {'VIP:':<15} {self.format_field('Oui' if person_data.get('VIP', False) else 'Non', 40)} │ ║\n"
-        details += f"║  │ {'Niveau d\'émission:':<15} {self.format_field(person_data.get('Issue_Level', 'N/A'), 40)} │ ║\n"
-        details += "║  └────────────────────────────────────────────────────────────┘ ║\n"
-        details += "║                                                                 ║\n"
-        
-        details += "║  ■ DATES IMPORTANTES                                           ║\n"
-        details += "║  ┌────────────────────────────────────────────────────────────┐ ║\n"
-        details += f"║  │ {'Émis le:':<15} {self.format_field(self.format_date(person_data.get('Issue_Date')), 40)} │ ║\n"
-        details += f"║  │ {'Activé le:':<15} {self.format_field(self.format_date(person_data.get('Activation_Date')), 40)} │ ║\n"
-        expiry = person_data.get('Deactivation_Date')
-        details += f"║  │ {'Expire le:':<15} {self.format_field(self.format_date(expiry), 40)} │ ║\n"
-        
-        if pd.notna(expiry):
-            today = datetime.now(pytz.utc)
-            days_left = (expiry - today).days
-            status = "⚠ Expire bientôt!" if days_left <= 30 else "✅ Valide"
-            details += f"║  │ {'Jours restants:':<15} {self.format_field(f'{days_left} jours ({status})', 40)} │ ║\n"
-        
-        details += "║  └────────────────────────────────────────────────────────────┘ ║\n"
-        details += "║                                                                 ║\n"
-        details += "╚══════════════════════════════════════════════════════════════════╝\n"
-        
+
+        self.current_selection = label
+        if key == self.details_key:
+            return
+        self.details_key = key
         self.details_text.config(state='normal')
         self.details_text.delete(1.0, tk.END)
-        self.details_text.insert(tk.END, details)
+        self.details_text.insert(tk.END, card)
         self.details_text.config(state='disabled')
-    
-    def format_field(self, value, width):
-        if value is None:
-            value = 'N/A'
-        return f"{str(value)[:width]:<{width}}"
-    
-    def format_date(self, date):
-        if pd.isna(date):
-            return "N/A"
-        return date.strftime('%d/%m/%Y %H:%M')
-    
+
     def refresh(self):
+        # Client léger : le serveur relit lui-même les classeurs modifiés
+        if isinstance(self.store, BadgeClient) and hasattr(self, 'df') and not self.loading:
+            self.load_data()
+            return
+
+        # Base SQLite ou plusieurs sites : rechargement en arrière-plan si un classeur a changé
+        # (les sites inchangés sont relus depuis leur cache)
+        if ((self.store is not None or len(self.paths) > 1) and hasattr(self, 'df') and not self.loading
+                and workbooks_stat(self.paths) != self.loaded_stat):
+            self.load_data()
+            return
+
+        # Classeur modifié depuis le chargement : mise à jour incrémentale en arrière-plan
+        if (hasattr(self, 'df') and not self.loading and self.refresher is None
+                and self.loaded_stat is not None and workbooks_stat(self.paths) != self.loaded_stat):
+            self.refresher = BadgeRefresher(self.df, self.index, self.fuzzy, self.aggregates, self.paths[0],
+                                            compact=self.compact)
+            self.refresher.start()
+            self.status_var.set("Fichier modifié : mise à jour des données...")
+            self.root.after(50, self.poll_refresher)
+            return
+
         if hasattr(self, 'df'):
-            self.display_results(self.df)
+            self.display_results(self.site_frame())
+            self.search_term = ""
+            self.search_generation += 1
             self.search_var.set("")
             self.details_text.config(state='normal')
             self.details_text.delete(1.0, tk.END)
             self.details_text.config(state='disabled')
-            self.update_stats()
+            self.schedule_stats()
             self.status_var.set("Données actualisées")
             self.current_selection = None
+            self.details_key = None
         
+    def poll_refresher(self):
+        try:
+            message = self.refresher.messages.get_nowait()
+        except queue.Empty:
+            self.root.after(50, self.poll_refresher)
+            return
+
+        self.refresher = None
+        kind = message[0]
+        if kind == 'changes':
+            _, merged, stat, inserted, updated, deleted = message
+            showing_all = self.virtual.df is self.df
+            self.df = merged
+            self.loaded_stat = (stat,)
+            self.schedule_stats()
+            if showing_all or not self.search_term:
+                self.virtual.set_frame(self.site_frame(), keep_offset=True)
+            else:
+                self.search()
+            self.status_var.set(f"Données actualisées : {inserted} ajout(s), {updated} modification(s), "
+                                f"{deleted} suppression(s)")
+        elif kind == 'reload':
+            self.load_data()
+        elif kind == 'error':
+            messagebox.showerror("Erreur", f"Impossible de relire le fichier:\n{message[1]}")
+
+    def export_results(self):
+        if self.virtual.df is None or len(self.virtual.df) == 0:
+            messagebox.showinfo("Export", "Aucun résultat à exporter.")
+            return
+        self.start_export(self.virtual.df, "resultats_badges")
+
+    def export_list(self, kind):
+        if not hasattr(self, 'df'):
+            return
+        state = self.badge_state()
+        if state.count(kind) == 0:
+            messagebox.showinfo("Export", "Aucun badge à exporter pour cette liste.")
+            return
+        self.start_export(state.select(kind), f"badges_{kind}")
+
+    def start_export(self, df, name):
+        if self.export_job is not None:
+            messagebox.showinfo("Export", "Un export est déjà en cours.")
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".csv", initialfile=name, filetypes=EXPORT_FILETYPES)
+        if not path:
+            return
+
+        self.export_job = ExportJob(df, path)
+        self.export_job.start()
+        self.export_cancel_btn.state(['!disabled'])
+        self.status_var.set(f"Export de {len(df)} lignes vers {os.path.basename(path)}...")
+        self.root.after(100, self.poll_export)
+
+    def cancel_export(self):
+        # Le fichier temporaire est supprimé par le thread d'export ; le fichier choisi n'est pas créé
+        if self.export_job is not None:
+            self.export_job.cancel()
+            self.status_var.set("Annulation de l'export...")
+
+    def poll_export(self):
+        job = self.export_job
+        message = None
+        try:
+            while True:
+                message = job.messages.get_nowait()
+                if message[0] != 'progress':
+                    break
+                self.status_var.set(f"Export : {message[1]} / {message[2]} lignes")
+        except queue.Empty:
+            self.root.after(100, self.poll_export)
+            return
+
+        self.export_job = None
+        self.export_cancel_btn.state(['disabled'])
+        if message[0] == 'done':
+            self.status_var.set(f"Export terminé : {message[1]} lignes dans {os.path.basename(job.path)}")
+        elif message[0] == 'cancelled':
+            self.status_var.set("Export annulé")
+        else:
+            messagebox.showerror("Erreur", f"Échec de l'export:\n{message[1]}")
+
+    @instrumented('show_graphs')
     def show_graphs(self):
         try:
             if not hasattr(self, 'df') or self.df.empty:
                 messagebox.showerror("Erreur", "Aucune donnée disponible pour les graphiques")
                 return
 
+            # Fenêtre déjà ouverte : on la remet au premier plan avec des graphiques à jour
+            if self.graph_window is not None:
+                self.update_graphs()
+                self.graph_window.deiconify()
+                self.graph_window.lift()
+                return
+
+            self.timer.mark("matplotlib importé", load_plotting())
+
             graph_window = tk.Toplevel(self.root)
             graph_window.title("Statistiques Avancées")
             graph_window.geometry("1100x750")
+            graph_window.protocol("WM_DELETE_WINDOW", self.close_graphs)
             
-            # Vérifier les styles disponibles et utiliser un style de repli
-            available_styles = plt.style.available
-            preferred_styles = ['seaborn-v0_8', 'seaborn', 'ggplot', 'classic']
-            selected_style = next((style for style in preferred_styles if style in available_styles), 'classic')
-            plt.style.use(selected_style)
-            
-            plt.rcParams.update({
-                'font.size': 10,
-                'axes.titlesize': 12,
-                'axes.labelsize': 10
-            })
+            if not self.graph_style_applied:
+                # Vérifier les styles disponibles et utiliser un style de repli
+                available_styles = plt.style.available
+                preferred_styles = ['seaborn-v0_8', 'seaborn', 'ggplot', 'classic']
+                selected_style = next((style for style in preferred_styles if style in available_styles), 'classic')
+                plt.style.use(selected_style)
+                
+                plt.rcParams.update({
+                    'font.size': 10,
+                    'axes.titlesize': 12,
+                    'axes.labelsize': 10
+                })
+                self.graph_style_applied = True
 
             notebook = ttk.Notebook(graph_window)
             notebook.pack(fill=tk.BOTH, expand=True)
+            artists = {}
+
+            state = self.badge_state()
 
             # Onglet 1 - Statut des badges
             tab1 = ttk.Frame(notebook)
             fig1 = plt.Figure(figsize=(6, 5), dpi=100)
             ax1 = fig1.add_subplot(111)
             
-            status_counts = self.df['Token_Status'].value_counts()
-            labels = ['Actif' if x == 1 else 'Inactif' for x in status_counts.index]
+            status_counts = [state.active_count, state.inactive_count]
+            labels = ['Actif', 'Inactif']
             colors = ['#4CAF50', '#F44336']  # Vert/Rouge
             
-            wedges, _, _ = ax1.pie(
+            wedges, texts, autotexts = ax1.pie(
                 status_counts,
                 labels=labels,
                 colors=colors,
@@ -382,35 +3938,53 @@ class EnhancedBadgeApp:
             canvas1.draw()
             canvas1.get_tk_widget().pack(fill=tk.BOTH, expand=True)
             notebook.add(tab1, text="Statut")
+            artists['status'] = (canvas1, wedges, texts, autotexts)
 
             # Onglet 2 - Évolution temporelle
             tab2 = ttk.Frame(notebook)
             fig2 = plt.Figure(figsize=(8, 5), dpi=100)
             ax2 = fig2.add_subplot(111)
             
-            self.df['Issue_Date'] = pd.to_datetime(self.df['Issue_Date'], errors='coerce', dayfirst=True)
-            monthly = self.df.dropna(subset=['Issue_Date']).set_index('Issue_Date').resample('M').size()
+            monthly = self.site_aggregates().monthly_series()
             
-            if not monthly.empty:
-                monthly.plot(
-                    ax=ax2,
-                    marker='o',
-                    color='#2196F3',
-                    linestyle='-',
-                    linewidth=2,
-                    markersize=6
-                )
-                
-                ax2.set_title('Badges émis par mois', fontweight='bold')
-                ax2.set_xlabel('Mois', labelpad=10)
-                ax2.set_ylabel('Nombre de badges', labelpad=10)
-                ax2.grid(True, linestyle=':', alpha=0.6)
-                fig2.autofmt_xdate(rotation=45)
+            line, = ax2.plot(
+                monthly.index,
+                monthly.values,
+                marker='o',
+                color='#2196F3',
+                linestyle='-',
+                linewidth=2,
+                markersize=6
+            )
+            
+            ax2.set_title('Badges émis par mois', fontweight='bold')
+            ax2.set_xlabel('Mois', labelpad=10)
+            ax2.set_ylabel('Nombre de badges', labelpad=10)
+            ax2.grid(True, linestyle=':', alpha=0.6)
+            fig2.autofmt_xdate(rotation=45)
             
             canvas2 = FigureCanvasTkAgg(fig2, master=tab2)
             canvas2.draw()
             canvas2.get_tk_widget().pack(fill=tk.BOTH, expand=True)
             notebook.add(tab2, text="Évolution")
+            artists['monthly'] = (canvas2, ax2, line)
+
+            # Onglet Échéances - badges expirant par jour / semaine / mois sur la fenêtre choisie
+            if state.has_expiry:
+                tab4 = ttk.Frame(notebook)
+                self.expiry_window_var = tk.StringVar(value=EXPIRY_CHART_WINDOWS[1][0])
+                window_box = ttk.Combobox(tab4, textvariable=self.expiry_window_var, state='readonly',
+                                          values=[label for label, _, _, _ in EXPIRY_CHART_WINDOWS])
+                window_box.pack(anchor=tk.W, padx=5, pady=5)
+                fig4 = plt.Figure(figsize=(8, 5), dpi=100)
+                ax4 = fig4.add_subplot(111)
+                canvas4 = FigureCanvasTkAgg(fig4, master=tab4)
+                canvas4.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+                notebook.add(tab4, text="Échéances")
+                artists['expiry'] = (canvas4, ax4)
+                self.draw_expiry_bars(canvas4, ax4, state)
+                window_box.bind("<<ComboboxSelected>>",
+                                lambda event: self.draw_expiry_bars(canvas4, ax4, self.badge_state()))
 
             # Onglet 3 - Types de badges (si colonne existe)
             if 'Type' in self.df.columns:
@@ -418,36 +3992,99 @@ class EnhancedBadgeApp:
                 fig3 = plt.Figure(figsize=(8, 6), dpi=100)
                 ax3 = fig3.add_subplot(111)
                 
-                type_counts = self.df['Type'].value_counts()
-                if not type_counts.empty:
-                    colors = plt.cm.tab20(range(len(type_counts)))
-                    bars = ax3.bar(
-                        type_counts.index.astype(str),
-                        type_counts.values,
-                        color=colors,
-                        edgecolor='grey',
-                        linewidth=0.5
-                    )
-                    
-                    ax3.set_title('Types de badges', fontweight='bold')
-                    ax3.set_xlabel('Type de badge')
-                    ax3.set_ylabel('Nombre')
-                    ax3.grid(axis='y', linestyle=':', alpha=0.6)
-                    
-                    for bar in bars:
-                        height = bar.get_height()
-                        ax3.text(bar.get_x() + bar.get_width()/2., height,
-                                f"{height}", ha='center', va='bottom', fontsize=9)
-                
                 canvas3 = FigureCanvasTkAgg(fig3, master=tab3)
-                canvas3.draw()
                 canvas3.get_tk_widget().pack(fill=tk.BOTH, expand=True)
                 notebook.add(tab3, text="Types")
+                artists['types'] = (canvas3, ax3) + self.draw_type_bars(canvas3, ax3, self.site_aggregates().type_counts())
+
+            self.graph_window = graph_window
+            self.graph_artists = artists
+            self.graph_versions = self.graph_version(state)
 
         except Exception as e:
             messagebox.showerror("Erreur Graphique", f"Erreur lors de la génération des graphiques:\n{str(e)}")
             if 'graph_window' in locals():
                 graph_window.destroy()
+            self.graph_window = None
+
+    def close_graphs(self):
+        self.graph_window.destroy()
+        self.graph_window = None
+        self.graph_artists = None
+
+    def draw_type_bars(self, canvas, ax, type_counts):
+        ax.clear()
+        bars, labels = [], []
+        if not type_counts.empty:
+            colors = plt.cm.tab20(range(len(type_counts)))
+            bars = ax.bar(
+                type_counts.index.astype(str),
+                type_counts.values,
+                color=colors,
+                edgecolor='grey',
+                linewidth=0.5
+            )
+            
+            ax.set_title('Types de badges', fontweight='bold')
+            ax.set_xlabel('Type de badge')
+            ax.set_ylabel('Nombre')
+            ax.grid(axis='y', linestyle=':', alpha=0.6)
+            
+            for bar in bars:
+                height = bar.get_height()
+                labels.append(ax.text(bar.get_x() + bar.get_width()/2., height,
+                                      f"{height}", ha='center', va='bottom', fontsize=9))
+        canvas.draw_idle()
+        return list(type_counts.index), bars, labels
+
+    def draw_expiry_bars(self, canvas, ax, state):
+        label, days, step, date_format = next(window for window in EXPIRY_CHART_WINDOWS
+                                              if window[0] == self.expiry_window_var.get())
+        edges = expiry_edges(state.today, days, step)
+        counts = state.expiry_counts(edges)
+        ax.clear()
+        ax.bar(edges[:-1].strftime(date_format), counts, color='#FF9800', edgecolor='grey', linewidth=0.5)
+        ax.set_title(f'Badges expirant - {label}', fontweight='bold')
+        ax.set_ylabel('Nombre')
+        ax.tick_params(axis='x', labelrotation=45, labelsize=8)
+        ax.grid(axis='y', linestyle=':', alpha=0.6)
+        canvas.draw_idle()
+
+    def graph_version(self, state):
+        return self.site, state.active_count, state.inactive_count, self.site_aggregates().version
+
+    def update_graphs(self):
+        # Met à jour les artistes existants seulement si les agrégats ont changé
+        state = self.badge_state()
+        versions = self.graph_version(state)
+        if versions == self.graph_versions or not self.graph_artists:
+            return
+        self.graph_versions = versions
+
+        canvas1, wedges, texts, autotexts = self.graph_artists['status']
+        if state.total:
+            update_pie(wedges, autotexts, [state.active_count, state.inactive_count], texts=texts, pctdistance=0.85)
+        canvas1.draw_idle()
+
+        canvas2, ax2, line = self.graph_artists['monthly']
+        monthly = self.site_aggregates().monthly_series()
+        line.set_data(monthly.index, monthly.values)
+        ax2.relim()
+        ax2.autoscale_view()
+        canvas2.draw_idle()
+
+        if 'expiry' in self.graph_artists:
+            self.draw_expiry_bars(*self.graph_artists['expiry'], state)
+
+        if 'types' in self.graph_artists:
+            canvas3, ax3, type_index, bars, labels = self.graph_artists['types']
+            type_counts = self.site_aggregates().type_counts()
+            if list(type_counts.index) == type_index:
+                update_bars(ax3, bars, labels, type_counts.values)
+                canvas3.draw_idle()
+            else:
+                self.graph_artists['types'] = (canvas3, ax3) + self.draw_type_bars(canvas3, ax3, type_counts)
+
     def open_ai_chat(self):
         self.chat_window = tk.Toplevel(self.root)
         self.chat_window.title("Assistant Virtuel ANP")
@@ -472,6 +4109,21 @@ class EnhancedBadgeApp:
                              command=lambda q=question: self.insert_question(q))
             btn.pack(side=tk.TOP, fill=tk.X, pady=2)
 
+        export_frame = ttk.LabelFrame(chat_frame, text="Exporter une liste", padding=10)
+        export_frame.pack(fill=tk.X, pady=(0, 10))
+
+        for text, kind in [("Badges expirés", 'expired'), ("Badges expirant ce mois", 'expiring'), ("VIP", 'vip')]:
+            btn = ttk.Button(export_frame, text=text, command=lambda k=kind: self.export_list(k))
+            btn.pack(side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+
+        batch_frame = ttk.LabelFrame(chat_frame, text="Rapport en lot", padding=10)
+        batch_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Button(batch_frame, text="Questions du rapport",
+                   command=lambda: self.ask_batch_report(self.batch_questions)).pack(
+            side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+        ttk.Button(batch_frame, text="Depuis un fichier...", command=self.ask_batch_report).pack(
+            side=tk.LEFT, expand=True, fill=tk.X, padx=2)
+
         self.chat_history = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD,
                                                       font=('Helvetica', 10), state='disabled')
         self.chat_history.pack(fill=tk.BOTH, expand=True)
@@ -485,6 +4137,10 @@ class EnhancedBadgeApp:
         send_btn = ttk.Button(input_frame, text="Envoyer", command=self.send_ai_message)
         send_btn.pack(side=tk.RIGHT)
 
+        self.assistant_status_var = tk.StringVar()
+        ttk.Label(chat_frame, textvariable=self.assistant_status_var).pack(fill=tk.X)
+        self.update_assistant_status()
+
         self.add_to_chat("Assistant: Bonjour! Je suis l'assistant ANP pour la gestion des badges.\n"
                          "Je peux vous fournir:\n"
                          "- Des statistiques sur les badges\n"
@@ -504,218 +4160,353 @@ class EnhancedBadgeApp:
 
     def send_ai_message(self):
         user_msg = self.user_input.get()
-        if not user_msg:
+        if not user_msg.strip():
             return
 
         self.add_to_chat(f"Vous: {user_msg}")
         self.user_input.delete(0, tk.END)
 
-        threading.Thread(target=self.process_ai_response, args=(user_msg,), daemon=True).start()
+        if not self.dispatcher.submit(user_msg):
+            self.add_to_chat("Assistant: Trop de questions en attente, veuillez patienter.")
+        self.update_assistant_status()
 
-    def process_ai_response(self, user_msg):
-        response = self.generate_ai_response(user_msg)
-        self.chat_window.after(0, self.add_to_chat, f"Assistant: {response}")
+    def deliver_ai_response(self, response):
+        # Appelé depuis un thread de travail, dans l'ordre des questions
+        try:
+            self.chat_window.after(0, self.show_ai_response, response)
+        except (tk.TclError, RuntimeError):
+            pass
 
-    def open_ai_chat(self):
-        self.chat_window = tk.Toplevel(self.root)
-        self.chat_window.title("Assistant Virtuel ANP")
-        self.chat_window.geometry("600x700")
+    def show_ai_response(self, response):
+        self.add_to_chat(f"Assistant: {response}")
+        self.update_assistant_status()
 
-        chat_frame = ttk.Frame(self.chat_window)
-        chat_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+    def update_assistant_status(self):
+        self.assistant_status_var.set(
+            f"File d'attente : {self.dispatcher.depth()} | Latence moyenne : {self.dispatcher.latency_ms():.0f} ms")
+    
+# ... (tout le code précédent reste inchangé jusqu'à la méthode generate_ai_response)
 
-        suggested_frame = ttk.LabelFrame(chat_frame, text="Questions suggérées", padding=10)
-        suggested_frame.pack(fill=tk.X, pady=(0, 10))
+    def generate_ai_response(self, user_msg):
+        if not hasattr(self, "df") or self.df is None:
+            return "Erreur : les données ne sont pas chargées. Veuillez importer un fichier."
+        if isinstance(self.store, BadgeClient):
+            return self.store.ask(user_msg, self.site)
+        # Un site cité dans la question prime sur le filtre de la fenêtre principale
+        site = mentioned_site(user_msg, self.sites) or self.site
+        with PERF.span(f"generate_ai_response:{self.assistant.route(user_msg)}"):
+            response = self.assistant.answer(self.site_state(site), user_msg, self.site_aggregates(site))
+        return response if site is None else f"[{site}] {response}"
 
-        suggested_questions = [
-            "Statut des badges",
-            "Liste des badges expirés",
-            "Badges expirant ce mois",
-            "Nombre de VIP",
-            "Statistiques complètes"
-        ]
+    def batch_answers(self, questions, site=None):
+        # Un seul état et un seul jeu d'agrégats pour toutes les questions du lot ; site_state et
+        # site_aggregates prennent state_lock, le lot peut donc tourner hors du thread Tk
+        if isinstance(self.store, BadgeClient):
+            return self.store.ask_batch(questions, site)
+        with PERF.span('assistant_batch'):
+            results = self.batch_assistant.answer_batch(self.site_state(site), questions, self.site_aggregates(site))
+        if site is None:
+            return results
+        return [(question, intent, f"[{site}] {answer}") for question, intent, answer in results]
 
-        for question in suggested_questions:
-            btn = ttk.Button(suggested_frame, text=question,
-                             command=lambda q=question: self.insert_question(q))
-            btn.pack(side=tk.TOP, fill=tk.X, pady=2)
+    def ask_batch_report(self, questions=None):
+        if questions is None:
+            source = filedialog.askopenfilename(parent=self.chat_window, title="Questions (une par ligne)",
+                                                filetypes=[("Texte", "*.txt"), ("Tous les fichiers", "*.*")])
+            if not source:
+                return
+            try:
+                questions = read_questions(source)
+            except (OSError, UnicodeDecodeError) as e:
+                messagebox.showerror("Erreur", f"Lecture impossible : {e}", parent=self.chat_window)
+                return
+            if not questions:
+                messagebox.showinfo("Rapport en lot", "Aucune question dans ce fichier.", parent=self.chat_window)
+                return
+        path = filedialog.asksaveasfilename(
+            parent=self.chat_window, defaultextension=".txt",
+            initialfile=BATCH_REPORT_PATTERN.format(date=datetime.now().strftime('%Y-%m-%d')),
+            filetypes=[("Texte", "*.txt"), ("JSON", "*.json")])
+        if path:
+            self.run_batch_report(path, questions)
 
-        self.chat_history = scrolledtext.ScrolledText(chat_frame, wrap=tk.WORD,
-                                                      font=('Helvetica', 10), state='disabled')
-        self.chat_history.pack(fill=tk.BOTH, expand=True)
+    def run_batch_report(self, path, questions):
+        # Le lot tourne hors du thread Tk ; le statut revient par root.after
+        if self.batch_running or not hasattr(self, "df") or self.df is None:
+            return False
+        self.batch_running = True
+        self.status_var.set(f"Rapport en lot : {len(questions)} questions...")
+        site = self.site
 
-        input_frame = ttk.Frame(chat_frame)
-        input_frame.pack(fill=tk.X, pady=5)
+        def work():
+            try:
+                write_batch_report(self.batch_answers(questions, site), path, batch_title())
+                message = f"Rapport en lot enregistré : {path}"
+            except Exception as e:
+                message = f"Rapport en lot impossible : {e}"
+            self.root.after(0, self.finish_batch_report, message)
 
-        self.user_input = ttk.Entry(input_frame)
-        self.user_input.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        threading.Thread(target=work, name="assistant-batch", daemon=True).start()
+        return True
 
-        send_btn = ttk.Button(input_frame, text="Envoyer", command=self.send_ai_message)
-        send_btn.pack(side=tk.RIGHT)
+    def finish_batch_report(self, message):
+        self.batch_running = False
+        self.status_var.set(message)
 
-        self.add_to_chat("Assistant: Bonjour! Je suis l'assistant ANP pour la gestion des badges.\n"
-                         "Je peux vous fournir:\n"
-                         "- Des statistiques sur les badges\n"
-                         "- Des listes de badges spécifiques\n"
-                         "- Des informations détaillées\n\n"
-                         "Posez-moi votre question ou cliquez sur une suggestion ci-dessus.")
+    def schedule_batch(self):
+        # --batch-at HH:MM : rapport quotidien tant que l'application est ouverte
+        if self.batch_at is None:
+            return
+        self.batch_next = next_run(self.batch_at, datetime.now())
+        self.root.after(BATCH_CHECK_MS, self.check_batch)
 
-    def insert_question(self, question):
-        self.user_input.delete(0, tk.END)
-        self.user_input.insert(0, question)
+    def check_batch(self):
+        now = datetime.now()
+        if now >= self.batch_next:
+            path = os.path.join(self.batch_dir, BATCH_REPORT_PATTERN.format(date=self.batch_next.strftime('%Y-%m-%d')))
+            # Données pas encore chargées ou lot en cours : nouvel essai à la prochaine vérification
+            if self.run_batch_report(path, self.batch_questions):
+                self.batch_next = next_run(self.batch_at, now)
+        self.root.after(BATCH_CHECK_MS, self.check_batch)
 
-    def add_to_chat(self, message):
-        self.chat_history.config(state='normal')
-        self.chat_history.insert(tk.END, message + "\n\n")
-        self.chat_history.config(state='disabled')
-        self.chat_history.see(tk.END)
 
-    def send_ai_message(self):
-        user_msg = self.user_input.get()
-        if not user_msg.strip():
-            return
+def badge_stats(state, days=EXPIRING_DAYS):
+    return {
+        'total': state.total,
+        'active': state.active_count,
+        'inactive': state.inactive_count,
+        'expired': state.expired_count,
+        f'expiring_{days}_days': state.count('expiring', days),
+        'vip': state.vip_count,
+    }
 
-        self.add_to_chat(f"Vous: {user_msg}")
-        self.user_input.delete(0, tk.END)
 
-        threading.Thread(target=self.process_ai_response, args=(user_msg,), daemon=True).start()
-    
-    def compute_status_masks(df):
-        import pytz
-        import pandas as pd
+def badge_report(state, kind, days=EXPIRING_DAYS):
+    if kind == 'stats':
+        return pd.DataFrame([badge_stats(state, days)])
+
+    selected = state.select(kind, days)
+    report = selected[[col for col in REPORT_COLUMNS if col in selected.columns]].copy()
+    if 'Deactivation_Date' in report.columns:
+        report['Days_Left'] = (selected['Deactivation_Date'] - state.today).dt.days.astype('Int64')
+        report['Deactivation_Date'] = report['Deactivation_Date'].dt.strftime('%Y-%m-%d')
+    return report
+
+
+def memory_report(df):
+    # Empreinte du DataFrame complet et de sa version compacte (--compact)
+    compact = compact_badges(df)
+    before, after = frame_memory(df), frame_memory(compact)
+    return pd.DataFrame([{
+        'rows': len(df),
+        'columns': df.shape[1],
+        'compact_columns': compact.shape[1],
+        'bytes': before,
+        'compact_bytes': after,
+        'ratio': round(before / max(after, 1), 2),
+    }])
+
+
+def assistant_report(state, questions, aggregates=None):
+    results = AssistantEngine(page_size=None).answer_batch(state, questions, aggregates)
+    return pd.DataFrame(results, columns=['Question', 'Intent', 'Answer'])
+
+
+def process_workbook(path, kind, days=EXPIRING_DAYS, use_cache=True, backend='excel', questions=None):
+    # Point d'entrée des processus de travail : un classeur -> un rapport
+    if kind == 'memory':
+        report = memory_report(load_badges(path, use_cache=use_cache))
+        report.insert(0, 'Workbook', os.path.basename(path))
+        return report
+    if backend == 'sqlite':
+        store = SQLiteStore(sqlite_path(path))
+        if not store.is_current(path):
+            store.import_workbook(path)
+        state = SQLiteState(store.view())
+        aggregates = store
+    else:
+        df = load_badges(path, use_cache=use_cache)
+        state = BadgeState(df)
+        if kind == 'assistant':
+            # Cube du cache si présent, sinon agrégé ici (et enregistré pour la prochaine fois)
+            aggregates = BadgeAggregates()
+            cube = read_cube(path) if use_cache else None
+            if cube is not None:
+                aggregates.load(cube)
+            else:
+                aggregates.add(df)
+                if use_cache:
+                    write_cube(path, aggregates.cube)
+    if kind == 'assistant':
+        report = assistant_report(state, questions or ASSISTANT_BATCH_QUESTIONS, aggregates)
+    else:
+        report = badge_report(state, kind, days)
+    report.insert(0, 'Workbook', os.path.basename(path))
+    return report
 
-        df = df.copy()
-        today = pd.Timestamp.now(tz=pytz.UTC)
 
-        # Conversion Deactivation_Date
-        if 'Deactivation_Date' in df.columns:
-            df['Deactivation_Date'] = pd.to_datetime(df['Deactivation_Date'], errors='coerce')
+def write_report(report, out, fmt, header):
+    if fmt == 'text':
+        if 'Answer' in report.columns:
+            workbook = report['Workbook'].iloc[0] if len(report) else ''
+            results = report[['Question', 'Intent', 'Answer']].itertuples(index=False, name=None)
+            out.write(format_batch_report(list(results), f"{batch_title()} ({workbook})") + "\n")
         else:
-            df['Deactivation_Date'] = pd.NaT
+            out.write(report.to_string(index=False) + "\n\n")
+    elif fmt == 'json':
+        if len(report):
+            out.write(report.to_json(orient='records', lines=True, force_ascii=False).rstrip('\n') + '\n')
+    else:
+        report.to_csv(out, index=False, header=header)
+    out.flush()
 
-        # Expirés : date de désactivation passée
-        expired_mask = df['Deactivation_Date'].notna() & (df['Deactivation_Date'] < today)
 
-        # Actifs : Token_Status = 1 ou 4 et pas expiré
-        active_mask = df['Token_Status'].isin([1,4]) & (~expired_mask)
+def run_report(args):
+    paths = [path for source in args.workbooks or [EXCEL_FILE] for path in site_workbooks(source)]
+    questions = read_questions(args.questions) if args.questions else None
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    executor = ProcessPoolExecutor(max_workers=args.jobs) if len(paths) > 1 and args.jobs != 1 else None
+    try:
+        if executor is not None:
+            results = executor.map(process_workbook, paths, [args.report] * len(paths), [args.days] * len(paths),
+                                   [not args.no_cache] * len(paths), [args.backend] * len(paths),
+                                   [questions] * len(paths))
+        else:
+            results = (process_workbook(path, args.report, args.days, not args.no_cache, args.backend, questions)
+                       for path in paths)
 
-        # Inactifs : tout le reste
-        inactive_mask = ~active_mask
+        # Chaque rapport est écrit dès qu'il est prêt (dans l'ordre des classeurs)
+        for position, report in enumerate(results):
+            write_report(report, out, args.format, header=position == 0)
+    finally:
+        # Aussi en cas d'erreur : les classeurs non commencés sont abandonnés, aucun processus ne survit
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if out is not sys.stdout:
+            out.close()
 
-        return active_mask, inactive_mask, expired_mask
 
-# ... (tout le code précédent reste inchangé jusqu'à la méthode generate_ai_response)
+def run_scheduled(args):
+    # Rapport quotidien sans cron : attend l'heure, produit le rapport ({date} dans --output), recommence
+    at = parse_clock(args.at)
+    try:
+        while True:
+            when = next_run(at, datetime.now())
+            time.sleep(max((when - datetime.now()).total_seconds(), 0))
+            output = args.output.format(date=when.strftime('%Y-%m-%d')) if args.output else None
+            try:
+                if output and os.path.dirname(output):
+                    os.makedirs(os.path.dirname(output), exist_ok=True)
+                run_report(argparse.Namespace(**dict(vars(args), output=output)))
+            except Exception as e:
+                print(f"Erreur : {e}", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
 
-    def generate_ai_response(self, user_msg):
+
+def run_server(args):
+    service = BadgeService(site_workbooks(args.sites), compact=args.compact)
+    server = BadgeServer(service, args.host, args.port, workers=args.workers)
+    print(f"Serveur prêt sur http://{args.host}:{args.port} ({len(service.df)} enregistrements)", file=sys.stderr)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ANP - Système Intelligent de Gestion des Badges")
+    parser.add_argument('--backend', choices=['excel', 'sqlite'], default='excel',
+                        help="Source des données : classeur en mémoire ou base SQLite indexée")
+    parser.add_argument('--db', help=f"Base SQLite (défaut : {sqlite_path(EXCEL_FILE)})")
+    parser.add_argument('--sites', default=EXCEL_FILE,
+                        help="Classeur, dossier ou motif glob : un classeur par site, fusionnés au chargement")
+    parser.add_argument('--server', help="Client léger d'un serveur anpp (ex. http://127.0.0.1:8765)")
+    parser.add_argument('--compact', action='store_true',
+                        help="Mode mémoire compact : colonnes utiles seulement, catégories, noms en minuscules")
+    parser.add_argument('--batch-at', help="Rapport quotidien de l'assistant à l'heure HH:MM (application ouverte)")
+    parser.add_argument('--batch-dir', default=".", help="Dossier des rapports planifiés (défaut : dossier courant)")
+    parser.add_argument('--batch-questions', help="Questions du rapport en lot, une par ligne")
+    parser.add_argument('--timings', action='store_true',
+                        help="Affiche les temps de démarrage sur la sortie d'erreur")
+    parser.add_argument('--profile', action='store_true',
+                        help="Active la capture cProfile dès le démarrage (onglet Diagnostics)")
+    subparsers = parser.add_subparsers(dest='command')
+
+    report = subparsers.add_parser('report', help="Rapport sans interface graphique (expirés, expirants, statistiques)")
+    report.add_argument('workbooks', nargs='*', help=f"Classeurs Excel, dossiers ou motifs glob (défaut : {EXCEL_FILE})")
+    report.add_argument('--report', choices=REPORT_KINDS, default='stats')
+    report.add_argument('--days', type=int, default=EXPIRING_DAYS, help="Fenêtre d'expiration en jours")
+    report.add_argument('--format', choices=['csv', 'json', 'text'], default='csv',
+                        help="CSV, JSON Lines ou texte consolidé")
+    report.add_argument('--questions', help="Questions de l'assistant, une par ligne (--report assistant)")
+    report.add_argument('--at', help="Planification quotidienne HH:MM ; --output peut contenir {date}")
+    report.add_argument('--output', help="Fichier de sortie (défaut : sortie standard)")
+    report.add_argument('--jobs', type=int, default=None, help="Nombre de processus pour plusieurs classeurs")
+    report.add_argument('--no-cache', action='store_true', help="Ignorer le cache du classeur")
+    report.add_argument('--backend', choices=['excel', 'sqlite'], default='excel',
+                        help="sqlite : importe chaque classeur dans une base indexée voisine")
+
+    serve = subparsers.add_parser('serve', help="Serveur HTTP/JSON local : données chargées une fois pour tous les postes")
+    serve.add_argument('--sites', default=argparse.SUPPRESS, help="Classeur, dossier ou motif glob (voir --sites)")
+    serve.add_argument('--compact', action='store_true', default=argparse.SUPPRESS, help="Mode mémoire compact")
+    serve.add_argument('--host', default=SERVER_HOST, help=f"Adresse d'écoute (défaut : {SERVER_HOST})")
+    serve.add_argument('--port', type=int, default=SERVER_PORT, help=f"Port (défaut : {SERVER_PORT})")
+    serve.add_argument('--workers', type=int, default=SERVER_WORKERS, help="Threads de traitement des requêtes")
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        try:
+            run_server(args)
+        except Exception as e:
+            print(f"Erreur : {e}", file=sys.stderr)
+            return 1
+        return 0
+    if args.command == 'report':
+        if args.at is not None:
+            try:
+                parse_clock(args.at)
+            except ValueError:
+                parser.error(f"--at attend une heure HH:MM, pas {args.at}")
         try:
-            if not hasattr(self, "df") or self.df is None:
-                return "Erreur : les données ne sont pas chargées. Veuillez importer un fichier."
-
-            user_msg = user_msg.lower().strip()
-            df = self.df.copy()
-            today = datetime.now(pytz.utc)
-            response = ""
-
-            if 'Deactivation_Date' in df.columns:
-                df['Deactivation_Date'] = pd.to_datetime(df['Deactivation_Date'], errors='coerce')
-                days_left = (df['Deactivation_Date'] - today).dt.days
-                expired_mask = (days_left < 0)
+            if args.at is not None:
+                run_scheduled(args)
             else:
-                days_left = None
-                expired_mask = pd.Series(False, index=df.index)
-
-            # Nouveau calcul des statuts
-            active_mask = (df['Token_Status'] == 1) & (~expired_mask)
-            inactive_mask = (df['Token_Status'] != 1) | expired_mask
-            active_count = active_mask.sum()
-            inactive_count = inactive_mask.sum()
-            expired_count = expired_mask.sum()
-
-            # Greeting
-            if "bonjour" in user_msg or "salut" in user_msg:
-                response = (
-                    f"Bonjour !\n"
-                    f"- Badges actifs : {active_count}\n"
-                    f"- Inactifs : {inactive_count}\n"
-                    f"- Total : {len(df)}"
-                )
-
-            # Full statistics
-            elif "statistiques" in user_msg or "complet" in user_msg:
-                response = f"Statistiques globales :\n- Total : {len(df)}\n- Actifs : {active_count}\n- Inactifs : {inactive_count}\n"
-                if "VIP" in df.columns:
-                    response += f"- VIP : {len(df[df['VIP'] == 1])}\n"
-                if days_left is not None:
-                    response += f"- Expirés : {expired_count}\n"
-                    response += f"- Expirant dans 30 jours : {len(df[days_left.between(0, 30)])}"
-
-            # Liste des badges expirés
-            elif "liste des badges expirés" in user_msg:
-                if days_left is None:
-                    return "Les données ne contiennent pas les dates d'expiration."
-
-                expired = df[expired_mask]
-                if expired.empty:
-                    response = "Aucun badge n'est expiré pour le moment."
-                else:
-                    response = f"{len(expired)} badge(s) expirés :\n"
-                    for _, row in expired.head(20).iterrows():
-                        name = f"{row.get('First_Name', '')} {row.get('Last_Name', '')}".strip()
-                        date = row['Deactivation_Date'].strftime('%d/%m/%Y')
-                        response += f"- {name} (expiré le {date})\n"
-                    if len(expired) > 20:
-                        response += f"...et {len(expired) - 20} autres."
-
-            # Badges expirant ce mois
-            elif "badge expirant ce mois" in user_msg or "badges expirant ce mois" in user_msg:
-                if days_left is None:
-                    return "Les données ne contiennent pas les dates d'expiration."
-
-                expiring = df[days_left.between(0, 30)]
-                if expiring.empty:
-                    response = "Aucun badge n'expire ce mois."
-                else:
-                    response = f"{len(expiring)} badge(s) expirent ce mois :\n"
-                    for _, row in expiring.head(20).iterrows():
-                        name = f"{row.get('First_Name', '')} {row.get('Last_Name', '')}".strip()
-                        date = row['Deactivation_Date'].strftime('%d/%m/%Y')
-                        response += f"- {name} (expire le {date})\n"
-                    if len(expiring) > 20:
-                        response += f"...et {len(expiring) - 20} autres."
-
-            # VIP
-            elif "vip" in user_msg:
-                if "VIP" in df.columns:
-                    vip = df[df['VIP'] == 1]
-                    response = f"Nombre total de VIP : {len(vip)}\n"
-                    for _, row in vip.head(5).iterrows():
-                        name = f"{row.get('First_Name', '')} {row.get('Last_Name', '')}".strip()
-                        status = "Actif" if row['Token_Status'] == 1 and (not expired_mask[row.name] if 'Deactivation_Date' in df.columns else True) else "Inactif"
-                        response += f"- {name} ({status})\n"
-                else:
-                    response = "La colonne VIP est absente des données."
+                run_report(args)
+        except Exception as e:
+            print(f"Erreur : {e}", file=sys.stderr)
+            return 1
+        return 0
 
-            # Statut simple
-            elif "statut" in user_msg:
-                response = f"- Actifs : {active_count}\n- Inactifs : {inactive_count}"
-                if days_left is not None:
-                    response += f"\n- Expirés : {expired_count}\n- Expirant dans 30 jours : {len(df[days_left.between(0, 30)])}"
+    paths = site_workbooks(args.sites)
+    if not paths:
+        parser.error(f"aucun classeur trouvé pour --sites {args.sites}")
+    if len(paths) > 1 and (args.backend == 'sqlite' or args.db):
+        parser.error("--backend sqlite ne prend qu'un seul classeur")
 
-            # Fallback
-            else:
-                response = (
-                    "Je ne comprends pas votre demande. Essayez par exemple :\n"
-                    "- 'Liste des badges expirés'\n"
-                    "- 'Badges expirant ce mois'\n"
-                    "- 'Nombre de VIP'\n"
-                    "- 'Statistiques complètes'"
-                )
+    try:
+        batch_at = parse_clock(args.batch_at) if args.batch_at else None
+    except ValueError:
+        parser.error(f"--batch-at attend une heure HH:MM, pas {args.batch_at}")
+    batch_questions = read_questions(args.batch_questions) if args.batch_questions else None
 
-            return response
-# ... (le reste du code reste inchangé)
-        except Exception as e:
-            return f"Désolé, une erreur est survenue : {str(e)}"
-if __name__ == "__main__":
+    PERF.profiling = args.profile
+    timer = StartupTimer(verbose=args.timings)
+    timer.mark("modules importés")
+    if args.server:
+        store = BadgeClient(args.server)
+    elif args.backend == 'sqlite' or args.db:
+        store = SQLiteStore(args.db or sqlite_path(paths[0]))
+    else:
+        store = None
+    timer.mark("tkinter importé", load_tk())
     root = tk.Tk()
-    app = EnhancedBadgeApp(root)
-    root.mainloop()
\ No newline at end of file
+    timer.mark("Tk initialisé")
+    app = EnhancedBadgeApp(root, store=store, compact=args.compact, timer=timer, source=args.sites,
+                           batch_at=batch_at, batch_dir=args.batch_dir, batch_questions=batch_questions)
+    root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,362 @@
+# Banc d'essai reproductible d'anpp.py, sans interface graphique.
+#
+#   python bench_anpp.py                                   # 10k / 100k / 1M lignes
+#   python bench_anpp.py --sizes 10000 --repeat 3
+#   python bench_anpp.py --output new.json --compare old.json
+#
+# Les classeurs synthétiques (mêmes colonnes que BADGES.xlsx) sont générés une fois dans
+# bench_data/ pour une graine donnée ; les résultats sont écrits en JSON.
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import anpp
+
+BENCH_SIZES = [10000, 100000, 1000000]
+BENCH_SEED = 42
+BENCH_REPEAT = 5
+BENCH_LOAD_MAX = 100000
+BENCH_DATA_DIR = "bench_data"
+BENCH_OUTPUT = "bench_results.json"
+BENCH_REGRESSION = 1.2
+
+# En-têtes bruts du classeur exporté (normalize_badges remplace les espaces par des _)
+WORKBOOK_COLUMNS = ['Export UUID', 'External System ID', 'Status', 'Type', 'ID Modify Time', 'Load Date',
+                    'Partition', 'First Name', 'Last Name', 'Middle Name', 'Address', 'Roles', 'Token Unique',
+                    'Internal Number', 'Alternate Number', 'Embossed Number', 'Token Status', 'Issue Level',
+                    'PIN', 'Token Modify Time', 'Issue Date', 'Activation Date', 'Deactivation Date', 'VIP',
+                    'Never Expire', 'Download', 'Trace', 'Ext Access']
+WORKBOOK_DATE_FORMAT = '%m/%d/%Y %H:%M:%SZ'
+
+FIRST_NAMES = ['MOHAMMED', 'MOHAMED', 'AHMED', 'YOUSSEF', 'FATIMA', 'KHADIJA', 'HASSAN', 'RACHID', 'SAID',
+               'ABDELLAH', 'NAIMA', 'AICHA', 'OMAR', 'MUSTAPHA', 'KARIM', 'SOUAD', 'HOUDA', 'MINA', 'ZAKARIA',
+               'SANAE', 'HAMZA', 'AMINE', 'IMANE', 'NADIA', 'BRAHIM', 'ABDELKADER', 'LAILA', 'JAMAL', 'SAMIRA',
+               'HICHAM', 'ABDERRAHIM', 'MERYEM', 'OTHMANE', 'SALMA', 'ILYAS', 'FATIMA ZAHRA', 'NOUREDDINE',
+               'ABDELAZIZ', 'LATIFA', 'MOUNIR']
+NAME_PREFIXES = ['', '', '', 'EL ', 'BEN', 'AIT ', 'BOU', 'OUL']
+NAME_ROOTS = ['AMRANI', 'ALAOUI', 'IDRISSI', 'TAZI', 'BENNANI', 'FASSI', 'CHRAIBI', 'BERRADA', 'SEBTI', 'KETTANI',
+              'OUAZZANI', 'TAHIRI', 'ZIANI', 'HADDAD', 'MANSOURI', 'RAMI', 'NACIRI', 'SQALLI', 'BOUTARTA',
+              'DAHMACH', 'MAZOUZ', 'LAHLOU', 'JABRI', 'KADIRI', 'MOUSSAOUI', 'SABRI', 'YACOUBI', 'ZOUAOUI']
+NAME_SUFFIXES = ['', '', 'I', 'A', 'NE', 'OUI']
+ROLES = [('Agent Provisoire-Avant port,Agent Provisoire-Port de pêche', 0.38),
+         ('Agent permanent Avant Port,Agent permanent Port de Pêche', 0.23),
+         ('ANP-OPERATEUR ROLE,ANP-USER-ROLE-', 0.12),
+         (None, 0.09),
+         ('Agent Provisoire-Avant port,Agent Provisoire-Port de pêche,ANP-OPERATEUR ROLE,ANP-USER-ROLE-', 0.05),
+         ('Agent Provisoire-Avant port', 0.04),
+         ('Anp Type 1,Rôle ANP', 0.05),
+         ('Visiteur', 0.04)]
+
+SEARCH_TERMS = ['moh', 'mohammed', 'bennani', 'fatima zahra', 'amrani youssef', '1540', 'zzzz']
+SUGGESTION_TERMS = ['mohamed', 'benani', 'khadija', 'xyzt']
+ASSISTANT_QUESTIONS = [('greeting', "bonjour"),
+                       ('stats', "Statistiques complètes"),
+                       ('expired_list', "Liste des badges expirés"),
+                       ('next_page', "suivant"),
+                       ('expiring_month', "Badges expirant ce mois"),
+                       ('vip', "Nombre de VIP"),
+                       ('status', "statut"),
+                       ('fallback', "quelle est la météo ?")]
+
+
+def weighted_choice(rng, values, size, exponent=1.1):
+    # Distribution de Zipf : quelques valeurs très fréquentes, une longue traîne
+    weights = 1 / np.arange(1, len(values) + 1) ** exponent
+    return np.asarray(values, dtype=object)[rng.choice(len(values), size=size, p=weights / weights.sum())]
+
+
+def format_dates(dates):
+    return pd.Series(dates).dt.strftime(WORKBOOK_DATE_FORMAT).where(pd.notna(dates), None).to_numpy(dtype=object)
+
+
+def random_uuids(seeded, size):
+    return [f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+            for value in (f"{seeded.getrandbits(128):032x}" for _ in range(size))]
+
+
+def generate_badges(rows, seed=BENCH_SEED):
+    # Données au format du classeur brut : mêmes colonnes, mêmes formats de date, mêmes trous
+    rng = np.random.default_rng(seed)
+    seeded = random.Random(seed)
+
+    last_pool = sorted({prefix + root + suffix for prefix in NAME_PREFIXES for root in NAME_ROOTS
+                        for suffix in NAME_SUFFIXES})
+    seeded.shuffle(last_pool)
+    first = weighted_choice(rng, FIRST_NAMES, rows)
+    last = weighted_choice(rng, last_pool, rows, exponent=0.8)
+    # Saisie hétérogène : espaces de fin, casse mixte, prénoms manquants
+    first = np.where(rng.random(rows) < 0.05, np.char.add(first.astype(str), ' '), first)
+    last = np.where(rng.random(rows) < 0.05, np.char.capitalize(last.astype(str)), last)
+    first = np.where(rng.random(rows) < 0.1, None, first)
+
+    # Émissions groupées sur quelques campagnes, le reste étalé jusqu'à aujourd'hui
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now - timedelta(days=5 * 365)
+    campaigns = rng.choice(np.arange(0, 5 * 365, 90), size=8)
+    offsets = np.where(rng.random(rows) < 0.6, rng.choice(campaigns, size=rows) + rng.random(rows) * 4,
+                       rng.random(rows) * 5 * 365)
+    issue = pd.to_datetime(start) + pd.to_timedelta(offsets, unit='D')
+    issue = issue.floor('s')
+    validity = rng.choice([365, 731, 1826, -146], size=rows, p=[0.6, 0.3, 0.08, 0.02])
+    deactivation = issue + pd.to_timedelta(validity, unit='D')
+    activation = issue + pd.to_timedelta(np.where(rng.random(rows) < 0.8, 0, rng.random(rows) * 900), unit='D')
+    missing = rng.random(rows) < 0.04
+    issue, activation, deactivation = (dates.where(~missing) for dates in (issue, activation.floor('s'), deactivation))
+
+    roles, role_weights = zip(*ROLES)
+    internal = rng.permutation(rows) + 150000
+    has_external = rng.random(rows) < 0.04
+
+    data = {
+        'Export UUID': random_uuids(seeded, rows),
+        'External System ID': np.where(has_external, np.char.add('EXT', internal.astype(str)), None),
+        'Status': rng.choice([1, 2], size=rows, p=[0.98, 0.02]),
+        'Type': np.where(rng.random(rows) < 0.002, 'Employee', None),
+        'ID Modify Time': format_dates(issue + pd.to_timedelta(rng.random(rows) * 300, unit='D').floor('s')),
+        'Load Date': format_dates(issue - pd.Timedelta(seconds=16)),
+        'Partition': None,
+        'First Name': first,
+        'Last Name': last,
+        'Middle Name': None,
+        'Address': None,
+        'Roles': np.asarray(roles, dtype=object)[rng.choice(len(roles), size=rows, p=role_weights)],
+        'Token Unique': random_uuids(seeded, rows),
+        'Internal Number': np.where(missing, None, internal.astype(object)),
+        'Alternate Number': None,
+        'Embossed Number': None,
+        'Token Status': np.where(missing, None,
+                                 rng.choice([4, 1, 2], size=rows, p=[0.81, 0.16, 0.03]).astype(object)),
+        'Issue Level': np.where(missing, None, rng.choice([0, 4, 12], size=rows, p=[0.99, 0.008, 0.002])
+                                .astype(object)),
+        'PIN': None,
+        'Token Modify Time': format_dates(deactivation),
+        'Issue Date': format_dates(issue),
+        'Activation Date': format_dates(activation),
+        'Deactivation Date': format_dates(deactivation),
+        'VIP': None,
+        'Never Expire': None,
+        'Download': np.where(missing, None, True),
+        'Trace': np.where(rng.random(rows) < 0.005, 1, None),
+        'Ext Access': None,
+    }
+    return pd.DataFrame(data, columns=WORKBOOK_COLUMNS)
+
+
+def write_workbook(df, path):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Badges")
+    sheet.append(list(df.columns))
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        sheet.append(row)
+    workbook.save(path)
+
+
+def workbook_path(rows, seed, data_dir=BENCH_DATA_DIR):
+    # Classeur généré une seule fois par (taille, graine)
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"badges_{rows}_{seed}.xlsx")
+    if not os.path.exists(path):
+        write_workbook(generate_badges(rows, seed), path)
+    return path
+
+
+def measure(func, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(times) * 1000, 3),
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'mean_ms': round(statistics.mean(times) * 1000, 3),
+        'max_ms': round(max(times) * 1000, 3),
+    }
+
+
+def run_loader(path, use_cache):
+    loader = anpp.BadgeLoader(path, use_cache=use_cache)
+    loader.run()
+    df = None
+    while not loader.messages.empty():
+        message = loader.messages.get()
+        if message[0] == 'frame':
+            df = message[1]
+        elif message[0] == 'error':
+            raise message[1]
+    return df, loader
+
+
+def index_frame(df):
+    index, fuzzy, aggregates = anpp.SearchIndex(), anpp.FuzzyIndex(), anpp.BadgeAggregates()
+    for target in (index, fuzzy, aggregates):
+        target.add(df)
+    return index, fuzzy, aggregates
+
+
+def headless_app(df, index, fuzzy, aggregates):
+    # Instance sans fenêtre Tk : seuls les attributs lus par les méthodes mesurées sont posés
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    anpp.load_plotting()
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.df = df
+    app.index = index
+    app.fuzzy = fuzzy
+    app.aggregates = aggregates
+    app.store = None
+    app.site = None
+    app.sites = []
+    app.site_states = None
+    app.site_aggregates_cache = None
+    app.partial = None
+    app.state_lock = threading.Lock()
+    app.search_cache = OrderedDict()
+    app.search_cache_version = None
+    app.assistant = anpp.AssistantEngine()
+    app.batch_assistant = anpp.AssistantEngine(page_size=None)
+    app.figure = Figure(figsize=(5, 4), dpi=100)
+    app.canvas = FigureCanvasAgg(app.figure)
+    app.stats_counts = None
+    app.stats_artists = None
+    app.stats_pending = False
+    app.graph_window = None
+    return app
+
+
+def bench_size(rows, args):
+    results = {}
+    if rows <= args.load_max:
+        path = workbook_path(rows, args.seed, args.data_dir)
+        anpp.drop_cache(path)
+        load_repeat = max(1, args.repeat // 2)
+        results['load_data'] = measure(lambda: run_loader(path, use_cache=False), load_repeat)
+        run_loader(path, use_cache=True)
+        results['load_data_cached'] = measure(lambda: run_loader(path, use_cache=True), load_repeat)
+        df, loader = run_loader(path, use_cache=True)
+        index, fuzzy, aggregates = loader.index, loader.fuzzy, loader.aggregates
+    else:
+        # Au-delà de --load-max, la lecture Excel est trop lente : même normalisation, en mémoire
+        df = anpp.normalize_badges(generate_badges(rows, args.seed))
+        results['index_build'] = measure(lambda: index_frame(df), 1)
+        index, fuzzy, aggregates = index_frame(df)
+
+    app = headless_app(df, index, fuzzy, aggregates)
+
+    for term in SEARCH_TERMS:
+        def search(term=term):
+            anpp.select_labels(app.df, app.cached_search(term, app.df))
+        results[f'search[{term}]'] = measure(search, args.repeat, setup=app.search_cache.clear)
+
+    for term in SUGGESTION_TERMS:
+        results[f'get_suggestions[{term}]'] = measure(lambda term=term: app.get_suggestions(term), args.repeat,
+                                                      setup=app.fuzzy.cache.clear)
+
+    # display_results : formatage du premier bloc visible du Treeview virtuel (fenêtre + overscan)
+    block = 40 + 2 * anpp.VIRTUAL_OVERSCAN
+    results['display_results'] = measure(lambda: anpp.format_badge_rows(app.df.iloc[:block]), args.repeat)
+
+    def reset_stats():
+        app.site_states = None
+        app.stats_counts = None
+        app.stats_artists = None
+    results['update_stats'] = measure(app.update_stats, args.repeat, setup=reset_stats)
+
+    app.badge_state()
+    for intent, question in ASSISTANT_QUESTIONS:
+        def fresh_engine(intent=intent):
+            app.assistant = anpp.AssistantEngine()
+            if intent == 'next_page':
+                app.generate_ai_response("Liste des badges expirés")
+        results[f'generate_ai_response[{intent}]'] = measure(
+            lambda question=question: app.generate_ai_response(question), args.repeat, setup=fresh_engine)
+    batch = [question for intent, question in ASSISTANT_QUESTIONS if intent != 'next_page']
+    results['assistant_batch'] = measure(lambda: app.batch_answers(batch), args.repeat)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path):
+    # Ratio des médianes par rapport à un résultat précédent ; > BENCH_REGRESSION = régression
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)
+    print(f"\nComparaison avec {previous_path} ({previous.get('commit')}) :")
+    regressions = 0
+    for size, results in current['sizes'].items():
+        for name, result in results.items():
+            old = previous.get('sizes', {}).get(size, {}).get(name)
+            if old is None or not old['median_ms']:
+                continue
+            ratio = result['median_ms'] / old['median_ms']
+            flag = "  << régression" if ratio > BENCH_REGRESSION else ""
+            regressions += bool(flag)
+            print(f"  {size:>8} {name:<40} {old['median_ms']:10.2f} -> {result['median_ms']:10.2f} ms "
+                  f"(x{ratio:.2f}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banc d'essai d'anpp.py sur des données synthétiques")
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCH_SIZES, help="Nombres de lignes")
+    parser.add_argument('--repeat', type=int, default=BENCH_REPEAT, help="Répétitions par mesure")
+    parser.add_argument('--seed', type=int, default=BENCH_SEED)
+    parser.add_argument('--load-max', type=int, default=BENCH_LOAD_MAX,
+                        help="Taille maximale pour laquelle la lecture du classeur Excel est mesurée")
+    parser.add_argument('--data-dir', default=BENCH_DATA_DIR, help="Dossier des classeurs générés")
+    parser.add_argument('--output', default=BENCH_OUTPUT, help="Fichier JSON des résultats")
+    parser.add_argument('--compare', help="Résultats JSON précédents à comparer")
+    args = parser.parse_args(argv)
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'sizes': {},
+    }
+    for rows in args.sizes:
+        print(f"{rows} lignes...", file=sys.stderr)
+        results = report['sizes'][str(rows)] = bench_size(rows, args)
+        for name, result in results.items():
+            print(f"  {name:<40} {result['median_ms']:10.2f} ms", file=sys.stderr)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Résultats écrits dans {args.output}", file=sys.stderr)
+
+    if args.compare:
+        return 1 if compare(report, args.compare) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
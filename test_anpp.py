@@ -0,0 +1,1267 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import anpp
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    # read_cache/write_cache ne lisent que la taille, la date et l'empreinte du classeur
+    path = tmp_path / "BADGES.xlsx"
+    path.write_bytes(b"classeur v1")
+    return str(path)
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({'External_System_ID': ['B1', 'B2'], 'Full_Name': ['ALAMI SARA', 'IDRISSI ALI'],
+                         'Deactivation_Date': pd.to_datetime(['2026-01-01', '2027-06-30'])})
+
+
+def cache_files(directory):
+    return sorted(name for name in os.listdir(directory) if anpp.CACHE_SUFFIX in name)
+
+
+def test_cache_round_trip(workbook, frame):
+    anpp.write_cache(workbook, frame)
+    pd.testing.assert_frame_equal(anpp.read_cache(workbook), frame)
+    assert not [name for name in cache_files(os.path.dirname(workbook)) if name.endswith('.tmp')]
+
+
+def test_cache_survives_touch_with_same_content(workbook, frame):
+    anpp.write_cache(workbook, frame)
+    stat = os.stat(workbook)
+    os.utime(workbook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    pd.testing.assert_frame_equal(anpp.read_cache(workbook), frame)
+    with open(anpp.cache_paths(workbook)[0], encoding='utf-8') as f:
+        assert json.load(f)['mtime'] == os.stat(workbook).st_mtime_ns
+
+
+def test_cache_invalidated_by_content_change(workbook, frame):
+    anpp.write_cache(workbook, frame)
+    with open(workbook, 'wb') as f:
+        f.write(b"classeur v2")
+    assert anpp.read_cache(workbook) is None
+
+
+def test_cache_invalidated_by_version(workbook, frame, monkeypatch):
+    anpp.write_cache(workbook, frame)
+    monkeypatch.setattr(anpp, 'CACHE_VERSION', anpp.CACHE_VERSION + 1)
+    assert anpp.read_cache(workbook) is None
+
+
+@pytest.mark.parametrize('payload', [b"", b"PAR1 tronque"])
+def test_corrupt_parquet_is_a_miss_and_removed(workbook, frame, payload):
+    anpp.write_cache(workbook, frame)
+    meta_path, parquet_path = anpp.cache_paths(workbook)
+    with open(parquet_path, 'wb') as f:
+        f.write(payload)
+    assert anpp.read_cache(workbook) is None
+    assert not os.path.exists(parquet_path) and not os.path.exists(meta_path)
+
+
+def test_mixed_identifiers_are_cached_as_parquet(workbook, frame):
+    # Classeur réel : numéros tantôt entiers, tantôt texte ; flottants des lots avec trous
+    frame['Internal_Number'] = pd.Series([154046, 'A-12'], dtype=object)
+    frame['Embossed_Number'] = pd.Series([154866.0, 'E7'], dtype=object)
+    frame = anpp.uniform_columns(frame)
+    legacy = anpp.legacy_cache_paths(workbook)
+    for path in legacy:
+        with open(path, 'wb') as f:
+            f.write(b"ancien cache")
+    anpp.write_cache(workbook, frame)
+    cached = anpp.read_cache(workbook)
+    assert list(cached['Internal_Number']) == ['154046', 'A-12']
+    assert list(cached['Embossed_Number']) == ['154866', 'E7']
+    assert os.path.exists(anpp.cache_paths(workbook)[1])
+    assert not any(os.path.exists(path) for path in legacy)
+    assert not [name for name in cache_files(os.path.dirname(workbook)) if name.endswith('.pkl')]
+
+
+@pytest.mark.parametrize('values, expected', [
+    ([154046, None, 'A-12'], ['154046', None, 'A-12']),
+    ([154046, None, 154047], ['154046', None, '154047']),
+    ([154866.0, np.nan, 'E7'], ['154866', None, 'E7']),
+    ([1.5, None, 2.0], ['1.5', None, '2']),
+])
+def test_identifiers_become_text_without_decimals(values, expected):
+    text = anpp.uniform_text(pd.Series(values, dtype=object), always=True)
+    assert text.astype(object).where(text.notna(), None).tolist() == expected
+
+
+def test_corrupt_metadata_is_a_miss(workbook, frame):
+    anpp.write_cache(workbook, frame)
+    with open(anpp.cache_paths(workbook)[0], 'w', encoding='utf-8') as f:
+        f.write('{"version": ')
+    assert anpp.read_cache(workbook) is None
+    assert cache_files(os.path.dirname(workbook)) == []
+
+
+def test_failed_write_keeps_previous_cache(workbook, frame, monkeypatch):
+    anpp.write_cache(workbook, frame)
+
+    def crash(self, path, *args, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b"PAR1")
+        raise KeyboardInterrupt
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', crash)
+    with pytest.raises(KeyboardInterrupt):
+        anpp.write_cache(workbook, frame.iloc[:1])
+    pd.testing.assert_frame_equal(anpp.read_cache(workbook), frame)
+    assert not [name for name in cache_files(os.path.dirname(workbook)) if name.endswith('.tmp')]
+
+
+def badge_frame(rows, index=None):
+    return pd.DataFrame(rows, columns=['External_System_ID', 'Export_UUID', 'Last_Name', 'Token_Status'],
+                        index=index)
+
+
+def test_diff_badges_classifies_rows():
+    old = badge_frame([['B1', 'u1', 'ALAMI', 1], ['B2', 'u2', 'IDRISSI', 1], [None, 'u3', 'BENNANI', None]])
+    new = badge_frame([[None, 'u3', 'BENNANI', None], ['B1', 'u1', 'ALAMI', 0], ['B4', 'u4', 'TAZI', 1]],
+                      index=[7, 8, 9])
+    inserted, updated_old, updated_new, deleted = anpp.diff_badges(old, new)
+    assert list(inserted['External_System_ID']) == ['B4']
+    assert list(deleted['External_System_ID']) == ['B2']
+    # Valeurs manquantes des deux côtés : pas une modification ; les mises à jour gardent l'ancien label
+    assert list(updated_old.index) == [0] and list(updated_new.index) == [0]
+    assert updated_new.loc[0, 'Token_Status'] == 0
+
+
+def test_diff_badges_ignores_category_sets():
+    old = badge_frame([['B1', 'u1', 'ALAMI', 1], ['B2', 'u2', 'IDRISSI', 1]])
+    new = old.copy()
+    old['Last_Name'] = old['Last_Name'].astype('category')
+    new['Last_Name'] = pd.Categorical(new['Last_Name'], categories=['IDRISSI', 'ALAMI', 'TAZI'])
+    inserted, updated_old, _, deleted = anpp.diff_badges(old, new)
+    assert len(inserted) == len(updated_old) == len(deleted) == 0
+
+
+@pytest.mark.parametrize('new', [
+    badge_frame([['B1', 'u1', 'ALAMI', 1]]).drop(columns='Token_Status'),
+    badge_frame([['B1', 'u1', 'ALAMI', 1], ['B1', 'u9', 'TAZI', 1]]),
+])
+def test_diff_badges_refuses_unmatchable_frames(new):
+    assert anpp.diff_badges(badge_frame([['B1', 'u1', 'ALAMI', 1]]), new) is None
+
+
+def test_apply_badge_changes_keeps_labels():
+    old = badge_frame([['B1', 'u1', 'ALAMI', 1], ['B2', 'u2', 'IDRISSI', 1], ['B3', 'u3', 'BENNANI', 1]])
+    new = badge_frame([['B1', 'u1', 'ALAMI', 0], ['B3', 'u3', 'BENNANI', 1], ['B4', 'u4', 'TAZI', 1]])
+    merged, inserted = anpp.apply_badge_changes(old, *anpp.diff_badges(old, new))
+    assert list(merged.index) == [0, 2, 3] and list(inserted.index) == [3]
+    assert list(merged['External_System_ID']) == ['B1', 'B3', 'B4']
+    assert merged.loc[0, 'Token_Status'] == 0
+
+
+def test_refresher_updates_indexes_and_cache(tmp_path):
+    import bench_anpp
+
+    raw = bench_anpp.generate_badges(40, seed=3)
+    raw['Last Name'] = [f"NOM{i:02d}" for i in range(len(raw))]
+    path = str(tmp_path / "BADGES.xlsx")
+    bench_anpp.write_workbook(raw, path)
+    df = anpp.read_badges(path)
+    index, fuzzy, aggregates = anpp.SearchIndex(), anpp.FuzzyIndex(), anpp.BadgeAggregates()
+    for target in (index, fuzzy, aggregates):
+        target.add(df)
+
+    added = raw.iloc[[0]].assign(**{'Export UUID': 'nouveau', 'Last Name': 'NOUVEAU'})
+    raw.loc[3, 'Last Name'] = 'RENOMME'
+    bench_anpp.write_workbook(pd.concat([raw.drop(index=5), added]), path)
+    refresher = anpp.BadgeRefresher(df, index, fuzzy, aggregates, path=path)
+    refresher.run()
+    kind, merged, _, inserted, updated, deleted = refresher.messages.get_nowait()
+    assert (kind, inserted, updated, deleted) == ('changes', 1, 1, 1)
+
+    assert index.search('nom03') == set() and index.search('nom05') == set()
+    assert index.search('renomme') == {3}
+    assert index.search('nouveau') == {len(df)}
+    fresh = anpp.BadgeAggregates()
+    fresh.add(merged)
+    pd.testing.assert_series_equal(aggregates.type_counts(), fresh.type_counts())
+    pd.testing.assert_series_equal(aggregates.monthly_series(), fresh.monthly_series())
+    # Le cache réécrit correspond au classeur modifié : pas de relecture complète au prochain démarrage
+    cached = anpp.read_cache(path)
+    assert list(cached.index) == list(merged.index)
+    assert cached['Last_Name'].tolist() == merged['Last_Name'].tolist()
+
+
+def test_site_state_follows_refreshed_frame():
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.store, app.site_states, app.state_lock = None, None, threading.Lock()
+    app.df = badge_frame([['B1', 'u1', 'ALAMI', 1], ['B2', 'u2', 'IDRISSI', 0]])
+    assert app.site_state(None).active_count == 1
+    app.df = badge_frame([['B1', 'u1', 'ALAMI', 1], ['B2', 'u2', 'IDRISSI', 1]])
+    assert app.site_state(None).active_count == 2
+
+
+def test_chunked_frame_matches_concat():
+    frame = badge_frame([[f"B{i}", f"u{i}", f"NOM{i}", i % 2] for i in range(10)])
+    view = anpp.ChunkedFrame()
+    for start, stop in ((0, 3), (3, 7), (7, 10)):
+        view.append(frame.iloc[start:stop])
+    assert len(view) == 10 and list(view.columns) == list(frame.columns)
+    for start, stop in ((0, 10), (2, 5), (3, 7), (6, 9), (9, 12), (5, 5)):
+        pd.testing.assert_frame_equal(view.iloc[start:stop], frame.iloc[start:stop])
+    assert view.loc[8]['External_System_ID'] == 'B8'
+    with pytest.raises(KeyError):
+        view.loc[42]
+
+
+def test_loader_chunks_are_shown_as_they_arrive():
+    frame = badge_frame([[f"B{i}", f"u{i}", f"NOM{i}", 1] for i in range(6)])
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.loader = mock.Mock(messages=queue.Queue())
+    app.partial, app.site, app.memory_note = None, None, ""
+    for name in ('progress', 'status_var', 'timer', 'root', 'cancel_btn', 'load_span', 'update_sites',
+                 'schedule_stats', 'search'):
+        setattr(app, name, mock.Mock())
+    app.search_var = mock.Mock(get=lambda: "nom4")
+    app.virtual = mock.Mock(df=None)
+    app.virtual.set_frame.side_effect = lambda df, keep_offset=False: setattr(app.virtual, 'df', df)
+
+    for start in (0, 3):
+        app.loader.messages.put(('batch', frame.iloc[start:start + 3], start + 3, 6))
+    app.poll_loader()
+    assert app.loading and not hasattr(app, 'df')
+    assert app.virtual.df is app.partial and len(app.virtual.df) == 6
+    # Recherche saisie pendant le chargement : relancée une fois les données complètes
+    app.search.assert_not_called()
+    app.loader.messages.put(('frame', frame))
+    app.loader.messages.put(('done', 6))
+    app.poll_loader()
+    assert not app.loading and app.partial is None
+    assert app.df is frame and app.virtual.df is frame
+    app.search.assert_called_once_with()
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.xlsx', '.parquet'])
+def test_cancelled_export_leaves_no_file(tmp_path, frame, extension):
+    path = tmp_path / f"export{extension}"
+    path.write_bytes(b"export precedent")
+    cancelled = threading.Event()
+    progress = lambda done, total: cancelled.set()
+    assert anpp.export_frame(frame, str(path), progress=progress, cancelled=cancelled, chunk_size=1) is False
+    assert path.read_bytes() == b"export precedent"
+    assert os.listdir(tmp_path) == [path.name]
+
+
+def test_failed_export_leaves_no_file(tmp_path, frame):
+    def crash(done, total):
+        raise OSError("disque plein")
+    path = tmp_path / "export.csv"
+    with pytest.raises(OSError):
+        anpp.export_frame(frame, str(path), progress=crash, chunk_size=1)
+    assert os.listdir(tmp_path) == []
+
+
+def test_export_job_cancel(tmp_path):
+    job = anpp.ExportJob(badge_frame([['B1', 'u1', 'ALAMI', 1]]), str(tmp_path / "export.csv"))
+    job.cancel()
+    job.run()
+    assert job.messages.get_nowait() == ('cancelled', 1)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('extension', ['.csv', '.xlsx', '.parquet'])
+def test_compact_export_has_no_search_columns(tmp_path, frame, extension):
+    compact = anpp.compact_badges(frame.assign(First_Name='SARA', Last_Name='ALAMI'))
+    assert any(col.endswith(anpp.LOWER_SUFFIX) for col in compact.columns)
+    path = str(tmp_path / f"export{extension}")
+    assert anpp.export_frame(compact, path, chunk_size=1)
+    reader = {'.csv': pd.read_csv, '.xlsx': pd.read_excel, '.parquet': pd.read_parquet}[extension]
+    exported = reader(path)
+    assert list(exported.columns) == anpp.public_columns(compact)
+    assert len(exported) == len(frame)
+
+
+@pytest.fixture(scope='module')
+def names_frame():
+    import bench_anpp
+
+    return anpp.normalize_badges(bench_anpp.generate_badges(800, seed=5))
+
+
+def test_fuzzy_suggestions_match_get_close_matches(names_frame):
+    import random
+    from difflib import get_close_matches
+
+    # Liste de noms de la version d'origine de get_suggestions
+    names = list(set(pd.concat([names_frame[field] for field in anpp.NAME_FIELDS]).dropna().str.lower()))
+    fuzzy = anpp.FuzzyIndex()
+    fuzzy.add(names_frame)
+    rng = random.Random(1)
+    terms = ['a', 'al', 'mo', 'zzzq', 'xq']
+    for name in rng.sample(sorted(names), 40):
+        cut = rng.randrange(len(name))
+        terms += [name, name[:cut] + name[cut + 1:], name[:cut] + 'q' + name[cut:]]
+    for term in terms:
+        assert fuzzy.suggestions(term, n=3, cutoff=0.6) == get_close_matches(term, names, n=3, cutoff=0.6), term
+
+
+@pytest.mark.parametrize('question, intent', [
+    ("Nombre de VIP cette année", 'vip'),
+    ("Statut des badges cette semaine", 'status'),
+    ("liste des badges expirés cette semaine", 'expired_list'),
+    ("Badges expirant ce mois", 'expiring_month'),
+    ("Badges expirant dans 7 jours", 'expiry_window'),
+    ("Quels badges expirent le trimestre prochain ?", 'expiry_window'),
+    ("Badges avant le 31/12/2026", 'expiry_window'),
+    ("Badges émis entre le 01/01/2025 et le 31/01/2025", 'period_counts'),
+])
+def test_assistant_routing(question, intent):
+    assert anpp.AssistantEngine().route(question) == intent
+
+
+TODAY = pd.Timestamp('2026-10-14 09:30', tz='UTC')
+
+
+@pytest.mark.parametrize('question, window, label', [
+    ("expirant dans 7 jours", (TODAY, TODAY + pd.Timedelta(days=8)), "dans les 7 prochains jours"),
+    ("expirent dans les prochains 10 jours", (TODAY, TODAY + pd.Timedelta(days=11)), "dans les 10 prochains jours"),
+    ("expirent le trimestre prochain", (pd.Timestamp('2027-01-01', tz='UTC'), pd.Timestamp('2027-04-01', tz='UTC')),
+     "le trimestre prochain"),
+    ("expirant la semaine prochaine", (pd.Timestamp('2026-10-19', tz='UTC'), pd.Timestamp('2026-10-26', tz='UTC')),
+     "la semaine prochaine"),
+    ("avant le 31/12/2026", (None, pd.Timestamp('2026-12-31', tz='UTC')), "avant le 31/12/2026"),
+    ("entre le 31/12/2026 et le 01/12/2026", (pd.Timestamp('2026-12-01', tz='UTC'), pd.Timestamp('2027-01-01', tz='UTC')),
+     "entre le 01/12/2026 et le 31/12/2026"),
+])
+def test_parse_expiry_window(question, window, label):
+    assert anpp.parse_expiry_window(question, TODAY) == (window, label)
+
+
+def test_parse_expiry_window_without_period():
+    assert anpp.parse_expiry_window("badges expirant", TODAY) is None
+    assert anpp.parse_expiry_window("avant le 31/02/2026", TODAY) is None
+
+
+def expiry_frame(today):
+    # Bornes exactes (minuit, même heure, une seconde avant/après), passé, futur et dates manquantes
+    offsets = [pd.Timedelta(days=days, seconds=seconds) for days in (-400, -1, 0, 1, 7, 30, 31, 32, 365)
+               for seconds in (-1, 0, 1)]
+    dates = [today + offset for offset in offsets]
+    dates += [today.normalize() + pd.Timedelta(days=days) for days in (-1, 0, 1, 30, 31)]
+    return pd.DataFrame({'Deactivation_Date': pd.to_datetime(dates + [pd.NaT, pd.NaT], utc=True),
+                         'Token_Status': 1})
+
+
+@pytest.mark.parametrize('days', [0, 1, 7, 30, 31, 365])
+def test_expiry_index_matches_masks(days):
+    df = expiry_frame(TODAY)
+    calendar = anpp.ExpiryIndex(df['Deactivation_Date'])
+    _, _, expired, days_left = anpp.compute_status_masks(df, TODAY)
+    expiring = ((days_left >= 0) & (days_left <= days)).to_numpy()
+
+    assert calendar.count(None, TODAY) == expired.sum()
+    assert list(calendar.positions(None, TODAY)) == list(np.flatnonzero(expired))
+    start, stop = anpp.expiry_bounds(TODAY, days)
+    assert calendar.count(start, stop) == expiring.sum()
+    assert list(calendar.positions(start, stop)) == list(np.flatnonzero(expiring))
+
+
+def test_expiry_index_window_counts():
+    df = expiry_frame(TODAY)
+    calendar = anpp.ExpiryIndex(df['Deactivation_Date'])
+    edges = [TODAY + pd.Timedelta(days=days) for days in (-500, 0, 7, 31, 400)]
+    expected = [((df['Deactivation_Date'] >= lo) & (df['Deactivation_Date'] < hi)).sum()
+                for lo, hi in zip(edges, edges[1:])]
+    assert list(calendar.counts(edges)) == expected
+
+
+def test_badge_state_counts_match_masks():
+    df = expiry_frame(pd.Timestamp.now(tz='UTC'))
+    state = anpp.BadgeState(df)
+    active, _, expired, days_left = anpp.compute_status_masks(df, state.today)
+    assert state.expired_count == expired.sum()
+    assert state.active_count == active.sum()
+    assert state.count('expiring') == ((days_left >= 0) & (days_left <= anpp.EXPIRING_DAYS)).sum()
+
+
+def utc(text):
+    return pd.Timestamp(text, tz='UTC')
+
+
+@pytest.mark.parametrize('question, window, label', [
+    ("Combien de badges créés ce mois ?", (utc('2026-10-01'), utc('2026-10-15')), "ce mois"),
+    ("badges activés la semaine dernière", (utc('2026-10-05'), utc('2026-10-12')), "la semaine dernière"),
+    ("badges émis hier", (utc('2026-10-13'), utc('2026-10-14')), "hier"),
+    ("badges émis l'année dernière", (utc('2025-01-01'), utc('2026-01-01')), "l'année dernière"),
+    ("badges émis en 2023", (utc('2023-01-01'), utc('2024-01-01')), "en 2023"),
+    ("badges émis en mars 2025", (utc('2025-03-01'), utc('2025-04-01')), "en mars 2025"),
+    ("badges émis en novembre", (utc('2025-11-01'), utc('2025-12-01')), "en novembre 2025"),
+    ("badges émis en mai", (utc('2026-05-01'), utc('2026-06-01')), "en mai 2026"),
+    ("badges émis le 01/02/2025", (utc('2025-02-01'), utc('2025-02-02')), "le 01/02/2025"),
+    ("badges émis entre le 31/01/2025 et le 01/01/2025", (utc('2025-01-01'), utc('2025-02-01')),
+     "entre le 01/01/2025 et le 31/01/2025"),
+])
+def test_parse_period(question, window, label):
+    assert anpp.parse_period(question, TODAY) == (window, label)
+
+
+@pytest.mark.parametrize('question', ["Combien de badges émis ?", "badges émis au printemps"])
+def test_parse_period_unknown_is_not_this_month(question):
+    assert anpp.parse_period(question, TODAY) is None
+
+
+def test_period_counts_answers():
+    now = pd.Timestamp.now(tz='UTC')
+    df = pd.DataFrame({'Issue_Date': [utc('2023-03-10'), utc('2023-11-02'), now, now], 'Token_Status': 1})
+    aggregates = anpp.BadgeAggregates()
+    aggregates.add(df)
+    state, engine = anpp.BadgeState(df), anpp.AssistantEngine()
+    assert engine.answer(state, "badges émis en 2023", aggregates).startswith("2 badge(s) émis en 2023")
+    assert engine.answer(state, "badges émis ce mois", aggregates).startswith("2 badge(s) émis ce mois")
+    assert "pas reconnu la période" in engine.answer(state, "badges émis au printemps", aggregates)
+
+
+@pytest.fixture(scope='module')
+def service(tmp_path_factory):
+    import bench_anpp
+
+    path = str(tmp_path_factory.mktemp('serveur') / "BADGES.xlsx")
+    bench_anpp.write_workbook(bench_anpp.generate_badges(60, seed=5), path)
+    return anpp.BadgeService([path])
+
+
+def raw_request(server, payload):
+    async def run():
+        listener = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        async with listener:
+            reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+            writer.write(payload)
+            await writer.drain()
+            data = await reader.read()
+            writer.close()
+        return data
+    return asyncio.run(run())
+
+
+def post(path, body):
+    return (f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n").encode() + body
+
+
+def status_line(data):
+    return data.split(b'\r\n', 1)[0].decode()
+
+
+@pytest.mark.parametrize('body', [b'{bad', b'[1, 2]', b'"texte"', b'\xff\xfe'])
+def test_server_rejects_malformed_bodies(service, body):
+    server = anpp.BadgeServer(service, workers=1)
+    assert status_line(raw_request(server, post('/ask', body))) == "HTTP/1.1 400 Bad Request"
+    assert status_line(raw_request(server, post('/reload', body))) == "HTTP/1.1 400 Bad Request"
+
+
+def test_server_answers_malformed_requests(service):
+    server = anpp.BadgeServer(service, workers=1)
+    assert status_line(raw_request(server, b"GARBAGE\r\n\r\n")) == "HTTP/1.1 400 Bad Request"
+    bad_length = b"GET /info HTTP/1.1\r\nContent-Length: abc\r\n\r\n"
+    assert status_line(raw_request(server, bad_length)) == "HTTP/1.1 400 Bad Request"
+
+
+def test_server_reports_internal_errors(service, monkeypatch):
+    server = anpp.BadgeServer(service, workers=1)
+
+    async def broken(*args):
+        raise RuntimeError("panne")
+    monkeypatch.setattr(server, 'respond', broken)
+    data = raw_request(server, b"GET /info HTTP/1.1\r\n\r\n")
+    assert status_line(data) == "HTTP/1.1 500 Internal Server Error"
+    assert json.loads(data.split(b'\r\n\r\n', 1)[1]) == {'error': "panne"}
+
+
+def test_server_ask(service):
+    server = anpp.BadgeServer(service, workers=1)
+    data = raw_request(server, post('/ask', json.dumps({'question': "Nombre de VIP"}).encode()))
+    assert status_line(data) == "HTTP/1.1 200 OK"
+    assert json.loads(data.split(b'\r\n\r\n', 1)[1])['response'].startswith("Nombre total de VIP")
+
+
+def test_thin_client_batch_is_one_request(service, monkeypatch):
+    server = anpp.BadgeServer(service, workers=1)
+    paths = []
+
+    def request(self, method, path, params=None, payload=None):
+        paths.append(path)
+        status, data = asyncio.run(server.respond(method, path, json.dumps(payload).encode()))
+        assert status == 200
+        return json.loads(data)
+    monkeypatch.setattr(anpp.BadgeClient, 'request', request)
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.store = anpp.BadgeClient("http://serveur")
+    questions = ["Liste des badges expirés", "Nombre de VIP", "Liste des badges expirés", "suivant"]
+    results = app.batch_answers(questions)
+    assert paths == ['/ask_batch']
+    # Listes complètes (pas de page de 20) et aucune session interactive touchée
+    assert results == anpp.AssistantEngine(page_size=None).answer_batch(service.state(), questions,
+                                                                          service.aggregates)
+    assert app.store.session not in service.assistants
+    assert status_line(raw_request(server, post('/ask_batch', b'{"questions": "Nombre de VIP"}'))) == \
+        "HTTP/1.1 400 Bad Request"
+
+
+def get_json(server, target):
+    status, data = asyncio.run(server.respond('GET', target, b''))
+    assert status == 200
+    return json.loads(data)
+
+
+def test_server_caches_follow_the_day(service, monkeypatch):
+    server = anpp.BadgeServer(service, workers=1)
+    before = get_json(server, '/stats')['expired_count']
+    assert get_json(server, '/rows?kind=expired&limit=0')['total'] == before
+
+    real = anpp.datetime
+
+    class Later(real):
+        @classmethod
+        def now(cls, tz=None):
+            return real.now(tz) + anpp.timedelta(days=400)
+    monkeypatch.setattr(anpp, 'datetime', Later)
+    after = get_json(server, '/stats')['expired_count']
+    assert after > before
+    assert after == service.state().expired_count
+    assert get_json(server, '/rows?kind=expired&limit=0')['total'] == after
+
+
+def test_server_rejects_unknown_list(service):
+    server = anpp.BadgeServer(service, workers=1)
+    status, data = asyncio.run(server.respond('GET', '/rows?kind=inconnu', b''))
+    assert status == 400 and 'inconnu' in json.loads(data)['error']
+
+
+def test_details_cache_is_thread_safe(service):
+    from concurrent.futures import ThreadPoolExecutor
+
+    renderer = anpp.DetailsRenderer(size=4)
+    labels = list(service.df.index) * 20
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        cards = list(pool.map(lambda label: renderer.card(service.df, label)[1], labels))
+    assert cards == [renderer.card(service.df, label)[1] for label in labels]
+    assert len(renderer.cards) <= 4
+
+
+def test_batch_answers_share_state_safely(service):
+    from concurrent.futures import ThreadPoolExecutor
+
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.store, app.site, app.site_states, app.site_aggregates_cache = None, None, None, None
+    app.state_lock = threading.Lock()
+    app.df = service.df.assign(Site=[f"site{i % 3}" for i in range(len(service.df))])
+    app.aggregates = service.aggregates
+    app.batch_assistant = anpp.AssistantEngine(page_size=None)
+    questions = ["Statistiques complètes", "Liste des badges expirés", "Nombre de VIP"]
+    sites = [None, 'site0', 'site1', 'site2'] * 10
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda site: app.batch_answers(questions, site), sites))
+    # Un seul état par site, partagé par tous les lots
+    assert set(app.site_states[1]) == set(sites)
+    assert results == [app.batch_answers(questions, site) for site in sites]
+    assert results[1][0][2].startswith("[site0] Statistiques globales")
+
+
+def test_report_runs_without_tkinter(tmp_path):
+    import subprocess
+    import sys
+    import bench_anpp
+
+    path = str(tmp_path / "BADGES.xlsx")
+    bench_anpp.write_workbook(bench_anpp.generate_badges(20, seed=2), path)
+    # Module tkinter absent (python3-tk non installé) : l'import échoue dès qu'il est tenté
+    code = "import sys; sys.modules['tkinter'] = None; import anpp; sys.exit(anpp.main(['report', sys.argv[1]]))"
+    result = subprocess.run([sys.executable, '-c', code, path], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(anpp.__file__)))
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.startswith('Workbook,total')
+
+
+def test_matplotlib_imported_on_first_chart(tmp_path):
+    import subprocess
+    import sys
+    import bench_anpp
+
+    pytest.importorskip('matplotlib')
+    path = str(tmp_path / "BADGES.xlsx")
+    bench_anpp.write_workbook(bench_anpp.generate_badges(20, seed=2), path)
+    # Processus neuf : ni l'import du module ni un rapport ne chargent matplotlib
+    code = ("import sys, io, contextlib; import anpp\n"
+            "assert anpp.plt is None and anpp.FigureCanvasTkAgg is None\n"
+            "with contextlib.redirect_stdout(io.StringIO()): anpp.main(['report', sys.argv[1]])\n"
+            "assert not any(name.split('.')[0] == 'matplotlib' for name in sys.modules)\n"
+            "first, second = anpp.load_plotting(), anpp.load_plotting()\n"
+            "import matplotlib.pyplot\n"
+            "assert anpp.plt is matplotlib.pyplot and first > 0 and second == 0.0\n")
+    result = subprocess.run([sys.executable, '-c', code, path], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(anpp.__file__)), env={**os.environ, 'MPLBACKEND': 'Agg'})
+    assert result.returncode == 0, result.stderr
+
+
+class FakeTree:
+    # Treeview minimal : lignes insérées, sélection et position
+    def __init__(self):
+        self.items = []
+        self.selected = ()
+
+    def bind(self, *args):
+        pass
+
+    def get_children(self):
+        return [iid for iid, _ in self.items]
+
+    def delete(self, *iids):
+        self.items = [item for item in self.items if item[0] not in iids]
+
+    def insert(self, parent, index, values, iid):
+        self.items.append((iid, values))
+
+    def selection_set(self, iid):
+        self.selected = (iid,)
+
+    def selection(self):
+        return self.selected
+
+    def focus(self, iid):
+        pass
+
+    def index(self, iid):
+        return self.get_children().index(iid)
+
+
+@pytest.fixture
+def virtual():
+    pytest.importorskip('tkinter')
+    anpp.load_tk()
+    formatted = []
+
+    def format_rows(df):
+        formatted.append(len(df))
+        return anpp.format_badge_rows(df)
+    view = anpp.VirtualTreeview(FakeTree(), mock.Mock(), format_rows=format_rows, overscan=10)
+    view.visible = 5
+    view.set_frame(badge_frame([[f"B{i}", f"u{i}", f"NOM{i}", 1] for i in range(100)], index=range(100, 200)))
+    return view, formatted
+
+
+def test_virtual_treeview_renders_only_the_window(virtual):
+    view, formatted = virtual
+    assert view.tree.get_children() == ['100', '101', '102', '103', '104']
+    assert view.scrollbar.set.call_args[0] == (0, 0.05)
+    view.yview('moveto', '0.5')
+    assert view.offset == 50 and view.tree.get_children()[0] == '150'
+    assert view.scrollbar.set.call_args[0] == (0.5, 0.55)
+    view.yview('scroll', '1', 'pages')
+    assert view.offset == 55
+    view.yview('scroll', '-2', 'units')
+    assert view.offset == 53
+    view.scroll_to(500)
+    assert view.offset == 95 and view.tree.get_children()[-1] == '199'
+    view.scroll_to(-3)
+    assert view.offset == 0
+    # Jamais plus que la fenêtre et son débord ne sont formatés
+    assert max(formatted) <= view.visible + 2 * view.overscan
+
+
+def test_virtual_treeview_reuses_the_formatted_block(virtual):
+    view, formatted = virtual
+    calls = len(formatted)
+    for offset in range(1, 6):
+        view.scroll_to(offset)
+    assert len(formatted) == calls
+    view.scroll_to(60)
+    assert len(formatted) == calls + 1
+
+
+def test_virtual_treeview_keyboard_paging(virtual):
+    view, _ = virtual
+    view.move_selection('end')
+    assert view.selected_pos == 99 and view.offset == 95 and view.tree.selection() == ('199',)
+    view.move_selection('page-')
+    assert view.selected_pos == 94 and view.offset == 94
+    view.move_selection(-1)
+    assert view.selected_pos == 93 and view.offset == 93
+    view.move_selection('home')
+    assert view.selected_pos == 0 and view.offset == 0
+    view.move_selection(-1)
+    assert view.selected_pos == 0
+    view.set_frame(view.df.iloc[:3])
+    assert view.selected_pos is None and view.tree.get_children() == ['100', '101', '102']
+
+
+def contains_search(df, term):
+    # Recherche d'origine : cinq str.contains, puis prénom + nom dans les deux ordres
+    mask = (df['Full_Name'].str.lower().str.contains(term, na=False)
+            | df['First_Name'].str.lower().str.contains(term, na=False)
+            | df['Last_Name'].str.lower().str.contains(term, na=False)
+            | df['External_System_ID'].astype(str).str.contains(term, na=False)
+            | df['Internal_Number'].astype(str).str.contains(term, na=False))
+    if not mask.any() and ' ' in term and len(term.split()) == 2:
+        first, last = term.split()
+        first_name, last_name = df['First_Name'].str.lower(), df['Last_Name'].str.lower()
+        mask = ((first_name.str.contains(first, na=False) & last_name.str.contains(last, na=False))
+                | (first_name.str.contains(last, na=False) & last_name.str.contains(first, na=False)))
+    return set(df.index[mask])
+
+
+@pytest.mark.parametrize('term', ['karim', 'ait', 'ass', 'a', 'karim ait fassia', 'fassia karim',
+                                  'boutarta youssef', '1505', '150055', 'zzz', 'karim zzz'])
+def test_search_index_matches_contains(names_frame, term):
+    index = anpp.SearchIndex()
+    # Index alimenté par lots, comme pendant le chargement
+    for start in range(0, len(names_frame), 300):
+        index.add(names_frame.iloc[start:start + 300])
+    labels = index.search(term, swapped=False) or index.search(term)
+    assert set(labels) == contains_search(names_frame, term)
+
+
+def search_app(df):
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.df = df
+    app.index = anpp.SearchIndex()
+    app.index.add(df)
+    app.search_cache, app.search_cache_version = OrderedDict(), None
+    return app
+
+
+def test_typed_search_narrows_cached_results(names_frame):
+    app = search_app(names_frame)
+    fresh = anpp.SearchIndex()
+    fresh.add(names_frame)
+    for term in ['k', 'ka', 'kar', 'kari', 'karim', 'karim ', 'karim a', 'karim ait', 'fassia karim']:
+        expected = fresh.search(term, swapped=False) or fresh.search(term)
+        assert set(app.cached_search(term, names_frame)) == set(expected), term
+    assert 'karim' in app.search_cache and len(app.search_cache) <= anpp.SEARCH_CACHE_SIZE
+    # Effacement : le terme déjà vu est servi par le cache, sans nouvelle recherche
+    with mock.patch.object(app.index, 'search', side_effect=AssertionError):
+        assert set(app.cached_search('kar', names_frame)) == set(fresh.search('kar'))
+
+
+def test_search_cache_follows_the_index(names_frame):
+    app = search_app(names_frame.iloc[:400])
+    before = set(app.cached_search('karim', app.df))
+    app.df = names_frame
+    app.index.add(names_frame.iloc[400:])
+    after = set(app.cached_search('karim', app.df))
+    assert after > before and len(app.search_cache) == 1
+
+
+def test_search_is_debounced_and_stale_searches_dropped():
+    app = anpp.EnhancedBadgeApp.__new__(anpp.EnhancedBadgeApp)
+    app.root = mock.Mock()
+    app.root.after.side_effect = ['frappe-1', 'frappe-2']
+    app.search_var = mock.Mock(get=lambda: "Karim ")
+    app.search_term, app.search_after = "", None
+    app.on_search_changed()
+    app.on_search_changed()
+    app.root.after_cancel.assert_called_once_with('frappe-1')
+    assert app.root.after.call_args[0] == (anpp.SEARCH_DEBOUNCE_MS, app.search)
+    # Saisie identique au terme affiché : rien n'est replanifié
+    app.search_term = "karim"
+    app.on_search_changed()
+    assert app.root.after.call_count == 2
+    # Une recherche dépassée par une saisie plus récente ne publie rien
+    app.root.reset_mock()
+    app.search_generation = 2
+    app.run_search("karim", 1, badge_frame([['B1', 'u1', 'KARIM', 1]]))
+    app.root.after.assert_not_called()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Horloge du module réglable : clock[0] est l'instant renvoyé par datetime.now
+    moment = [TODAY]
+    real = anpp.datetime
+
+    class Frozen(real):
+        @classmethod
+        def now(cls, tz=None):
+            return moment[0].tz_convert(tz or 'UTC').to_pydatetime()
+    monkeypatch.setattr(anpp, 'datetime', Frozen)
+    return moment
+
+
+@pytest.mark.parametrize('now', [TODAY, TODAY.normalize(), TODAY.normalize() - pd.Timedelta(microseconds=1),
+                                 TODAY + pd.Timedelta(days=31)])
+def test_badge_state_masks_match_status_masks(clock, now):
+    clock[0] = now
+    df = expiry_frame(TODAY)
+    df['Token_Status'] = np.arange(len(df)) % 2
+    state = anpp.BadgeState(df)
+    active, inactive, expired, days_left = anpp.compute_status_masks(df, state.today)
+    assert (state.expired == expired).all() and (state.active == active).all()
+    assert (state.inactive == inactive).all()
+    expiring = ((days_left >= 0) & (days_left <= anpp.EXPIRING_DAYS)).to_numpy()
+    assert list(state.kind_positions('expiring')) == list(np.flatnonzero(expiring))
+    assert (state.active_count, state.expired_count, state.expiring_count) == \
+        (active.sum(), expired.sum(), expiring.sum())
+
+
+def test_badge_state_recomputes_at_midnight(clock):
+    clock[0] = utc('2026-10-14 23:59:59')
+    df = pd.DataFrame({'Deactivation_Date': [utc('2026-10-15 00:00:30'), utc('2026-11-30')], 'Token_Status': 1})
+    state = anpp.BadgeState(df)
+    version = state.version
+    assert (state.expired_count, state.active_count, state.expiring_count) == (0, 2, 1)
+    # Même jour : rien n'est recalculé
+    clock[0] = utc('2026-10-14 23:59:59.900')
+    assert state.current() is state and state.version == version
+    clock[0] = utc('2026-10-15 00:01')
+    assert state.current() is state and state.version != version
+    assert (state.expired_count, state.active_count, state.expiring_count) == (1, 1, 0)
+    assert list(state.select('expired').index) == [0]
+
+
+@pytest.fixture
+def typed_frame(names_frame):
+    types = np.array(['Employé', 'Visiteur', 'Prestataire', None], dtype=object)
+    return names_frame.assign(Type=types[np.arange(len(names_frame)) % 4])
+
+
+def test_chart_aggregates_follow_added_and_removed_rows(typed_frame):
+    aggregates = anpp.BadgeAggregates()
+    for start in range(0, len(typed_frame), 300):
+        aggregates.add(typed_frame.iloc[start:start + 300])
+    aggregates.remove(typed_frame.iloc[:100])
+    rest = typed_frame.iloc[100:]
+
+    issued = rest['Issue_Date'].dropna().dt.tz_localize(None).dt.normalize()
+    expected = pd.Series(1, index=pd.DatetimeIndex(issued)).groupby(level=0).sum().resample('MS').sum()
+    pd.testing.assert_series_equal(aggregates.monthly_series(), expected, check_names=False, check_freq=False,
+                                   check_index_type=False)
+    assert aggregates.type_counts().to_dict() == rest['Type'].value_counts().to_dict()
+
+
+def test_stats_figure_is_updated_in_place(typed_frame):
+    pytest.importorskip('matplotlib')
+    import bench_anpp
+
+    df = typed_frame.copy()
+    app = bench_anpp.headless_app(df, None, None, anpp.BadgeAggregates())
+    app.update_stats()
+    artists = app.stats_artists
+    wedges = list(artists['wedges'])
+    assert artists['autotexts'][0].get_text().endswith(f"({app.badge_state().active_count})")
+
+    # Comptes inchangés : ni nouveau tracé ni mise à jour
+    with mock.patch.object(app.figure, 'clear') as clear, mock.patch.object(anpp, 'update_pie') as update:
+        app.update_stats()
+    clear.assert_not_called()
+    update.assert_not_called()
+
+    # Statuts modifiés : mêmes artistes, angles et libellés déplacés
+    theta = wedges[0].theta2
+    app.df = df.assign(Token_Status=1)
+    app.site_states = None
+    with mock.patch.object(app.figure, 'clear') as clear:
+        app.update_stats()
+    clear.assert_not_called()
+    assert app.stats_artists is artists and list(artists['wedges']) == wedges
+    assert wedges[0].theta2 != theta
+    assert artists['autotexts'][0].get_text().endswith(f"({app.badge_state().active_count})")
+
+
+@pytest.mark.parametrize('question, intent', [
+    ("Bonjour !", 'greeting'),
+    ("Statistiques complètes", 'stats'),
+    ("STATUT des badges", 'status'),
+    ("Combien de VIP ?", 'vip'),
+    ("suivant", 'next_page'),
+    # Fautes de frappe : mot rapproché d'un mot-clé
+    ("Statistiqes", 'stats'),
+    ("statu des badges", 'status'),
+    ("quelle heure est-il ?", None),
+])
+def test_assistant_intents_and_typos(question, intent):
+    assert anpp.AssistantEngine().route(question) == intent
+
+
+def test_assistant_answer_cache(clock):
+    df = pd.DataFrame({'Deactivation_Date': [TODAY - pd.Timedelta(days=3), TODAY + pd.Timedelta(days=3)],
+                       'Token_Status': [1, 1], 'VIP': [1, 0]})
+    engine = anpp.AssistantEngine()
+    stats = engine.handlers['stats'] = mock.Mock(side_effect=engine.stats)
+    state = anpp.BadgeState(df)
+    first = engine.answer(state, "Statistiques complètes")
+    assert engine.answer(state, "statistiques") == first and stats.call_count == 1
+    # Nouvelles données ou nouveau jour : nouvelle clé
+    engine.answer(anpp.BadgeState(df.assign(VIP=0)), "Statistiques complètes")
+    assert stats.call_count == 2
+    clock[0] = TODAY + pd.Timedelta(days=4)
+    assert engine.answer(state, "Statistiques complètes") != first and stats.call_count == 3
+    # Listes paginées : jamais mémorisées
+    expired = engine.handlers['expired_list'] = mock.Mock(side_effect=engine.expired_list)
+    engine.answer(state, "Liste des badges expirés")
+    engine.answer(state, "Liste des badges expirés")
+    assert expired.call_count == 2 and len(engine.cache) == 3
+    # Erreur d'un traitement : message d'excuse, rien de mémorisé
+    engine.handlers['vip'] = mock.Mock(side_effect=RuntimeError("panne"))
+    assert engine.answer(state, "Combien de VIP ?") == "Désolé, une erreur est survenue : panne"
+    assert len(engine.cache) == 3
+
+
+def test_assistant_dispatcher_is_bounded_and_ordered():
+    release, calls, delivered = threading.Event(), [], []
+
+    def answer(user_msg):
+        calls.append(user_msg)
+        release.wait(5)
+        if user_msg == "panne":
+            raise RuntimeError("panne")
+        return user_msg.upper()
+    dispatcher = anpp.AssistantDispatcher(answer, delivered.append, workers=2, max_pending=4)
+    assert all(dispatcher.submit(question) for question in ["stats", "vip", "Stats ", "panne"])
+    # File pleine : la question est refusée, rien n'est calculé
+    assert dispatcher.submit("statut") is False and dispatcher.depth() == 4
+    release.set()
+    dispatcher.executor.shutdown(wait=True)
+    # Questions identiques fusionnées (un seul calcul), mais une réponse par question, dans l'ordre
+    assert sorted(calls) == ["panne", "stats", "vip"]
+    assert delivered == ["STATS", "VIP", "STATS", "Désolé, une erreur est survenue : panne"]
+    assert dispatcher.depth() == 0 and dispatcher.latency_ms() > 0
+
+
+def test_assistant_dispatcher_delivers_in_submission_order():
+    gates = {"lente": threading.Event(), "rapide": threading.Event()}
+    delivered = []
+
+    def answer(user_msg):
+        gates[user_msg].wait(5)
+        return user_msg
+    dispatcher = anpp.AssistantDispatcher(answer, delivered.append, workers=2, coalesce=lambda user_msg: False)
+    dispatcher.submit("lente")
+    dispatcher.submit("rapide")
+    gates["rapide"].set()
+    # Réponse rapide prête : retenue tant que la précédente n'est pas livrée
+    while 'rapide' in dispatcher.running:
+        threading.Event().wait(0.01)
+    assert delivered == []
+    gates["lente"].set()
+    dispatcher.executor.shutdown(wait=True)
+    assert delivered == ["lente", "rapide"]
+
+
+def test_assistant_lists_are_paged_by_cursor(clock):
+    df = pd.DataFrame({'First_Name': [f"P{i:02d}" for i in range(45)], 'Last_Name': 'NOM',
+                       'Deactivation_Date': TODAY - pd.to_timedelta(np.arange(45) + 1, unit='D'), 'Token_Status': 1})
+    state, engine = anpp.BadgeState(df), anpp.AssistantEngine()
+    assert engine.answer(state, "suivant").startswith("Aucune liste en cours")
+
+    pages = [engine.answer(state, "Liste des badges expirés")] + [engine.answer(state, "suivant") for _ in range(3)]
+    assert pages[0].startswith("45 badge(s) expirés :\n") and pages[0].endswith(
+        "...et 25 autres. Tapez « suivant » pour la page suivante.")
+    assert pages[1].startswith("Badge(s) expirés 21 à 40 sur 45 :\n")
+    assert pages[2].startswith("Badge(s) expirés 41 à 45 sur 45 :\n") and "suivant" not in pages[2]
+    assert pages[3] == "Fin de la liste."
+    lines = [line for page in pages[:3] for line in page.splitlines() if line.startswith("- ")]
+    assert [line.split()[1] for line in lines] == list(df['First_Name'])
+
+    # Liste complète d'un coup (rapports en lot) : mêmes lignes, une seule page
+    full = anpp.AssistantEngine(page_size=None).answer(state, "Liste des badges expirés")
+    assert [line for line in full.splitlines() if line.startswith("- ")] == lines
+
+    # Données changées entre deux pages : le curseur n'est plus valable
+    engine.answer(state, "Liste des badges expirés")
+    assert engine.answer(anpp.BadgeState(df), "suivant").startswith("Les données ont changé")
+
+
+@pytest.fixture(scope='module')
+def sqlite_store(tmp_path_factory):
+    # Même classeur en mémoire (read_badges) et importé dans SQLite
+    import bench_anpp
+    path = str(tmp_path_factory.mktemp('sqlite') / "BADGES.xlsx")
+    bench_anpp.write_workbook(bench_anpp.generate_badges(400, seed=11), path)
+    store = anpp.SQLiteStore(anpp.sqlite_path(path))
+    assert store.import_workbook(path) == 400
+    return store, anpp.read_badges(path)
+
+
+def test_sqlite_state_matches_badge_state(sqlite_store, clock):
+    store, df = sqlite_store
+    sql, mem = store.state(store.view()), anpp.BadgeState(df)
+    for name in ['total', 'active_count', 'inactive_count', 'expired_count', 'expiring_count', 'vip_count']:
+        assert getattr(sql, name) == getattr(mem, name), name
+    assert 0 < mem.expired_count < mem.total and mem.expiring_count > 0
+
+    for kind in ['active', 'expired', 'expiring', 'vip']:
+        for days in [anpp.EXPIRING_DAYS, 7, 365, (30, 90)]:
+            assert sql.count(kind, days) == mem.count(kind, days), (kind, days)
+            assert list(sql.select(kind, days).index) == list(mem.select(kind, days).index), (kind, days)
+        assert list(sql.rows(kind, 3, 9).index) == list(mem.rows(kind, 3, 9).index)
+    expected = mem.select('expiring')['External_System_ID'].astype(str).tolist()
+    assert sql.select('expiring')['External_System_ID'].astype(str).tolist() == expected
+
+    edges = [None] + [clock[0] + pd.Timedelta(days=d) for d in (-365, -30, 0, 30, 365)] + [None]
+    np.testing.assert_array_equal(sql.expiry_counts(edges), mem.expiry_counts(edges))
+
+
+def test_sqlite_state_recomputes_after_midnight(sqlite_store, clock):
+    store = sqlite_store[0]
+    state = store.state(store.view())
+    version = state.version
+    assert state.current() is state and state.version == version
+    clock[0] = clock[0] + pd.Timedelta(days=400)
+    assert state.current().version != version
+    later = anpp.BadgeState(sqlite_store[1])
+    assert (state.expired_count, state.expiring_count) == (later.expired_count, later.expiring_count)
+
+
+def test_perf_recorder_summary_histogram_and_dumps(tmp_path):
+    recorder = anpp.PerfRecorder(buckets=[1, 10, 100], samples=3)
+    for ms, rows, memory in [(0.5, 10, 4096), (5, None, None), (50, 5, -1024), (500, 1, 0)]:
+        recorder.record('search', ms / 1000, rows, memory)
+    recorder.record('show_details', 0.002)
+
+    summary = {row['operation']: row for row in recorder.summary()}
+    search = summary['search']
+    assert (search['count'], search['rows'], search['memory_delta']) == (4, 16, 3072)
+    assert search['histogram'] == [1, 1, 1, 1] and search['max_ms'] == 500
+    assert search['mean_ms'] == pytest.approx(555.5 / 4)
+    # Percentiles sur les derniers échantillons seulement (fenêtre de 3)
+    assert search['p50_ms'] == pytest.approx(50)
+    assert summary['show_details']['histogram'] == [0, 1, 0, 0]
+    assert recorder.bucket_labels() == ["≤1 ms", "≤10 ms", "≤100 ms", ">100 ms"]
+
+    recorder.dump(str(tmp_path / "perf.csv"))
+    log = pd.read_csv(tmp_path / "perf.csv")
+    assert list(log['operation']) == ['search', 'search', 'show_details']
+    assert log['rows'].isna().tolist() == [False, False, True]
+    recorder.dump(str(tmp_path / "perf.json"))
+    with open(tmp_path / "perf.json", encoding='utf-8') as f:
+        report = json.load(f)
+    assert report['buckets_ms'] == [1, 10, 100] and len(report['samples']) == 3
+    assert [op['operation'] for op in report['operations']] == ['search', 'show_details']
+
+
+def test_perf_span_records_on_error_and_profiles_once(tmp_path):
+    recorder = anpp.PerfRecorder()
+    with pytest.raises(KeyError):
+        with recorder.span('lookup') as span:
+            span.rows = 7
+            raise KeyError('x')
+    op = recorder.summary()[0]
+    assert (op['operation'], op['count'], op['rows']) == ('lookup', 1, 7)
+    assert recorder.profile_stats is None
+
+    # Profilage : un seul profileur actif, les spans imbriqués ne sont que chronométrés
+    recorder.profiling = True
+    with recorder.span('outer') as outer:
+        with recorder.span('inner') as inner:
+            sorted(range(1000), key=lambda value: -value)
+    assert outer.profiler is not None and inner.profiler is None and not recorder.profile_active
+    assert 'sorted' in recorder.profile_report()
+    assert recorder.dump_profile(str(tmp_path / "perf.prof")) and os.path.getsize(tmp_path / "perf.prof") > 0
+    assert {op['operation'] for op in recorder.summary()} == {'lookup', 'outer', 'inner'}
+
+
+def test_instrumented_method_records_rows(monkeypatch):
+    recorder = anpp.PerfRecorder()
+    monkeypatch.setattr(anpp, 'PERF', recorder)
+
+    class Table:
+        @anpp.instrumented('display_results', rows=lambda self, df: len(df))
+        def display(self, df):
+            """Affiche les lignes."""
+            return df.head(2)
+
+        @anpp.instrumented('show_details')
+        def details(self):
+            return 'ok'
+
+    table = Table()
+    assert len(table.display(pd.DataFrame({'a': range(5)}))) == 2
+    table.display(pd.DataFrame({'a': range(3)}))
+    assert table.details() == 'ok'
+    assert Table.display.__name__ == 'display' and Table.display.__doc__ == "Affiche les lignes."
+    summary = {row['operation']: row for row in recorder.summary()}
+    assert (summary['display_results']['count'], summary['display_results']['rows']) == (2, 8)
+    assert (summary['show_details']['count'], summary['show_details']['rows']) == (1, 0)
+
+
+def details_frame(today):
+    return pd.DataFrame({
+        'First_Name': ['Amine', 'Sara', None, 'Karim'], 'Last_Name': ['Alaoui', 'Bennani', 'Chraibi', None],
+        'External_System_ID': ['E1', 'E2', None, 'E4'], 'Internal_Number': [11, 12, 13, 14],
+        'Token_Status': [1, 0, 1, 1], 'VIP': [True, False, None, True], 'Site': ['Casa', 'Tanger', None, 'Casa'],
+        'Issue_Date': [today - pd.Timedelta(days=400)] * 4,
+        'Deactivation_Date': [today + pd.Timedelta(days=10), today + pd.Timedelta(days=200), pd.NaT,
+                              today - pd.Timedelta(days=3)],
+    }, index=[40, 41, 42, 43])
+
+
+def test_details_card_matches_row(clock):
+    df = details_frame(clock[0])
+    renderer = anpp.DetailsRenderer()
+    for label in df.index:
+        key, card = renderer.card(df, label)
+        assert key[0] == label
+        assert card == anpp.render_details(df.loc[label].to_dict(), clock[0])
+    card = renderer.card(df, 40)[1]
+    assert "Amine Alaoui" in card and "E1" in card and "Actif" in card and "Casa" in card
+    assert "10 jours (⚠ Expire bientôt!)" in card
+    # Lignes optionnelles absentes sans site ni échéance ; valeurs manquantes en N/A
+    card = renderer.card(df, 42)[1]
+    assert "Site:" not in card and "Jours restants:" not in card
+    assert anpp.details_line('VIP:', 'vip').format(vip='Non') in card
+    assert anpp.details_line('ID:', 'external_id').format(external_id='N/A') in card
+    assert "200 jours (✅ Valide)" in renderer.card(df, 41)[1]
+
+
+def test_details_cache_is_bounded_lru(clock, monkeypatch):
+    df = details_frame(clock[0])
+    renders = []
+    real = anpp.render_details
+    monkeypatch.setattr(anpp, 'render_details', lambda row, today: renders.append(row) or real(row, today))
+    renderer = anpp.DetailsRenderer(size=2)
+    renderer.card(df, 40)
+    renderer.card(df, 41)
+    assert renderer.card(df, 40)[1] is renderer.cards[(40, renderer.version, clock[0].date())]
+    renderer.card(df, 42)
+    # 41, le moins récemment utilisé, est sorti ; 40 est resté en cache
+    assert [key[0] for key in renderer.cards] == [40, 42] and len(renders) == 3
+    renderer.card(df, 40)
+    assert len(renders) == 3
+    renderer.card(df, 41)
+    assert len(renders) == 4 and len(renderer.cards) == 2
+
+
+def test_details_key_follows_data_and_day(clock):
+    df = details_frame(clock[0])
+    renderer = anpp.DetailsRenderer()
+    key, card = renderer.card(df, 40)
+    assert renderer.card(df, 40)[0] == key
+
+    # Nouvelles données : autre version, cache vidé, fiche relue
+    changed = df.assign(External_System_ID=['X1', 'E2', None, 'E4'])
+    new_key, new_card = renderer.card(changed, 40)
+    assert new_key[1] != key[1] and list(renderer.cards) == [new_key] and "X1" in new_card
+
+    # Lendemain : nouvelle clé, jours restants recalculés
+    clock[0] = clock[0] + pd.Timedelta(days=1)
+    next_key, next_card = renderer.card(changed, 40)
+    assert next_key[1:] == (new_key[1], clock[0].date()) and "9 jours" in next_card
+
+
+def test_details_read_lazy_views_by_label(clock):
+    df = details_frame(clock[0])
+    view = anpp.ChunkedFrame()
+    view.append(df.iloc[:2])
+    view.append(df.iloc[2:])
+    renderer = anpp.DetailsRenderer()
+    cards = [renderer.card(view, label)[1] for label in df.index]
+    assert renderer.arrays is None
+    assert cards == [anpp.DetailsRenderer().card(df, label)[1] for label in df.index]
+
+
+def test_site_workbooks_from_file_folder_and_glob(tmp_path):
+    for name in ["Rabat.xlsx", "Casa.xlsx", "~$Casa.xlsx", "notes.txt"]:
+        (tmp_path / name).write_bytes(b"")
+    expected = [str(tmp_path / "Casa.xlsx"), str(tmp_path / "Rabat.xlsx")]
+    assert anpp.site_workbooks(str(tmp_path)) == expected
+    assert anpp.site_workbooks(str(tmp_path / "*.xlsx")) == expected
+    assert anpp.site_workbooks(str(tmp_path / "R*.xlsx")) == expected[1:]
+    assert anpp.site_workbooks(str(tmp_path / "Casa.xlsx")) == expected[:1]
+    assert [anpp.site_name(path) for path in expected] == ['Casa', 'Rabat']
+
+
+def test_merge_sites_keeps_most_recent_badge():
+    day = pd.Timestamp('2026-01-01', tz='UTC')
+    casa = pd.DataFrame({'External_System_ID': ['A', 'B', 'C', None], 'Site': 'Casa',
+                         'ID_Modify_Time': [day, day, pd.NaT, day],
+                         'Token_Modify_Time': [day, day + pd.Timedelta(days=2), day, day]})
+    rabat = pd.DataFrame({'External_System_ID': ['B', 'A', 'C', None], 'Site': 'Rabat',
+                          'ID_Modify_Time': [day, day + pd.Timedelta(days=1), day, day],
+                          'Token_Modify_Time': [day + pd.Timedelta(days=1), day, day, day]})
+    merged = anpp.merge_sites([casa, rabat])
+    # A : fiche modifiée plus tard à Rabat ; B : égalité départagée par Token_Modify_Time ;
+    # C : date manquante à Casa ; sans identifiant : lignes toutes conservées, ordre d'origine
+    assert merged[['External_System_ID', 'Site']].astype(object).where(merged.notna(), None).values.tolist() == [
+        ['B', 'Casa'], [None, 'Casa'], ['A', 'Rabat'], ['C', 'Rabat'], [None, 'Rabat']]
+    assert list(merged.index) == list(range(5))
+    # Sans colonne de date, le dernier classeur l'emporte
+    plain = anpp.merge_sites([casa.drop(columns=anpp.SITE_RECENCY_COLUMNS), rabat.drop(columns=anpp.SITE_RECENCY_COLUMNS)])
+    assert plain.dropna(subset=['External_System_ID'])['Site'].tolist() == ['Rabat'] * 3
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_load_sites_merges_and_filters(tmp_path, jobs):
+    import bench_anpp
+    raw = bench_anpp.generate_badges(60, seed=9)
+    raw['External System ID'] = [f"EXT{i}" for i in range(len(raw))]
+    # Badges passés à Rabat : fiche modifiée plus tard, colonne Token Modify Time vide dans ce classeur
+    moved = raw.head(10).assign(**{'ID Modify Time': '01/01/2099 00:00:00Z', 'Token Modify Time': None})
+    bench_anpp.write_workbook(raw, str(tmp_path / "Casa.xlsx"))
+    bench_anpp.write_workbook(moved, str(tmp_path / "Rabat.xlsx"))
+
+    steps = []
+    paths = anpp.site_workbooks(str(tmp_path))
+    df = anpp.load_sites(paths, use_cache=False, jobs=jobs, progress=lambda done, total: steps.append((done, total)))
+    assert steps[0] == (0, 2) and steps[-1] == (2, 2)
+    assert len(df) == len(raw) and df['External_System_ID'].is_unique
+    # Dates restées des dates UTC après fusion, même la colonne vide d'un classeur
+    assert all(isinstance(df[col].dtype, pd.DatetimeTZDtype) for col in anpp.SITE_RECENCY_COLUMNS)
+    assert anpp.site_names(df) == ['Casa', 'Rabat']
+    rabat = anpp.filter_site(df, 'Rabat')
+    assert sorted(rabat['External_System_ID']) == sorted(moved['External System ID'].astype(str))
+    assert len(anpp.filter_site(df, 'Casa')) == len(raw) - len(moved)
+    assert anpp.filter_site(df, None) is df and len(anpp.filter_site(df, 'Fès')) == 0
+    assert anpp.site_names(df.drop(columns='Site')) == [] and anpp.filter_site(df.drop(columns='Site'), 'Casa').shape[0] == len(df)
+
+
+AGGREGATE_FILTERS = [{}, {'Token_Status': 1}, {'Type': 'Employé'}, {'Token_Status': 4, 'Issue_Level': 0},
+                     {'VIP': True}]
+
+
+@pytest.fixture
+def cube_frame(typed_frame):
+    return typed_frame.assign(VIP=np.array([True, False, None], dtype=object)[np.arange(len(typed_frame)) % 3])
+
+
+def grouped_events(df, event, filters):
+    # Référence : filtre et regroupement directs sur le DataFrame
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in filters.items():
+        mask &= (df[col] == value).fillna(False).to_numpy(dtype=bool)
+    dates = df.loc[mask, anpp.AGGREGATE_EVENTS[event]].dropna()
+    return dates.dt.tz_convert('UTC').dt.tz_localize(None).dt.normalize()
+
+
+@pytest.mark.parametrize('filters', AGGREGATE_FILTERS)
+def test_aggregate_cube_matches_groupby(cube_frame, filters, tmp_path):
+    aggregates = anpp.BadgeAggregates()
+    aggregates.add(cube_frame)
+    # Cube relu depuis le cache Parquet : mêmes réponses
+    path = str(tmp_path / "BADGES.xlsx")
+    with open(path, 'wb') as f:
+        f.write(b"classeur")
+    anpp.write_cache(path, cube_frame, aggregates.cube)
+    cached = anpp.BadgeAggregates()
+    cached.load(anpp.read_cube(path))
+
+    for event in anpp.AGGREGATE_EVENTS:
+        days = grouped_events(cube_frame, event, filters)
+        assert not days.empty
+        for year in range(2020, 2031):
+            start, stop = utc(f'{year}-01-01'), utc(f'{year + 1}-01-01')
+            expected = int(((days >= start.tz_localize(None)) & (days < stop.tz_localize(None))).sum())
+            assert aggregates.period_count(event, start, stop, **filters) == expected, (event, year)
+            assert cached.period_count(event, start, stop, **filters) == expected, (event, year)
+        start, stop = utc('2023-06-15'), utc('2025-03-17')
+        expected = int(((days >= start.tz_localize(None)) & (days < stop.tz_localize(None))).sum())
+        assert aggregates.period_count(event, start, stop, **filters) == expected
+
+        for freq in ['D', 'YS']:
+            series = aggregates.series(event, freq, **filters)
+            expected = pd.Series(1, index=pd.DatetimeIndex(days)).groupby(level=0).sum().resample(freq).sum()
+            pd.testing.assert_series_equal(series, expected, check_names=False, check_freq=False,
+                                           check_index_type=False)
+            pd.testing.assert_series_equal(cached.series(event, freq, **filters), series, check_freq=False,
+                                           check_index_type=False)